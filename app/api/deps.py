@@ -0,0 +1,92 @@
+# app/api/deps.py
+from fastapi import Depends, HTTPException, Request, Security, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from app.core.admission import AdmissionRejected, check_rate_limit
+from app.core.security import ANONYMOUS_USER_ID, TokenVerificationError, jwks_store, tokens_rejected_without_jwks, verify_token
+from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# auto_error=False: el token es opcional, sin él se procesa como 'No Login'
+bearer_scheme_optional = HTTPBearer(auto_error=False)
+
+
+async def _verified_user_id(token: str) -> Optional[str]:
+    """'sub' de un token verificado (None si no lo tiene). Lanza 401 si el token no es válido."""
+    try:
+        claims = await verify_token(token)
+    except TokenVerificationError as e:
+        logger.warning("Token Bearer rechazado: %s", e.detail)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Token proporcionado inválido: {e.detail}",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user_id = claims.get("sub") # o "user_id"
+    return str(user_id) if user_id else None
+
+
+async def get_optional_user_id(
+    token_credentials: Optional[HTTPAuthorizationCredentials] = Security(bearer_scheme_optional),
+) -> str:
+    """
+    Dependencia reutilizable por cualquier router: user_id ('sub') de un token Bearer verificado,
+    'No Login' si no se envía token. Lanza 401 si el token no es válido.
+    """
+    if not token_credentials or not token_credentials.credentials:
+        logger.debug("No se proporcionó Token Bearer. Procesando como 'No Login'.")
+        return ANONYMOUS_USER_ID
+    if not jwks_store.configured and not tokens_rejected_without_jwks():
+        # Sin JWKS el token no se puede verificar: su 'sub' no es de fiar (ver JWT_UNVERIFIABLE_TOKENS)
+        logger.debug("Token Bearer sin JWKS configurado para verificarlo. Procesando como 'No Login'.")
+        return ANONYMOUS_USER_ID
+
+    user_id = await _verified_user_id(token_credentials.credentials)
+    if not user_id:
+        # Token válido pero sin 'sub': se procesa como anónimo, como hasta ahora
+        logger.warning("Token presente pero sin claim 'sub' (user_id). Se procesará como 'No Login'.")
+        return ANONYMOUS_USER_ID
+    return user_id
+
+
+async def get_current_user_id(
+    token_credentials: Optional[HTTPAuthorizationCredentials] = Security(bearer_scheme_optional),
+) -> str:
+    """Como get_optional_user_id, pero para endpoints que exigen usuario: 401 sin token o sin 'sub'."""
+    if not token_credentials or not token_credentials.credentials:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Se requiere un token Bearer.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user_id = await _verified_user_id(token_credentials.credentials)
+    if not user_id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="El token no identifica a un usuario (claim 'sub').",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user_id
+
+
+def admit_request(request: Request, user_id: str, cost: int = 1) -> None:
+    """
+    Control de admisión: token bucket por 'sub' o, sin sesión, por IP del cliente (detrás de un proxy, arrancar
+    uvicorn con --proxy-headers para que sea la IP real). `cost` tokens, uno por huella. 429 con Retry-After si se agota.
+    """
+    try:
+        check_rate_limit(user_id, request.client.host if request.client else None, cost)
+    except AdmissionRejected as e:
+        logger.warning("Petición rechazada para %s: %s (Retry-After %ss).", user_id, e.reason, e.retry_after_header)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.detail,
+            headers={"Retry-After": e.retry_after_header},
+        )
+
+
+async def get_admitted_user_id(request: Request, user_id: str = Depends(get_optional_user_id)) -> str:
+    """get_optional_user_id más admit_request para una huella. Los lotes llaman a admit_request con su tamaño."""
+    admit_request(request, user_id)
+    return user_id
@@ -1,51 +1,45 @@
 # app/api/v1/endpoints/recommendations.py
-from fastapi import APIRouter, HTTPException, status, Body, Depends, Security
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi import APIRouter, HTTPException, Request, status, Body, Depends, Header, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from app.api.deps import admit_request, get_admitted_user_id, get_current_user_id, get_optional_user_id
+from app.core.admission import AdmissionRejected
 from app.api.v1.schemas.footprint import FootprintInputSchema
-from app.api.v1.schemas.recommendation import RecommendationOutputSchema
-from app.services.recommendation_service import get_recommendations_for_footprint
+from app.api.v1.schemas.recommendation import (
+    RecommendationHistoryPage,
+    RecommendationJobAccepted,
+    RecommendationJobStatus,
+    RecommendationOutputSchema,
+)
+from app.services.recommendation_service import get_recommendations_for_footprint, stream_recommendations_for_footprint
+from app.services.history_service import get_recommendation_history
+from app.services.job_service import get_job, submit_job
+from app.core.config import settings
+import asyncio
+import json
 import logging
-import jwt 
-from jose import jwt as jose_jwt
-from jose.exceptions import JWTError
-from typing import Optional # Importa Optional
+import math
+import uuid
+from typing import AsyncIterator, List, Literal, Optional
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Hacemos que el auto_error sea False para que no falle si no hay token
-oauth2_scheme_optional = HTTPBearer(auto_error=False)
+def _service_error_detail(result: RecommendationOutputSchema) -> Optional[str]:
+    """Devuelve el detalle del error si el servicio lo señaló (vía notas o recomendación global 'Error'), o None."""
+    if result.notes and ("error" in result.notes.lower() or "fallo" in result.notes.lower()):
+        logger.error("Recommendation service indicated an error via notes: %s", result.notes)
+        return f"Error al generar recomendaciones: {result.notes}"
+    if result.global_recommendation and result.global_recommendation.category.lower() == "error":
+        logger.error("Recommendation service returned an error via global recommendation: %s", result.global_recommendation.suggestion)
+        return f"Error al generar recomendaciones: {result.global_recommendation.suggestion}"
+    return None
 
 
-# Función simple para decodificar el token (SIN VALIDACIÓN DE FIRMA)
-# (Esta función ya la tienes, la mantengo igual)
-def decode_jwt_payload_insecure(token: str) -> dict | None:
-    try:
-        payload = jose_jwt.decode(
-            token,
-            key=None,
-            algorithms=["HS256", "RS256"],
-            options={
-                "verify_signature": False, "verify_aud": False, "verify_iat": False,
-                "verify_exp": False, "verify_nbf": False, "verify_iss": False,
-                "verify_sub": False, "require_exp": False, "require_iat": False,
-                "require_nbf": False,
-            }
-        )
-        return payload
-    except jwt.ExpiredSignatureError:
-        logger.warning("Token ha expirado (detectado por python-jwt, si se usara).")
-        # No relanzar HTTPException aquí si el token es opcional, manejarlo en el endpoint
-        return {"error": "token_expired"} # O alguna otra indicación
-    except jwt.InvalidTokenError as e:
-        logger.warning(f"Token inválido (detectado por python-jwt, si se usara): {e}")
-        return {"error": "invalid_token", "detail": str(e)}
-    except JWTError as e:
-        logger.warning(f"Error al decodificar token JWT con python-jose: {e}")
-        return {"error": "jwt_decode_error", "detail": str(e)}
-    except Exception as e:
-        logger.error(f"Error inesperado al decodificar token: {e}")
-        return {"error": "unexpected_decode_error", "detail": str(e)}
+# Motor por petición; si no se indica se usa RECOMMENDATION_ENGINE
+EngineQuery = Query(
+    None,
+    description='"gemini" (IA) o "local" (motor determinista, sin IA). Por defecto, el configurado en el servidor.',
+)
 
 
 @router.post(
@@ -57,71 +51,281 @@ def decode_jwt_payload_insecure(token: str) -> dict | None:
 )
 async def create_recommendations(
     footprint_data: FootprintInputSchema = Body(...),
-    token_credentials: Optional[HTTPAuthorizationCredentials] = Depends(oauth2_scheme_optional)
-) -> RecommendationOutputSchema:
-    logger.info("Received request to generate structured recommendations (optional auth).")
-
-    user_id_to_process: str = "No Login" # Valor por defecto
-
-    if token_credentials and token_credentials.credentials:
-        raw_token = token_credentials.credentials
-        logger.info("Token Bearer encontrado, intentando decodificar.")
-        decoded_payload = decode_jwt_payload_insecure(raw_token)
-
-        if decoded_payload:
-            if "error" in decoded_payload:
-
-                logger.error(f"Error al procesar el token proporcionado: {decoded_payload.get('detail')}")
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail=f"Token proporcionado inválido: {decoded_payload.get('detail', 'Error desconocido')}"
-                )
-
-            user_id_from_token = decoded_payload.get("sub") # o "user_id"
-            if user_id_from_token:
-                user_id_to_process = str(user_id_from_token)
-                logger.info(f"Token decodificado. Procesando para el usuario: {user_id_to_process}")
-            else:
-                # Token presente pero sin 'sub', esto podría ser un error si se espera 'sub'
-                logger.warning("Token presente pero sin claim 'sub' (user_id). Se procesará como 'No Login'.")
-        else:
-
-            logger.error("El token proporcionado no pudo ser decodificado (payload es None).")
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="El token proporcionado no pudo ser decodificado.")
-    else:
-        logger.info("No se proporcionó Token Bearer. Procesando como 'No Login'.")
-
-
-    logger.info(f"ID de usuario final para el servicio: {user_id_to_process}")
+    user_id_to_process: str = Depends(get_admitted_user_id),
+    engine: Optional[Literal["gemini", "local"]] = EngineQuery
+) -> Response:
+    logger.debug("Received request to generate structured recommendations (optional auth).")
+    logger.debug("ID de usuario final para el servicio: %s", user_id_to_process)
 
     try:
         # Pasar el user_id al servicio
         result = await get_recommendations_for_footprint(
             footprint_data=footprint_data,
-            user_id_from_token=user_id_to_process # Siempre pasamos el user_id_to_process
+            user_id_from_token=user_id_to_process, # Siempre pasamos el user_id_to_process
+            engine=engine
         )
 
         # (lógica de manejo de errores devueltos por el servicio - se mantiene igual)
-        if result.notes and ("error" in result.notes.lower() or "fallo" in result.notes.lower()):
-            logger.error(f"Recommendation service indicated an error via notes: {result.notes}")
+        error_detail = _service_error_detail(result)
+        if error_detail:
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail=f"Error al generar recomendaciones: {result.notes}"
-            )
-        if result.global_recommendation and result.global_recommendation.category.lower() == "error":
-            logger.error(f"Recommendation service returned an error via global recommendation: {result.global_recommendation.suggestion}")
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail=f"Error al generar recomendaciones: {result.global_recommendation.suggestion}"
+                detail=error_detail
             )
 
-        logger.info("Successfully generated and processed structured recommendations.")
-        return result
+        logger.debug("Successfully generated and processed structured recommendations.")
+        # JSON ya serializado (y validado): se evita que FastAPI vuelva a validar y serializar vía response_model
+        return Response(content=result.to_json(), media_type="application/json")
     except HTTPException as http_exc:
         raise http_exc
+    except AdmissionRejected as e:
+        # Gemini saturado: 429 rápido en lugar de esperar a un upstream que ya no da abasto
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.detail,
+            headers={"Retry-After": e.retry_after_header}
+        )
     except Exception as e:
         logger.exception("An unexpected error occurred during recommendation generation/saving.")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An internal server error occurred: {str(e)}",
-        )
\ No newline at end of file
+        )
+
+
+def _batch_error_line(index: int, status_code: int, detail: str) -> str:
+    return json.dumps(
+        {"index": index, "status": "error", "status_code": status_code, "detail": detail},
+        ensure_ascii=False, separators=(",", ":")
+    ) + "\n"
+
+
+async def _process_batch_item(
+    index: int,
+    footprint_data: FootprintInputSchema,
+    user_id: str,
+    semaphore: asyncio.Semaphore,
+    engine: Optional[str] = None
+) -> str:
+    """Procesa una huella del batch y devuelve su línea NDJSON (resultado o error, nunca lanza)."""
+    async with semaphore:
+        try:
+            result = await get_recommendations_for_footprint(
+                footprint_data=footprint_data,
+                user_id_from_token=user_id,
+                engine=engine
+            )
+        except AdmissionRejected as e:
+            return _batch_error_line(index, status.HTTP_429_TOO_MANY_REQUESTS, e.detail)
+        except Exception as e:
+            logger.exception("Unexpected error processing batch item %s.", index)
+            return _batch_error_line(index, status.HTTP_500_INTERNAL_SERVER_ERROR, f"An internal server error occurred: {str(e)}")
+
+    error_detail = _service_error_detail(result)
+    if error_detail:
+        return _batch_error_line(index, status.HTTP_503_SERVICE_UNAVAILABLE, error_detail)
+    # El resultado ya es JSON válido: se incrusta sin volver a parsearlo
+    return f'{{"index":{index},"status":"ok","result":{result.to_json().decode()}}}\n'
+
+
+async def _stream_batch_results(items: List[FootprintInputSchema], user_id: str, engine: Optional[str] = None) -> AsyncIterator[str]:
+    semaphore = asyncio.Semaphore(settings.BATCH_MAX_CONCURRENCY)
+    tasks = [
+        asyncio.create_task(_process_batch_item(index, item, user_id, semaphore, engine))
+        for index, item in enumerate(items)
+    ]
+    try:
+        # Cada línea se envía en cuanto termina su huella, sin esperar a la más lenta
+        for next_completed in asyncio.as_completed(tasks):
+            yield await next_completed
+    finally:
+        # Si el cliente se desconecta, no seguir gastando llamadas a Gemini
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+@router.post(
+    "/batch",
+    status_code=status.HTTP_200_OK,
+    summary="Generate Recommendations for Many Footprints (NDJSON stream, Optional Auth)",
+    description=(
+        "Accepts a JSON array of footprints and streams one NDJSON line per item as soon as it completes: "
+        '`{"index": i, "status": "ok", "result": {...}}` or `{"index": i, "status": "error", "status_code": ..., "detail": ...}`. '
+        "Items may arrive out of order; per-item errors never fail the whole batch."
+    ),
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def create_recommendations_batch(
+    request: Request,
+    footprints: List[FootprintInputSchema] = Body(...),
+    user_id_to_process: str = Depends(get_optional_user_id),
+    engine: Optional[Literal["gemini", "local"]] = EngineQuery
+) -> StreamingResponse:
+    if not footprints:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="El batch no contiene huellas.")
+    if len(footprints) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"El batch excede el máximo de {settings.BATCH_MAX_ITEMS} huellas por petición."
+        )
+    admit_request(request, user_id_to_process, cost=len(footprints)) # Un token por huella, no por petición
+
+    logger.info("Batch de %s huellas recibido para el usuario: %s", len(footprints), user_id_to_process)
+
+    return StreamingResponse(
+        _stream_batch_results(footprints, user_id_to_process, engine),
+        media_type="application/x-ndjson"
+    )
+
+
+def _sse_event(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+async def _stream_sse_events(footprint_data: FootprintInputSchema, user_id: str, engine: Optional[str] = None) -> AsyncIterator[str]:
+    try:
+        async for event, data in stream_recommendations_for_footprint(footprint_data, user_id, engine):
+            if event == "done":
+                error_detail = _service_error_detail(data)
+                if error_detail:
+                    yield _sse_event("error", json.dumps({"detail": error_detail}, ensure_ascii=False))
+                else:
+                    yield _sse_event("done", data.to_json().decode())
+            else:
+                yield _sse_event(event, json.dumps(data, ensure_ascii=False))
+    except Exception as e:
+        logger.exception("An unexpected error occurred during streaming recommendation generation.")
+        yield _sse_event("error", json.dumps({"detail": f"An internal server error occurred: {str(e)}"}, ensure_ascii=False))
+
+
+@router.post(
+    "/stream",
+    status_code=status.HTTP_200_OK,
+    summary="Stream Structured Recommendations as Server-Sent Events (Optional Auth)",
+    description=(
+        "Same input as `POST /`, but the response is a `text/event-stream`. Events are sent as soon as each part "
+        "of the AI response is complete: `global_recommendation`, then `transport`, `food`, `energy` and `waste` "
+        "(each a list of suggestions), and finally `done` with the full `RecommendationOutputSchema` once it has been "
+        "saved, or `error` with a `detail`."
+    ),
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}},
+)
+async def stream_recommendations(
+    footprint_data: FootprintInputSchema = Body(...),
+    user_id_to_process: str = Depends(get_admitted_user_id),
+    engine: Optional[Literal["gemini", "local"]] = EngineQuery
+) -> StreamingResponse:
+    logger.debug("Streaming de recomendaciones solicitado para el usuario: %s", user_id_to_process)
+
+    return StreamingResponse(
+        _stream_sse_events(footprint_data, user_id_to_process, engine),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Sin buffering en proxies (nginx)
+    )
+
+
+@router.get(
+    "/history",
+    response_model=RecommendationHistoryPage,
+    status_code=status.HTTP_200_OK,
+    summary="Paginated Recommendation History of the Authenticated User",
+    description=(
+        "Returns the stored recommendations of the token's `sub`, newest first. Pass `next_cursor` back as `cursor` "
+        "to get the following page. Responses carry an `ETag`; send it in `If-None-Match` to get a `304 Not Modified` "
+        "when the page has not changed."
+    ),
+    responses={304: {"description": "The page has not changed since the ETag sent in If-None-Match."}},
+)
+async def read_recommendation_history(
+    user_id: str = Depends(get_current_user_id),
+    limit: int = Query(settings.HISTORY_PAGE_SIZE, ge=1, le=settings.HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="`next_cursor` de la página anterior."),
+    if_none_match: Optional[str] = Header(None)
+) -> Response:
+    try:
+        page = await get_recommendation_history(user_id, limit, cursor, if_none_match)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if page is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="El historial no está disponible en este momento (base de datos)."
+        )
+
+    # private: contiene datos del usuario; no-cache: el cliente puede guardarla pero debe revalidar con el ETag
+    headers = {"ETag": page.etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if page.not_modified:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=page.body, media_type="application/json", headers=headers)
+
+
+@router.post(
+    "/jobs",
+    response_model=RecommendationJobAccepted,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Queue a Recommendation Job (202 Accepted, Optional Auth)",
+    description=(
+        "Same input as `POST /`, but the work is queued and the response returns immediately with the job `id` "
+        "(also in the `Location` header). Poll `GET /jobs/{id}` until `status` is `succeeded` or `failed`. "
+        "Jobs of authenticated users are processed before anonymous ones."
+    ),
+)
+async def create_recommendation_job(
+    request: Request,
+    footprint_data: FootprintInputSchema = Body(...),
+    user_id_to_process: str = Depends(get_admitted_user_id),
+    engine: Optional[Literal["gemini", "local"]] = EngineQuery
+) -> JSONResponse:
+    if not settings.JOBS_ENABLED:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="El modo asíncrono no está activado en este servidor (JOBS_ENABLED)."
+        )
+    job_id = await submit_job(footprint_data, user_id_to_process, engine)
+    if job_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="No se pudo encolar el trabajo en este momento (base de datos)."
+        )
+
+    status_url = request.url_for("read_recommendation_job", job_id=job_id).path
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={"id": job_id, "status": "queued", "status_url": status_url},
+        headers={"Location": status_url},
+    )
+
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=RecommendationJobStatus,
+    status_code=status.HTTP_200_OK,
+    summary="Status or Result of a Recommendation Job",
+    description=(
+        "`status` is `queued`, `running`, `succeeded` (with `result`) or `failed` (with `error`). While the job is "
+        "pending the response carries `Retry-After` with the suggested polling interval. Jobs created with a token "
+        "are only visible with a token for the same user."
+    ),
+    responses={404: {"description": "Unknown job, or a job that belongs to another user."}},
+)
+async def read_recommendation_job(
+    job_id: uuid.UUID,
+    user_id: str = Depends(get_optional_user_id)
+) -> Response:
+    try:
+        job = await get_job(str(job_id), user_id)
+    except LookupError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trabajo no encontrado.")
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="El estado del trabajo no está disponible en este momento (base de datos)."
+        )
+
+    headers = {"Cache-Control": "no-store"}
+    if not job.finished:
+        headers["Retry-After"] = str(max(1, math.ceil(settings.JOBS_POLL_INTERVAL)))
+    return Response(content=job.body, media_type="application/json", headers=headers)
@@ -1,23 +1,135 @@
 # app/api/v1/schemas/recommendation.py
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, model_validator
+from typing import Any, List, Literal, Optional
+from datetime import date, datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+SUGGESTIONS_PER_CATEGORY = 2
 
 # Modelo para la recomendación global (y potencialmente para un error genérico)
 class FullRecommendation(BaseModel):
+    model_config = ConfigDict(frozen=True) # Inmutable: las instancias de error se comparten entre peticiones
+
     category: str = Field(..., description="La categoría de la recomendación, ej: Transporte, General.")
     suggestion: str = Field(..., description="El texto de la recomendación, incluyendo una breve explicación.")
 
 # Nuevo modelo para las sugerencias específicas por categoría (solo 'suggestion')
 class CategorySpecificSuggestion(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     suggestion: str = Field(..., description="El texto de la recomendación específica para la categoría, incluyendo su explicación.")
 
+
+def normalize_category_suggestions(category: str, items: Any) -> List[Any]:
+    """
+    Deja la lista cruda de una categoría en exactamente SUGGESTIONS_PER_CATEGORY elementos: descarta los que
+    no son {"suggestion": ...}, rellena con un texto por defecto si faltan y trunca si sobran.
+    """
+    suggestions: List[Any] = []
+    if isinstance(items, list): # Lista de objetos {suggestion: "..."}
+        for item in items:
+            if isinstance(item, CategorySpecificSuggestion):
+                suggestions.append(item)
+            elif isinstance(item, dict) and "suggestion" in item:
+                suggestions.append({"suggestion": str(item["suggestion"])})
+            else:
+                logger.warning("Skipping invalid item in '%s' suggestions (expected {'suggestion': ...}): %s", category, item)
+            if len(suggestions) == SUGGESTIONS_PER_CATEGORY: # Truncar si hay demasiadas (aunque el prompt pide 2)
+                break
+    else:
+        logger.warning("Expected a list for '%s' recommendations, got: %s", category, type(items))
+
+    # Rellenar si no hay suficientes sugerencias para cumplir con el "exactamente dos"
+    # Esto es importante si Gemini no sigue las instrucciones al pie de la letra.
+    while len(suggestions) < SUGGESTIONS_PER_CATEGORY:
+        logger.warning("Not enough suggestions for '%s', padding with default.", category)
+        suggestions.append({"suggestion": f"No specific suggestion provided by AI for {category} (slot {len(suggestions) + 1})."})
+    return suggestions
+
+
 class RecommendationsByCategory(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     transport: List[CategorySpecificSuggestion] = Field(..., description="Sugerencias para Transporte.")
     food: List[CategorySpecificSuggestion] = Field(..., description="Sugerencias para Alimentación.")
     energy: List[CategorySpecificSuggestion] = Field(..., description="Sugerencias para Consumo Energético.")
     waste: List[CategorySpecificSuggestion] = Field(..., description="Sugerencias para Generación de Residuos.")
 
-class RecommendationOutputSchema(BaseModel):
+    # El relleno y el truncado se aplican durante la validación: el JSON de Gemini se valida en una sola pasada.
+    # A nivel de modelo (y no de campo) para rellenar también las categorías ausentes sin dejar de
+    # marcarlas como obligatorias en el response schema que se envía a Gemini.
+    @model_validator(mode="before")
+    @classmethod
+    def _exactly_two_per_category(cls, data: Any) -> Any:
+        if not isinstance(data, dict):
+            return data
+        return {**data, **{category: normalize_category_suggestions(category, data.get(category)) for category in cls.model_fields}}
+
+# Contrato de salida que se le pide al modelo de IA (se usa como response schema de Gemini).
+# No incluye 'notes', que es un campo propio de la API.
+class RecommendationGenerationSchema(BaseModel):
     global_recommendation: FullRecommendation = Field(..., description="Una recomendación general de alto impacto.")
     category_recommendations: RecommendationsByCategory = Field(..., description="Dos sugerencias específicas para cada categoría principal.")
-    notes: Optional[str] = None
\ No newline at end of file
+
+# Respuesta de cada prompt por categoría en el modo GEMINI_PARALLEL_CATEGORIES. El relleno y truncado a dos
+# sugerencias lo aplica RecommendationsByCategory al unir las cinco respuestas.
+class CategoryGenerationSchema(BaseModel):
+    suggestions: List[CategorySpecificSuggestion] = Field(..., description="Dos sugerencias específicas para la categoría.")
+
+class RecommendationOutputSchema(RecommendationGenerationSchema):
+    notes: Optional[str] = None
+
+    # JSON ya serializado: se reutiliza para la respuesta HTTP, la fila de la BD, el webhook y la caché
+    _json: Optional[bytes] = PrivateAttr(default=None)
+
+    @classmethod
+    def from_json(cls, payload: str | bytes, reuse_text: bool = True) -> "RecommendationOutputSchema":
+        """
+        Valida un JSON (p. ej. de la caché) y conserva el texto original como serialización. Con `reuse_text=False`
+        se descarta y to_json() vuelve a serializar: para textos que no salieron tal cual de to_json(), como el
+        JSONB que devuelve Postgres (claves reordenadas y otros espacios), que cambiaría los bytes de la respuesta.
+        """
+        output = cls.model_validate_json(payload)
+        if reuse_text:
+            output._json = payload.encode() if isinstance(payload, str) else payload
+        return output
+
+    def to_json(self) -> bytes:
+        """JSON compacto del objeto, calculado una sola vez mientras no cambien las notas."""
+        if self._json is None:
+            self._json = self.__pydantic_serializer__.to_json(self)
+        return self._json
+
+    def add_note(self, note: str) -> None:
+        """Añade una nota (separada por ' | ') e invalida la serialización guardada."""
+        self.notes = f"{self.notes} | {note}" if self.notes else note
+        self._json = None
+
+
+# Historial (GET /history). Solo documenta la respuesta: el endpoint incrusta el JSON guardado sin revalidarlo.
+class RecommendationHistoryItem(BaseModel):
+    id: int
+    calculation_date: date
+    recommendations: Optional[RecommendationOutputSchema] = None
+
+class RecommendationHistoryPage(BaseModel):
+    items: List[RecommendationHistoryItem]
+    next_cursor: Optional[str] = Field(None, description="Cursor para la página siguiente; null si no hay más.")
+
+
+# Trabajos asíncronos (POST /jobs y GET /jobs/{id}). Como el historial, solo documentan las respuestas.
+class RecommendationJobAccepted(BaseModel):
+    id: str
+    status: Literal["queued"] = "queued"
+    status_url: str = Field(..., description="URL que consultar (GET) hasta que el trabajo termine.")
+
+class RecommendationJobStatus(BaseModel):
+    id: str
+    status: Literal["queued", "running", "succeeded", "failed"]
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+    result: Optional[RecommendationOutputSchema] = Field(None, description="Presente cuando status es 'succeeded'.")
@@ -0,0 +1,418 @@
+# app/cli/backfill.py
+# Regeneración masiva de recomendaciones (p. ej. tras cambiar el prompt) sin pasar por la API HTTP.
+# Lee huellas (FootprintInputSchema más un `user_id` opcional) de un NDJSON o un CSV en streaming, las pasa
+# por prompt, Gemini y parseo con concurrencia acotada y un ritmo máximo, y guarda las filas en
+# user_recommendations por lotes. Sin caché, sin webhook y sin la consulta de reenvíos idempotentes.
+#
+# El progreso vive en un fichero de checkpoint (por defecto <entrada>.checkpoint). Cada resultado de Gemini se
+# anota en él antes de ir a la BD, así que un proceso matado a mitad se retoma donde se quedó: las huellas ya
+# generadas se insertan desde el checkpoint sin volver a pagar la llamada. Las que fallaron en Gemini no se
+# anotan y se reintentan en la siguiente ejecución.
+#
+# Uso (desde la raíz del repo):
+#   python -m app.cli.backfill huellas.ndjson [--format csv] [--concurrency 8] [--rate 5] [--batch-size 100]
+# En CSV las columnas son `user_id`, `date`, `result` y una por hábito con la forma `energy.applianceHours`.
+from app.api.v1.schemas.footprint import FootprintInputSchema
+from app.api.v1.schemas.recommendation import RecommendationOutputSchema
+from app.core.admission import AdmissionRejected, TokenBucket
+from app.core.gemini_client import warm_gemini_client
+from app.core.logging_config import setup_logging
+from app.core.security import ANONYMOUS_USER_ID
+from app.db.database import build_insert_params, close_db_pool, get_db_pool_stats, insert_recommendations_batch, open_db_pool
+from app.services.recommendation_service import (
+    engine_name, footprint_date, generate_output, idempotency_fingerprint, is_error_output,
+)
+from datetime import date
+from pydantic import ValidationError
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import signal
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object() # Centinela: el lector ya no tiene más huellas para los workers
+_PROGRESS_LOG_SECONDS = 30.0
+
+
+class BackfillProgress:
+    """
+    Registros de la entrada ya resueltos (generados o descartados por inválidos). Como se terminan casi en
+    orden, se guarda `watermark` (el primer registro pendiente: los anteriores están hechos) más los sueltos
+    por encima de él. Los registros se numeran desde 1.
+    """
+
+    def __init__(self, watermark: int = 1, ahead: Optional[List[int]] = None):
+        self.watermark = watermark
+        self.ahead = set(ahead or ())
+
+    def done(self, record: int) -> bool:
+        return record < self.watermark or record in self.ahead
+
+    def mark(self, record: int) -> None:
+        if record < self.watermark:
+            return
+        self.ahead.add(record)
+        while self.watermark in self.ahead:
+            self.ahead.remove(self.watermark)
+            self.watermark += 1
+
+    @property
+    def resolved(self) -> int:
+        return self.watermark - 1 + len(self.ahead)
+
+    def to_dict(self) -> dict:
+        return {"watermark": self.watermark, "ahead": sorted(self.ahead)}
+
+
+class BackfillCheckpoint:
+    """
+    Diario append-only en NDJSON. La primera línea es el progreso ({"source", "progress"}); después van los
+    resultados generados que aún no están en la BD ({"record", "row"}) y los registros descartados
+    ({"record", "skipped"}). Tras cada lote insertado el fichero se reescribe de forma atómica solo con el
+    progreso y las filas pendientes, así no crece con la entrada. Una última línea cortada (proceso matado a
+    mitad de escribirla) se ignora al cargar.
+    """
+
+    def __init__(self, path: str, source: str):
+        self.path = path
+        self.source = source
+        self.progress = BackfillProgress()
+        self._file = None
+
+    def open(self) -> List[Tuple[int, dict]]:
+        """Carga el checkpoint si existe y devuelve las filas generadas que faltan por insertar."""
+        pending: Dict[int, dict] = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning("Línea incompleta ignorada en el checkpoint %s.", self.path)
+                        continue
+                    if "progress" in entry:
+                        if entry.get("source") != self.source:
+                            raise ValueError(f"El checkpoint {self.path} es de otra entrada ({entry.get('source')}).")
+                        self.progress = BackfillProgress(**entry["progress"])
+                    elif "row" in entry:
+                        pending[entry["record"]] = entry["row"]
+                        self.progress.mark(entry["record"])
+                    elif "skipped" in entry:
+                        self.progress.mark(entry["record"])
+            logger.info(
+                "Checkpoint cargado: %s registros resueltos, %s filas pendientes de insertar.",
+                self.progress.resolved, len(pending)
+            )
+        rows = sorted(pending.items())
+        self.compact(rows) # Parte de un fichero limpio (sin una posible línea cortada al final)
+        return rows
+
+    def _append(self, entry: dict) -> None:
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._file.flush() # Al SO: sobrevive a que maten el proceso
+
+    def append_row(self, record: int, row: dict) -> None:
+        self.progress.mark(record)
+        self._append({"record": record, "row": row})
+
+    def append_skipped(self, record: int, reason: str) -> None:
+        self.progress.mark(record)
+        self._append({"record": record, "skipped": reason})
+
+    def compact(self, pending: List[Tuple[int, dict]]) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"source": self.source, "progress": self.progress.to_dict()}) + "\n")
+            for record, row in pending:
+                f.write(json.dumps({"record": record, "row": row}, ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is not None:
+            self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _csv_record(row: Dict[str, str]) -> dict:
+    """Fila CSV plana (`energy.applianceHours`, ...) a la forma anidada de FootprintInputSchema; vacío = por defecto."""
+    raw: dict = {}
+    for column, value in row.items():
+        if column is None or value is None or value == "":
+            continue
+        section, _, field = column.partition(".")
+        if field:
+            raw.setdefault(section, {})[field] = value
+        else:
+            raw[column] = value
+    return raw
+
+
+def iter_records(path: str, fmt: str, skip: Callable[[int], bool]) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Recorre la entrada en streaming y produce (registro, huella en bruto, error); una línea en blanco sale como
+    (registro, None, None). El registro es el número de línea (NDJSON) o de fila de datos (CSV), estable entre
+    ejecuciones; los que `skip` da por hechos no se parsean.
+    """
+    with open(path, newline="" if fmt == "csv" else None, encoding="utf-8") as f:
+        if fmt == "csv":
+            for record, row in enumerate(csv.DictReader(f), 1):
+                if not skip(record):
+                    yield record, _csv_record(row), None
+            return
+        for record, line in enumerate(f, 1):
+            if skip(record):
+                continue
+            if not line.strip():
+                yield record, None, None
+                continue
+            try:
+                raw = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield record, None, f"JSON no válido: {e}"
+                continue
+            if not isinstance(raw, dict):
+                yield record, None, "La línea no es un objeto JSON."
+                continue
+            yield record, raw, None
+
+
+class BackfillRunner:
+    """Lector en streaming, `concurrency` workers (prompt, Gemini y parseo) y un escritor por lotes."""
+
+    def __init__(
+        self,
+        path: str,
+        fmt: str,
+        checkpoint: BackfillCheckpoint,
+        concurrency: int,
+        rate: float,
+        batch_size: int,
+        engine: str,
+        default_user_id: str
+    ):
+        self.path = path
+        self.fmt = fmt
+        self.checkpoint = checkpoint
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.engine = engine
+        self.default_user_id = default_user_id
+        self._bucket = TokenBucket(rate, max(1.0, rate)) if rate > 0 else None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2) # Acota lo leído por delante de los workers
+        self._buffer: List[Tuple[int, dict]] = []
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self.db_failed = False
+        self.started_at = time.monotonic()
+        self.generated = 0
+        self.failed = 0
+        self.skipped = 0
+        self.written = 0
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopping
+
+    def stop(self, reason: str) -> None:
+        """Deja de leer; los workers terminan la huella en curso y se vuelca lo pendiente."""
+        if not self._stopping:
+            logger.warning("Deteniendo el backfill: %s", reason)
+        self._stopping = True
+
+    async def run(self) -> None:
+        self._buffer = self.checkpoint.open()
+        await self._flush() # Filas de una ejecución anterior que no llegaron a la BD
+        reporter = asyncio.create_task(self._report(), name="backfill-progress")
+        workers = [asyncio.create_task(self._worker(), name=f"backfill-worker-{i}") for i in range(self.concurrency)]
+        try:
+            await self._read()
+            await asyncio.gather(*workers)
+            await self._flush()
+        finally:
+            for task in workers:
+                task.cancel()
+            reporter.cancel()
+            self.checkpoint.close()
+        self._log_progress("Backfill terminado" if not self._stopping else "Backfill detenido")
+
+    async def _read(self) -> None:
+        for record, raw, error in iter_records(self.path, self.fmt, self.checkpoint.progress.done):
+            if self._stopping:
+                break
+            if error is not None:
+                self._skip(record, error)
+                continue
+            if raw is None:
+                self.checkpoint.progress.mark(record) # Línea en blanco
+                continue
+            user_id = str(raw.pop("user_id", None) or self.default_user_id)
+            try:
+                footprint_data = FootprintInputSchema.model_validate(raw)
+                footprint_date(footprint_data)
+            except (ValidationError, ValueError) as e:
+                self._skip(record, str(e).splitlines()[0])
+                continue
+            await self._queue.put((record, user_id, footprint_data))
+        for _ in range(self.concurrency):
+            await self._queue.put(_STOP)
+
+    def _skip(self, record: int, reason: str) -> None:
+        # Descarte definitivo (la entrada no es válida): se anota para no volver a leerlo
+        logger.warning("Registro %s descartado: %s", record, reason)
+        self.skipped += 1
+        self.checkpoint.append_skipped(record, reason)
+
+    async def _worker(self) -> None:
+        while True:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+            if self._stopping:
+                continue # Sin anotar: se procesará en la siguiente ejecución
+            await self._process(*item)
+
+    async def _throttle(self) -> None:
+        if self._bucket is None:
+            return
+        while True:
+            wait = self._bucket.try_acquire(time.monotonic())
+            if wait == 0.0:
+                return
+            await asyncio.sleep(wait)
+
+    async def _process(self, record: int, user_id: str, footprint_data: FootprintInputSchema) -> None:
+        while True:
+            if self.engine != "local":
+                await self._throttle()
+            try:
+                output, engine, _ = await generate_output(footprint_data, self.engine)
+                break
+            except AdmissionRejected as e:
+                # Compuerta de Gemini llena (más workers que GEMINI_MAX_CONCURRENCY): se espera y se reintenta
+                await asyncio.sleep(e.retry_after)
+
+        if is_error_output(output):
+            self.failed += 1
+            notes = output.notes if output is not None else "sin respuesta"
+            logger.warning("Registro %s sin recomendaciones válidas (%s); se reintentará en la próxima ejecución.", record, notes)
+            return
+
+        row = {
+            "user_id": user_id,
+            "calculation_date": footprint_date(footprint_data).isoformat(),
+            "payload": output.to_json().decode(),
+            "input_fingerprint": idempotency_fingerprint(footprint_data, user_id, engine),
+        }
+        # Primero al checkpoint: desde aquí la llamada a Gemini ya no se repite aunque el proceso muera
+        self.checkpoint.append_row(record, row)
+        self._buffer.append((record, row))
+        self.generated += 1
+        if len(self._buffer) >= self.batch_size:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        async with self._flush_lock:
+            if not self._buffer or self.db_failed:
+                return
+            batch, self._buffer = self._buffer, []
+            # Con el upsert, una misma (usuario, fecha, huella) no puede aparecer dos veces en el INSERT: gana la última
+            unique: Dict[tuple, tuple] = {}
+            for record, row in batch:
+                key = (row["user_id"], row["calculation_date"], row["input_fingerprint"] or f"#{record}")
+                unique[key] = build_insert_params(
+                    row["user_id"],
+                    date.fromisoformat(row["calculation_date"]),
+                    RecommendationOutputSchema.from_json(row["payload"]),
+                    row["input_fingerprint"]
+                )
+            if not await insert_recommendations_batch(list(unique.values())):
+                # Las filas siguen en el checkpoint: la próxima ejecución las inserta sin volver a llamar a Gemini
+                self._buffer = batch + self._buffer
+                self.db_failed = True
+                self.stop("no se pudo insertar el lote en la base de datos.")
+                return
+            self.written += len(unique) # Las filas repetidas del lote se fundieron en una
+            self.checkpoint.compact(self._buffer)
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(_PROGRESS_LOG_SECONDS)
+            self._log_progress("Progreso")
+
+    def _log_progress(self, label: str) -> None:
+        elapsed = time.monotonic() - self.started_at
+        logger.info(
+            "%s: %s generadas (%.1f/s), %s guardadas, %s fallidas, %s descartadas en %.0fs.",
+            label, self.generated, self.generated / elapsed, self.written, self.failed, self.skipped, elapsed
+        )
+
+
+def _detect_format(path: str) -> str:
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+async def main_async(args: argparse.Namespace) -> int:
+    engine = engine_name(args.engine)
+    if engine == "gemini" and not await warm_gemini_client():
+        logger.error("No se pudo inicializar el cliente de Gemini.")
+        return 2
+    await open_db_pool()
+    if not get_db_pool_stats()["open"]:
+        logger.error("El backfill necesita la base de datos (AWS_RDS_URL o DB_HOST/USER/...).")
+        return 2
+
+    path = os.path.abspath(args.input)
+    checkpoint = BackfillCheckpoint(args.checkpoint or f"{args.input}.checkpoint", path)
+    runner = BackfillRunner(
+        path=path,
+        fmt=args.format or _detect_format(path),
+        checkpoint=checkpoint,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        batch_size=args.batch_size,
+        engine=engine,
+        default_user_id=args.user_id,
+    )
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, runner.stop, f"señal {sig.name}; se puede retomar con el mismo checkpoint.")
+    try:
+        await runner.run()
+    except ValueError as e:
+        logger.error(str(e))
+        return 2
+    finally:
+        await close_db_pool()
+    return 1 if runner.stopped else 0 # Detenido (señal o BD): queda trabajo por hacer
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Regenera recomendaciones en bloque desde un NDJSON o CSV de huellas")
+    parser.add_argument("input", help="Fichero de huellas (.ndjson/.jsonl o .csv)")
+    parser.add_argument("--format", choices=("ndjson", "csv"), help="Por defecto, según la extensión")
+    parser.add_argument("--checkpoint", help="Fichero de progreso (por defecto <input>.checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Huellas en curso a la vez (no más que GEMINI_MAX_CONCURRENCY)")
+    parser.add_argument("--rate", type=float, default=5.0, help="Huellas por segundo como máximo hacia Gemini (0 = sin límite)")
+    parser.add_argument("--batch-size", type=int, default=100, help="Filas por INSERT en user_recommendations")
+    parser.add_argument("--engine", choices=("gemini", "local"), help="Por defecto RECOMMENDATION_ENGINE")
+    parser.add_argument("--user-id", default=ANONYMOUS_USER_ID, help="user_id de los registros que no traen el suyo")
+    args = parser.parse_args()
+
+    setup_logging()
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
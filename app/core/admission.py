@@ -0,0 +1,190 @@
+# app/core/admission.py
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+from app.core.config import settings
+from app.core.metrics import ADMISSION_REJECTIONS, GEMINI_GATE_IN_FLIGHT, GEMINI_GATE_QUEUE_DEPTH
+from app.core.security import ANONYMOUS_USER_ID
+import asyncio
+import math
+import time
+
+
+class AdmissionRejected(Exception):
+    """La petición no se admite ahora: el llamador debe responder 429 con Retry-After = `retry_after` segundos."""
+
+    def __init__(self, reason: str, retry_after: float, detail: str):
+        super().__init__(detail)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.detail = detail
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """
+    Cubo de tokens: `rate` tokens por segundo hasta un máximo de `burst`. Cada petición admitida gasta `cost`
+    (uno por huella). Nunca queda en negativo: un coste mayor que `burst` no cabe y no se admite.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def try_acquire(self, now: float, cost: float = 1.0) -> float:
+        """
+        Gasta `cost` tokens si hay. Devuelve 0 si se admite, o los segundos hasta que haya bastantes; infinito si
+        `cost` es mayor que `burst` (no cabe nunca: el llamador debe rechazarlo o dividirlo).
+        """
+        if cost > self.burst:
+            return math.inf
+        wait = self.time_until(now, cost)
+        if wait == 0.0:
+            self.tokens -= cost
+        return wait
+
+    def time_until(self, now: float, cost: float) -> float:
+        """Segundos hasta que haya `cost` tokens (como mucho `burst`), sin gastarlos."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return max(0.0, (min(cost, self.burst) - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """
+    Un TokenBucket por clave (usuario o IP) en una LRU acotada a `max_keys`: una clave expulsada vuelve
+    con el cubo lleno, lo que solo favorece a claves inactivas hace tiempo.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: float, max_keys: int):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.admitted = 0
+        self.rejected = 0
+
+    def check(self, key: str, cost: float = 1.0) -> None:
+        """Admite la petición de `key` (que cuesta `cost` tokens) o lanza AdmissionRejected."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+
+        if cost > self.burst:
+            # No cabría nunca: se rechaza sin gastar tokens. Retry-After es cuando el cubo esté lleno y admita un
+            # lote de `burst` huellas
+            self.rejected += 1
+            ADMISSION_REJECTIONS.labels("cost_above_burst").inc()
+            raise AdmissionRejected(
+                "cost_above_burst", bucket.time_until(time.monotonic(), cost),
+                f"El lote de {cost:g} huellas supera el límite por usuario ({self.burst:g} seguidas): divídelo en lotes más pequeños."
+            )
+        wait = bucket.try_acquire(time.monotonic(), cost)
+        if wait == 0.0:
+            self.admitted += 1
+            return
+        self.rejected += 1
+        ADMISSION_REJECTIONS.labels("rate_limited").inc()
+        raise AdmissionRejected("rate_limited", wait, "Demasiadas peticiones: límite por usuario alcanzado.")
+
+    def stats(self) -> dict:
+        return {"keys": len(self._buckets), "admitted": self.admitted, "rejected": self.rejected}
+
+
+class ConcurrencyGate:
+    """
+    Límite global de llamadas simultáneas a un upstream (cuota de Gemini) con una cola de espera acotada.
+    Con todos los huecos ocupados se espera como mucho `max_wait` segundos; si ya hay `max_queue` peticiones
+    esperando, o se agota la espera, se rechaza enseguida en lugar de acumular trabajo sobre un upstream saturado.
+    """
+
+    def __init__(self, limit: int, max_queue: int, max_wait: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.rejected_queue_full += 1
+                ADMISSION_REJECTIONS.labels("gemini_queue_full").inc()
+                raise AdmissionRejected("gemini_queue_full", self.max_wait, "Servicio de IA saturado: cola de espera llena.")
+            self._set_waiting(+1)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                ADMISSION_REJECTIONS.labels("gemini_queue_timeout").inc()
+                raise AdmissionRejected("gemini_queue_timeout", self.max_wait, "Servicio de IA saturado: tiempo de espera agotado.")
+            finally:
+                self._set_waiting(-1)
+        else:
+            await self._semaphore.acquire()
+
+        self.in_flight += 1
+        GEMINI_GATE_IN_FLIGHT.inc()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            GEMINI_GATE_IN_FLIGHT.dec()
+            self._semaphore.release()
+
+    def _set_waiting(self, delta: int) -> None:
+        self.waiting += delta
+        GEMINI_GATE_QUEUE_DEPTH.set(self.waiting)
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_queue": self.max_queue,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+        }
+
+
+user_rate_limiter = RateLimiter(
+    rate_per_minute=settings.RATE_LIMIT_PER_MINUTE,
+    burst=settings.RATE_LIMIT_BURST,
+    max_keys=settings.RATE_LIMIT_MAX_KEYS,
+)
+gemini_gate = ConcurrencyGate(
+    limit=settings.GEMINI_MAX_CONCURRENCY,
+    max_queue=settings.GEMINI_MAX_QUEUE,
+    max_wait=settings.GEMINI_QUEUE_TIMEOUT_SECONDS,
+)
+
+
+def check_rate_limit(user_id: str, client_ip: Optional[str], cost: float = 1.0) -> None:
+    """Token bucket por usuario ('sub') o, para peticiones 'No Login', por IP del cliente. `cost`: huellas pedidas."""
+    if not settings.RATE_LIMIT_ENABLED:
+        return
+    key = f"ip:{client_ip or 'unknown'}" if user_id == ANONYMOUS_USER_ID else f"user:{user_id}"
+    user_rate_limiter.check(key, cost)
+
+
+def get_admission_stats() -> dict:
+    return {
+        "rate_limit_enabled": settings.RATE_LIMIT_ENABLED,
+        "rate_limiter": user_rate_limiter.stats(),
+        "gemini_gate": gemini_gate.stats(),
+    }
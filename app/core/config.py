@@ -2,7 +2,7 @@
 import os
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings # Asegúrate que usas pydantic_settings
-from typing import Optional
+from typing import Dict, Optional
 
 load_dotenv()
 
@@ -10,6 +10,52 @@ class Settings(BaseSettings):
     GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "DEFAULT_KEY_IF_NOT_SET")
     AWS_RDS_URL: Optional[str] = os.getenv("AWS_RDS_URL") # Nueva variable
 
+    # Salida estructurada: prompt compacto + RecommendationGenerationSchema como response schema (JSON)
+    GEMINI_STRUCTURED_OUTPUT: bool = os.getenv("GEMINI_STRUCTURED_OUTPUT", False)
+    # Cinco prompts pequeños en paralelo (global + una por categoría, siempre con salida estructurada) en lugar de uno
+    GEMINI_PARALLEL_CATEGORIES: bool = os.getenv("GEMINI_PARALLEL_CATEGORIES", False)
+
+    # Observabilidad: cabecera Server-Timing con el desglose por etapas (los histogramas de /metrics siempre están activos)
+    SERVER_TIMING_ENABLED: bool = os.getenv("SERVER_TIMING_ENABLED", True)
+
+    # Logging: un QueueHandler por proceso (la escritura ocurre en un hilo aparte), JSON con el X-Request-ID de cada
+    # petición. Las respuestas crudas de Gemini solo se registran en una fracción de los casos y recortadas
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json") # "json" o "text"
+    LOG_PAYLOAD_SAMPLE_RATE: float = os.getenv("LOG_PAYLOAD_SAMPLE_RATE", 0.01)
+    LOG_PAYLOAD_MAX_CHARS: int = os.getenv("LOG_PAYLOAD_MAX_CHARS", 2000)
+
+    # Motor de recomendaciones: "gemini" (LLM) o "local" (motor determinista, sin IA)
+    RECOMMENDATION_ENGINE: str = os.getenv("RECOMMENDATION_ENGINE", "gemini")
+    LOCAL_ENGINE_FALLBACK: bool = os.getenv("LOCAL_ENGINE_FALLBACK", False) # Usar el motor local si Gemini falla
+
+    # Autenticación: verificación de JWT con las claves públicas de un JWKS (fichero local o URL)
+    JWT_JWKS_URL: Optional[str] = os.getenv("JWT_JWKS_URL")
+    JWT_JWKS_FILE: Optional[str] = os.getenv("JWT_JWKS_FILE") # Tiene prioridad sobre la URL
+    # Tokens Bearer recibidos sin JWKS configurado (no se pueden verificar): "reject" (por defecto) responde 401;
+    # "anonymous" hay que pedirlo expresamente: ignora el token y procesa la petición como 'No Login', con lo que
+    # el historial, la idempotencia y el rate limit dejan de ser por usuario
+    JWT_UNVERIFIABLE_TOKENS: str = os.getenv("JWT_UNVERIFIABLE_TOKENS", "reject")
+    JWT_ALGORITHMS: str = os.getenv("JWT_ALGORITHMS", "RS256") # Separados por comas, p. ej. "RS256,ES256"
+    JWT_AUDIENCE: Optional[str] = os.getenv("JWT_AUDIENCE") # Si no se define, no se comprueba 'aud'
+    JWT_ISSUER: Optional[str] = os.getenv("JWT_ISSUER") # Si no se define, no se comprueba 'iss'
+    JWT_LEEWAY_SECONDS: int = os.getenv("JWT_LEEWAY_SECONDS", 30) # Tolerancia de reloj para exp/nbf/iat
+    JWT_JWKS_REFRESH_SECONDS: float = os.getenv("JWT_JWKS_REFRESH_SECONDS", 600.0) # Recarga periódica en segundo plano
+    JWT_JWKS_MIN_REFRESH_SECONDS: float = os.getenv("JWT_JWKS_MIN_REFRESH_SECONDS", 30.0) # Mínimo entre recargas por kid desconocido
+    JWT_CACHE_MAX_ENTRIES: int = os.getenv("JWT_CACHE_MAX_ENTRIES", 10000) # Tokens verificados en la LRU
+
+    # Resiliencia de las llamadas a Gemini
+    GEMINI_TIMEOUT_SECONDS: float = os.getenv("GEMINI_TIMEOUT_SECONDS", 20.0) # Presupuesto total por petición (reintentos incluidos)
+    GEMINI_MAX_RETRIES: int = os.getenv("GEMINI_MAX_RETRIES", 2) # Solo errores transitorios (429, 5xx, timeouts)
+    GEMINI_RETRY_BASE_DELAY: float = os.getenv("GEMINI_RETRY_BASE_DELAY", 0.5)
+    GEMINI_RETRY_MAX_DELAY: float = os.getenv("GEMINI_RETRY_MAX_DELAY", 4.0)
+    GEMINI_HEDGE_ENABLED: bool = os.getenv("GEMINI_HEDGE_ENABLED", False) # Segunda petición si la primera supera el percentil
+    GEMINI_HEDGE_PERCENTILE: float = os.getenv("GEMINI_HEDGE_PERCENTILE", 0.95)
+    GEMINI_HEDGE_MIN_DELAY: float = os.getenv("GEMINI_HEDGE_MIN_DELAY", 1.0)
+    GEMINI_HEDGE_MIN_SAMPLES: int = os.getenv("GEMINI_HEDGE_MIN_SAMPLES", 20) # Latencias observadas antes de empezar a cubrir
+    GEMINI_BREAKER_FAILURE_THRESHOLD: int = os.getenv("GEMINI_BREAKER_FAILURE_THRESHOLD", 5)
+    GEMINI_BREAKER_RESET_SECONDS: float = os.getenv("GEMINI_BREAKER_RESET_SECONDS", 30.0)
+
     # Para construir la DSN de psycopg a partir de los componentes de la URL
     # Esto es útil si prefieres definir las partes de la URL por separado en .env
     DB_HOST: Optional[str] = os.getenv("DB_HOST")
@@ -18,7 +64,101 @@ class Settings(BaseSettings):
     DB_NAME: Optional[str] = os.getenv("DB_NAME")
     DB_PORT: Optional[int] = os.getenv("DB_PORT", 5432)
     DB_SSLMODE: Optional[str] = os.getenv("DB_SSLMODE", "require")
+    DB_CONNECT_TIMEOUT: int = os.getenv("DB_CONNECT_TIMEOUT", 10)
+
+    # Pool de conexiones asíncrono (psycopg_pool), abierto en el lifespan de FastAPI
+    DB_POOL_MIN_SIZE: int = os.getenv("DB_POOL_MIN_SIZE", 1)
+    DB_POOL_MAX_SIZE: int = os.getenv("DB_POOL_MAX_SIZE", 10)
+    DB_POOL_TIMEOUT: float = os.getenv("DB_POOL_TIMEOUT", 10.0) # Espera máxima (s) por una conexión libre
+    DB_POOL_MAX_IDLE: float = os.getenv("DB_POOL_MAX_IDLE", 300.0) # Cierra conexiones ociosas por encima de min_size
+    DB_POOL_MAX_LIFETIME: float = os.getenv("DB_POOL_MAX_LIFETIME", 3600.0) # Recicla conexiones viejas (rotación de RDS)
+    DB_POOL_CHECK_CONNECTIONS: bool = os.getenv("DB_POOL_CHECK_CONNECTIONS", True) # Health check al entregar cada conexión
+
+    # Esquema compacto (migrations/0004): payload JSONB sin columnas de sugerencias copiadas, tabla particionada por mes.
+    # El esquema real se detecta en la BD con la primera conexión; esta variable solo cuenta si no se puede detectar
+    DB_JSONB_STORAGE_ENABLED: bool = os.getenv("DB_JSONB_STORAGE_ENABLED", False)
+    DB_PARTITIONS_MONTHS_AHEAD: int = os.getenv("DB_PARTITIONS_MONTHS_AHEAD", 3) # Particiones futuras creadas al arrancar
+
+    # Modo write-behind: las filas se encolan y una tarea en segundo plano las inserta por lotes
+    DB_WRITE_BEHIND_ENABLED: bool = os.getenv("DB_WRITE_BEHIND_ENABLED", False)
+    DB_WRITE_BEHIND_MAX_QUEUE: int = os.getenv("DB_WRITE_BEHIND_MAX_QUEUE", 10000) # Filas pendientes antes de aplicar backpressure
+    DB_WRITE_BEHIND_BATCH_SIZE: int = os.getenv("DB_WRITE_BEHIND_BATCH_SIZE", 200)
+    DB_WRITE_BEHIND_FLUSH_INTERVAL: float = os.getenv("DB_WRITE_BEHIND_FLUSH_INTERVAL", 0.5) # Segundos máximos que una fila espera en cola
+    DB_WRITE_BEHIND_ENQUEUE_TIMEOUT: float = os.getenv("DB_WRITE_BEHIND_ENQUEUE_TIMEOUT", 1.0) # Con la cola llena, espera esto y luego inserta directo
+
+    # Reenvíos idempotentes: un usuario con sesión que repite huella y fecha recibe la fila ya guardada (sin LLM ni
+    # fila duplicada). Requiere migrations/0003_user_recommendations_idempotency.sql
+    IDEMPOTENT_RECOMMENDATIONS_ENABLED: bool = os.getenv("IDEMPOTENT_RECOMMENDATIONS_ENABLED", False)
+
+    # Caché de recomendaciones (LRU en memoria + nivel compartido opcional en Postgres)
+    CACHE_ENABLED: bool = os.getenv("CACHE_ENABLED", True)
+    CACHE_TTL_SECONDS: float = os.getenv("CACHE_TTL_SECONDS", 3600.0)
+    CACHE_MAX_ENTRIES: int = os.getenv("CACHE_MAX_ENTRIES", 5000)
+    CACHE_MAX_BYTES: int = os.getenv("CACHE_MAX_BYTES", 32 * 1024 * 1024)
+    CACHE_QUANTUM: float = os.getenv("CACHE_QUANTUM", 1.0) # Tamaño del intervalo para cuantizar cada hábito
+    CACHE_RESULT_QUANTUM: float = os.getenv("CACHE_RESULT_QUANTUM", 0.1) # Idem para `result` (toneladas CO2e/año)
+    CACHE_SHARED_ENABLED: bool = os.getenv("CACHE_SHARED_ENABLED", False) # Requiere migrations/0001_recommendation_cache.sql
+    CACHE_SHARED_PURGE_EVERY: int = os.getenv("CACHE_SHARED_PURGE_EVERY", 1000) # Purga las entradas caducadas cada N escrituras
+
+    # Reutilización por vecino más cercano: una huella a menos de SIMILARITY_MAX_DISTANCE (distancia euclídea entre
+    # vectores log1p de hábitos y `result`) de otra generada hace poco reutiliza su respuesta sin llamar a Gemini
+    SIMILARITY_INDEX_ENABLED: bool = os.getenv("SIMILARITY_INDEX_ENABLED", False)
+    SIMILARITY_INDEX_CAPACITY: int = os.getenv("SIMILARITY_INDEX_CAPACITY", 20000) # Entradas (~2 KB de JSON cada una)
+    SIMILARITY_MAX_DISTANCE: float = os.getenv("SIMILARITY_MAX_DISTANCE", 0.3)
+    SIMILARITY_TTL_SECONDS: float = os.getenv("SIMILARITY_TTL_SECONDS", 3600.0)
+
+    # Endpoint batch (/api/v1/recommendations/batch)
+    BATCH_MAX_ITEMS: int = os.getenv("BATCH_MAX_ITEMS", 500)
+    BATCH_MAX_CONCURRENCY: int = os.getenv("BATCH_MAX_CONCURRENCY", 8) # Huellas procesadas en paralelo por petición batch
+
+    # Modo asíncrono (/api/v1/recommendations/jobs): 202 + workers en proceso que drenan una cola en Postgres.
+    # Requiere migrations/0005_recommendation_jobs.sql
+    JOBS_ENABLED: bool = os.getenv("JOBS_ENABLED", False)
+    JOBS_WORKERS: int = os.getenv("JOBS_WORKERS", 4) # Trabajos procesados a la vez por proceso
+    JOBS_POLL_INTERVAL: float = os.getenv("JOBS_POLL_INTERVAL", 1.0) # Espera entre consultas con la cola vacía
+    JOBS_LEASE_SECONDS: float = os.getenv("JOBS_LEASE_SECONDS", 120.0) # Tras esto, un trabajo 'running' se reclama de nuevo
+    JOBS_MAX_ATTEMPTS: int = os.getenv("JOBS_MAX_ATTEMPTS", 3)
+    JOBS_RETENTION_HOURS: float = os.getenv("JOBS_RETENTION_HOURS", 24.0) # Trabajos terminados que se conservan
+    JOBS_SHUTDOWN_TIMEOUT: float = os.getenv("JOBS_SHUTDOWN_TIMEOUT", 30.0) # Espera a los trabajos en curso al apagar
+
+    # Historial de recomendaciones (/api/v1/recommendations/history)
+    HISTORY_PAGE_SIZE: int = os.getenv("HISTORY_PAGE_SIZE", 20)
+    HISTORY_MAX_PAGE_SIZE: int = os.getenv("HISTORY_MAX_PAGE_SIZE", 100)
+
+    # Control de admisión: token bucket por usuario ('sub', o IP del cliente sin sesión) delante de los endpoints
+    # que generan recomendaciones, y compuerta global de concurrencia dimensionada a la cuota de Gemini
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", True)
+    RATE_LIMIT_PER_MINUTE: float = os.getenv("RATE_LIMIT_PER_MINUTE", 30.0) # Ritmo sostenido por usuario/IP
+    RATE_LIMIT_BURST: float = os.getenv("RATE_LIMIT_BURST", 10.0) # Peticiones seguidas admitidas con el cubo lleno
+    RATE_LIMIT_MAX_KEYS: int = os.getenv("RATE_LIMIT_MAX_KEYS", 100000) # Cubos en memoria (LRU)
+    GEMINI_MAX_CONCURRENCY: int = os.getenv("GEMINI_MAX_CONCURRENCY", 16) # Llamadas simultáneas a Gemini (cuota)
+    GEMINI_MAX_QUEUE: int = os.getenv("GEMINI_MAX_QUEUE", 64) # Peticiones esperando hueco; por encima, 429 inmediato
+    GEMINI_QUEUE_TIMEOUT_SECONDS: float = os.getenv("GEMINI_QUEUE_TIMEOUT_SECONDS", 2.0) # Espera máxima por un hueco
+
+    # Cliente HTTP saliente compartido (httpx), creado en el lifespan de FastAPI
+    TARGET_SERVICE_URL: Optional[str] = os.getenv("TARGET_SERVICE_URL", "https://fake-data-wvx9.onrender.com/enviar_calculos")
+    HTTP_MAX_CONNECTIONS: int = os.getenv("HTTP_MAX_CONNECTIONS", 100)
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+    HTTP_KEEPALIVE_EXPIRY: float = os.getenv("HTTP_KEEPALIVE_EXPIRY", 30.0) # Segundos que una conexión ociosa sigue abierta
+    HTTP2_ENABLED: bool = os.getenv("HTTP2_ENABLED", False)
+    HTTP_CONNECT_TIMEOUT: float = os.getenv("HTTP_CONNECT_TIMEOUT", 5.0)
+    HTTP_READ_TIMEOUT: float = os.getenv("HTTP_READ_TIMEOUT", 10.0)
+    HTTP_WRITE_TIMEOUT: float = os.getenv("HTTP_WRITE_TIMEOUT", 10.0)
+    HTTP_POOL_TIMEOUT: float = os.getenv("HTTP_POOL_TIMEOUT", 5.0) # Espera máxima por una conexión libre del pool
+    # Timeout (lectura/escritura) por host, en JSON: HTTP_HOST_TIMEOUTS='{"fake-data-wvx9.onrender.com": 3.0}'
+    HTTP_HOST_TIMEOUTS: Dict[str, float] = {}
 
+    # Outbox del webhook: la entrega a TARGET_SERVICE_URL se guarda en webhook_outbox en la misma transacción que la
+    # fila de recomendaciones y un dispatcher en segundo plano la envía con reintentos. Requiere migrations/0006_webhook_outbox.sql
+    WEBHOOK_OUTBOX_ENABLED: bool = os.getenv("WEBHOOK_OUTBOX_ENABLED", False)
+    WEBHOOK_OUTBOX_BATCH_SIZE: int = os.getenv("WEBHOOK_OUTBOX_BATCH_SIZE", 50) # Entregas reclamadas por consulta
+    WEBHOOK_OUTBOX_CONCURRENCY: int = os.getenv("WEBHOOK_OUTBOX_CONCURRENCY", 8) # POST simultáneos al receptor
+    WEBHOOK_OUTBOX_POLL_INTERVAL: float = os.getenv("WEBHOOK_OUTBOX_POLL_INTERVAL", 1.0) # Segundos entre consultas sin trabajo
+    WEBHOOK_OUTBOX_LEASE_SECONDS: float = os.getenv("WEBHOOK_OUTBOX_LEASE_SECONDS", 120.0) # Reserva de un lote reclamado (más que su envío)
+    WEBHOOK_OUTBOX_MAX_ATTEMPTS: int = os.getenv("WEBHOOK_OUTBOX_MAX_ATTEMPTS", 10) # Después, dead letter ('dead')
+    WEBHOOK_OUTBOX_BACKOFF_BASE: float = os.getenv("WEBHOOK_OUTBOX_BACKOFF_BASE", 2.0)
+    WEBHOOK_OUTBOX_BACKOFF_MAX: float = os.getenv("WEBHOOK_OUTBOX_BACKOFF_MAX", 600.0)
+    WEBHOOK_OUTBOX_RETENTION_HOURS: float = os.getenv("WEBHOOK_OUTBOX_RETENTION_HOURS", 24.0) # Entregas hechas
 
     class Config:
         env_file = ".env"
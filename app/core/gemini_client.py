@@ -1,28 +1,259 @@
 # app/core/gemini_client.py
-import google.generativeai as genai
+from pydantic import BaseModel
+from .admission import gemini_gate
 from .config import settings
+from .logging_config import log_payload
+from .metrics import GEMINI_TOKENS
+from .resilience import CircuitBreaker, LatencyTracker, backoff_delay
+from .singleflight import SingleFlight
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Tuple, Type
+import asyncio
+import functools
+import hashlib
 import logging
+import threading
+import time
+
+if TYPE_CHECKING:
+    import google.generativeai as genai
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-try:
-    genai.configure(api_key=settings.GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-2.0-flash') # Or specify a newer model if available
-    logger.info("Gemini client configured successfully.")
-except Exception as e:
-    logger.error(f"Failed to configure Gemini client: {e}")
-    model = None # Ensure model is None if config fails
+# google.generativeai tarda ~1 s en importarse: no se carga al importar este módulo sino en
+# init_gemini_client(), que el lifespan lanza en segundo plano (o la primera llamada, si llega antes).
+model = None # genai.GenerativeModel una vez inicializado (los benchmarks lo sustituyen por un doble)
+_init_lock = threading.Lock()
+_init_attempted = False
+
+def init_gemini_client() -> bool:
+    """Importa el SDK, configura la API key y crea el modelo (una sola vez). Bloqueante: usar en un hilo."""
+    global model, _init_attempted
+    with _init_lock:
+        if model is not None or _init_attempted:
+            return model is not None
+        _init_attempted = True
+        start = time.perf_counter()
+        try:
+            import google.generativeai as genai
+            genai.configure(api_key=settings.GEMINI_API_KEY)
+            model = genai.GenerativeModel('gemini-2.0-flash') # Or specify a newer model if available
+            logger.info("Gemini client configured successfully in %.2fs.", time.perf_counter() - start)
+        except Exception as e:
+            logger.error("Failed to configure Gemini client: %s", e)
+            model = None # Ensure model is None if config fails
+        return model is not None
+
+async def warm_gemini_client() -> bool:
+    """Inicializa el cliente de Gemini en un hilo para no bloquear el event loop."""
+    if model is not None:
+        return True
+    return await asyncio.to_thread(init_gemini_client)
+
+def gemini_client_ready() -> bool:
+    return model is not None
+
+# Peticiones idénticas en curso (mismo prompt) comparten una única llamada a Gemini
+_gemini_singleflight: SingleFlight[str | None] = SingleFlight()
+
+# Tokens consumidos por modo: "text" (prompt libre) o "json" (salida con response schema)
+_token_usage: Dict[str, Dict[str, int]] = {
+    mode: {"calls": 0, "prompt_tokens": 0, "output_tokens": 0} for mode in ("text", "json")
+}
+
+# Protección frente a un Gemini degradado: breaker, latencias recientes (para el hedging) y contadores
+_breaker = CircuitBreaker(
+    failure_threshold=settings.GEMINI_BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=settings.GEMINI_BREAKER_RESET_SECONDS,
+)
+_latency = LatencyTracker()
+_resilience_counters: Dict[str, int] = {"retries": 0, "timeouts": 0, "hedges_fired": 0, "hedges_won": 0}
+
+@functools.lru_cache(maxsize=None)
+def _transient_errors() -> Tuple[Type[BaseException], ...]:
+    """
+    Errores tras los que tiene sentido reintentar: cuota (429), errores del servidor (5xx) y timeouts.
+    Se resuelve en la primera llamada para no importar google.api_core al arrancar.
+    """
+    from google.api_core import exceptions as google_exceptions
+    return (
+        asyncio.TimeoutError,
+        ConnectionError,
+        google_exceptions.TooManyRequests,
+        google_exceptions.ServerError,
+    )
+
+# Campos que admite el Schema de Gemini (subconjunto de OpenAPI)
+_GEMINI_SCHEMA_FIELDS = {"type", "format", "description", "nullable", "enum", "required"}
+
+def _to_gemini_schema(schema: Dict[str, Any], defs: Dict[str, Any]) -> Dict[str, Any]:
+    """Convierte un JSON Schema de Pydantic al subconjunto que acepta Gemini (sin $ref, title, default...)."""
+    if "$ref" in schema:
+        referenced = defs[schema["$ref"].rsplit("/", 1)[-1]]
+        return _to_gemini_schema({**referenced, **{k: v for k, v in schema.items() if k != "$ref"}}, defs)
+    if "anyOf" in schema: # Optional[X] -> X nullable
+        variants = [v for v in schema["anyOf"] if v.get("type") != "null"]
+        converted = _to_gemini_schema(variants[0], defs)
+        converted["nullable"] = True
+        if "description" in schema:
+            converted["description"] = schema["description"]
+        return converted
+
+    converted: Dict[str, Any] = {key: value for key, value in schema.items() if key in _GEMINI_SCHEMA_FIELDS}
+    if "properties" in schema:
+        converted["properties"] = {name: _to_gemini_schema(sub, defs) for name, sub in schema["properties"].items()}
+    if "items" in schema:
+        converted["items"] = _to_gemini_schema(schema["items"], defs)
+    if "minItems" in schema:
+        converted["min_items"] = schema["minItems"]
+    if "maxItems" in schema:
+        converted["max_items"] = schema["maxItems"]
+    return converted
+
+@functools.lru_cache(maxsize=None)
+def _json_generation_config(response_model: Type[BaseModel]) -> "genai.GenerationConfig":
+    """
+    GenerationConfig (JSON + response schema) para un modelo Pydantic. Se construye una sola vez por modelo.
+    El schema va como dict por la API pública de GenerationConfig: el SDK lo convierte a protos.Schema en cada
+    llamada (sobre una copia, el dict cacheado no cambia).
+    """
+    import google.generativeai as genai
+    json_schema = response_model.model_json_schema()
+    gemini_schema = _to_gemini_schema(json_schema, json_schema.get("$defs", {}))
+    return genai.GenerationConfig(response_mime_type="application/json", response_schema=gemini_schema)
+
+def _record_usage(response, structured: bool) -> None:
+    """Acumula y registra los tokens de prompt y de salida de una llamada."""
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return
+    mode = "json" if structured else "text"
+    counters = _token_usage[mode]
+    counters["calls"] += 1
+    counters["prompt_tokens"] += usage.prompt_token_count
+    counters["output_tokens"] += usage.candidates_token_count
+    GEMINI_TOKENS.labels(mode, "prompt").inc(usage.prompt_token_count)
+    GEMINI_TOKENS.labels(mode, "output").inc(usage.candidates_token_count)
+    logger.debug("Gemini tokens (%s): prompt=%s, output=%s", mode, usage.prompt_token_count, usage.candidates_token_count)
+
+async def generate_text_from_gemini(prompt: str, response_model: Optional[Type[BaseModel]] = None) -> str | None:
+    """
+    Genera texto con Gemini. Con `response_model` la salida queda restringida a JSON que cumple
+    ese schema (response_mime_type application/json), lo que permite prompts mucho más cortos.
+    """
+    mode = "json" if response_model else "text"
+    key = f"{mode}:{hashlib.sha256(prompt.encode()).hexdigest()}"
+    return await _gemini_singleflight.do(key, lambda: _admitted_generate_text(prompt, response_model))
+
+async def _admitted_generate_text(prompt: str, response_model: Optional[Type[BaseModel]] = None) -> str | None:
+    # Tras el singleflight: las peticiones idénticas comparten un único hueco de la cuota de Gemini.
+    # Si la compuerta está saturada lanza AdmissionRejected, que el llamador convierte en 429 o en motor local.
+    async with gemini_gate.slot():
+        return await _generate_text_from_gemini(prompt, response_model)
+
+def get_gemini_stats() -> dict:
+    return {
+        "singleflight": _gemini_singleflight.stats(),
+        "tokens": {mode: dict(counters) for mode, counters in _token_usage.items()},
+        "circuit_breaker": _breaker.stats(),
+        **_resilience_counters,
+        "latency_p50": _latency.percentile(0.5),
+        "latency_p95": _latency.percentile(0.95),
+    }
 
-async def generate_text_from_gemini(prompt: str) -> str | None:
-    if not model:
+async def _call_model(prompt: str, generation_config: Optional["genai.GenerationConfig"]):
+    start = time.perf_counter()
+    response = await model.generate_content_async(prompt, generation_config=generation_config) # Use async version
+    _latency.record(time.perf_counter() - start)
+    return response
+
+def _hedge_delay() -> Optional[float]:
+    """Segundos a esperar antes de lanzar la petición de cobertura, o None si el hedging no aplica todavía."""
+    if not settings.GEMINI_HEDGE_ENABLED or len(_latency) < settings.GEMINI_HEDGE_MIN_SAMPLES:
+        return None
+    return max(settings.GEMINI_HEDGE_MIN_DELAY, _latency.percentile(settings.GEMINI_HEDGE_PERCENTILE))
+
+async def _call_with_hedging(prompt: str, generation_config: Optional["genai.GenerationConfig"], deadline: float):
+    """
+    Una llamada a Gemini limitada por `deadline` (reloj del event loop). Si el hedging está activo y la
+    primera petición tarda más que el percentil configurado, se lanza una segunda idéntica y gana la
+    primera que responda bien; la otra se cancela.
+    """
+    loop = asyncio.get_running_loop()
+    primary = asyncio.ensure_future(_call_model(prompt, generation_config))
+    started: List[asyncio.Future] = [primary]
+    pending = {primary}
+    last_error: Optional[BaseException] = None
+    try:
+        hedge_delay = _hedge_delay()
+        if hedge_delay is not None and loop.time() + hedge_delay < deadline:
+            done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+            if not done:
+                _resilience_counters["hedges_fired"] += 1
+                hedge = asyncio.ensure_future(_call_model(prompt, generation_config))
+                started.append(hedge)
+                pending.add(hedge)
+            else:
+                pending = done # Respondió antes del umbral: se procesa abajo
+
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        _resilience_counters["hedges_won"] += 1
+                    return task.result()
+                last_error = task.exception()
+
+        if last_error is not None and not pending:
+            raise last_error
+        _resilience_counters["timeouts"] += 1
+        raise asyncio.TimeoutError(f"Gemini did not answer within {settings.GEMINI_TIMEOUT_SECONDS}s")
+    finally:
+        for task in started:
+            if not task.done():
+                task.cancel()
+
+async def _generate_text_from_gemini(prompt: str, response_model: Optional[Type[BaseModel]] = None) -> str | None:
+    if not await warm_gemini_client():
         logger.error("Gemini model not initialized. Cannot generate text.")
         return None
+    if not _breaker.allow_request():
+        logger.warning("Gemini circuit breaker is open; failing fast.")
+        return "Error communicating with Gemini: circuit breaker open (upstream unhealthy), failing fast."
+    probe = _breaker.probe_token()
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.GEMINI_TIMEOUT_SECONDS
+    generation_config = _json_generation_config(response_model) if response_model else None
+    attempt = 0
     try:
-        response = await model.generate_content_async(prompt) # Use async version
+        while True:
+            try:
+                response = await _call_with_hedging(prompt, generation_config, deadline)
+                break
+            except _transient_errors() as e:
+                remaining = deadline - loop.time()
+                if attempt >= settings.GEMINI_MAX_RETRIES or remaining <= 0:
+                    _breaker.record_failure()
+                    raise
+                delay = min(backoff_delay(attempt, settings.GEMINI_RETRY_BASE_DELAY, settings.GEMINI_RETRY_MAX_DELAY), remaining)
+                attempt += 1
+                _resilience_counters["retries"] += 1
+                logger.warning("Transient Gemini error (%s: %s); retry %s/%s in %.2fs.", type(e).__name__, e, attempt, settings.GEMINI_MAX_RETRIES, delay)
+                await asyncio.sleep(delay)
+            except Exception:
+                # Gemini respondió (p. ej. argumento inválido, API key): no es un problema de salud del upstream
+                _breaker.record_success()
+                raise
+        _breaker.record_success()
+
+        _record_usage(response, structured=response_model is not None)
         # Basic safety check (can be expanded)
         if not response.candidates or not response.candidates[0].content.parts:
-             logger.warning(f"Gemini response emight be blocked or empty. Response: {response}")
+             log_payload(logger, logging.WARNING, "Gemini response might be blocked or empty. Response: %s", str(response))
              # Check prompt feedback for block reasons
              if response.prompt_feedback and response.prompt_feedback.block_reason:
                  return f"Blocked: {response.prompt_feedback.block_reason_message}"
@@ -30,6 +261,75 @@ async def generate_text_from_gemini(prompt: str) -> str | None:
 
         return response.text
     except Exception as e:
-        logger.error(f"Error generating content with Gemini: {e}")
+        logger.error("Error generating content with Gemini: %s", e)
         # Consider specific error types if needed (e.g., API key errors)
-        return f"Error communicating with Gemini: {e}"
\ No newline at end of file
+        return f"Error communicating with Gemini: {e}"
+    finally:
+        # Cancelación (cliente desconectado, single-flight sin esperas): CancelledError no pasa por los except
+        # anteriores y la prueba half_open quedaría marcada para siempre. Se libera sin contarla como fallo.
+        _breaker.release_probe(probe)
+
+_STREAM_END = object() # Fin del stream en la cola de fragmentos
+
+
+async def _pump_gemini_stream(
+    prompt: str,
+    generation_config: Any,
+    structured: bool,
+    chunks: "asyncio.Queue[Any]"
+) -> None:
+    """
+    Lee el stream de Gemini con un hueco de la compuerta y deja cada fragmento en `chunks`. El hueco se libera en
+    cuanto Gemini termina, aunque el cliente (p. ej. un SSE lento) todavía no haya leído todo.
+    """
+    try:
+        async with gemini_gate.slot():
+            # El breaker se consulta ya con el hueco: un AdmissionRejected de la compuerta no deja una prueba colgada
+            if not _breaker.allow_request():
+                raise RuntimeError("circuit breaker open (upstream unhealthy), failing fast.")
+            probe = _breaker.probe_token()
+            try:
+                response = await model.generate_content_async(prompt, generation_config=generation_config, stream=True)
+                last_chunk = None
+                async for chunk in response:
+                    last_chunk = chunk
+                    if chunk.candidates and chunk.candidates[0].content.parts:
+                        chunks.put_nowait(chunk.text)
+            except _transient_errors():
+                _breaker.record_failure()
+                raise
+            except Exception:
+                _breaker.record_success() # Gemini respondió: no es un problema de salud del upstream
+                raise
+            else:
+                _breaker.record_success()
+            finally:
+                # El consumidor se fue (la tarea se canceló): se libera la prueba sin contar un fallo
+                _breaker.release_probe(probe)
+        if last_chunk is not None: # El último fragmento trae el recuento total de tokens
+            _record_usage(last_chunk, structured=structured)
+    finally:
+        chunks.put_nowait(_STREAM_END)
+
+
+async def stream_text_from_gemini(prompt: str, response_model: Optional[Type[BaseModel]] = None) -> AsyncIterator[str]:
+    """
+    Genera la respuesta de Gemini en modo streaming, fragmento a fragmento.
+    A diferencia de generate_text_from_gemini, los errores se propagan como excepciones
+    porque el llamador puede haber enviado ya parte de la respuesta.
+    """
+    if not await warm_gemini_client():
+        raise RuntimeError("Gemini model not initialized. Cannot generate text.")
+    generation_config = _json_generation_config(response_model) if response_model else None
+    chunks: "asyncio.Queue[Any]" = asyncio.Queue() # Sin límite: la respuesta está acotada por max_output_tokens
+    producer = asyncio.create_task(
+        _pump_gemini_stream(prompt, generation_config, response_model is not None, chunks), name="gemini-stream"
+    )
+    try:
+        while (chunk := await chunks.get()) is not _STREAM_END:
+            yield chunk
+        await producer # Propaga el error de Gemini, de la compuerta o del breaker
+    finally:
+        if not producer.done(): # El cliente dejó de leer antes del final: no se sigue pagando el stream
+            producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
@@ -1,33 +1,111 @@
 # app/core/http_client.py
 import httpx
 import logging
+from typing import Optional
 from app.api.v1.schemas.recommendation import RecommendationOutputSchema 
+from app.core.config import settings
+from app.core.metrics import WEBHOOK_ERRORS
 
 logger = logging.getLogger(__name__)
 
-TARGET_SERVICE_URL = "https://fake-data-wvx9.onrender.com/enviar_calculos" # La URL del servicio destino
+# Cliente único para toda la aplicación: reutiliza conexiones keep-alive (DNS, TCP y TLS una sola vez)
+_client: Optional[httpx.AsyncClient] = None
 
-async def post_recommendations_to_external_service(recommendations_payload: RecommendationOutputSchema):
+def _build_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=settings.HTTP_CONNECT_TIMEOUT,
+            read=settings.HTTP_READ_TIMEOUT,
+            write=settings.HTTP_WRITE_TIMEOUT,
+            pool=settings.HTTP_POOL_TIMEOUT,
+        ),
+        http2=settings.HTTP2_ENABLED,
+    )
+
+async def open_http_client() -> None:
+    """Crea el cliente HTTP compartido (lifespan startup)."""
+    global _client
+    if _client is None:
+        _client = _build_client()
+        logger.info("Cliente HTTP compartido creado (max_connections=%s, http2=%s).", settings.HTTP_MAX_CONNECTIONS, settings.HTTP2_ENABLED)
+
+async def close_http_client() -> None:
+    """Cierra el cliente HTTP compartido y sus conexiones (lifespan shutdown)."""
+    global _client
+    if _client is None:
+        return
+    client, _client = _client, None
+    await client.aclose()
+    logger.info("Cliente HTTP compartido cerrado.")
+
+def http_client_ready() -> bool:
+    return _client is not None and not _client.is_closed
+
+def get_http_client() -> httpx.AsyncClient:
     """
-    Envía el payload de recomendaciones a un servicio externo mediante una petición POST.
+    Devuelve el cliente compartido para cualquier integración saliente.
+    Si el lifespan no lo creó (scripts, tests), se crea bajo demanda.
     """
-    if not TARGET_SERVICE_URL:
+    global _client
+    if _client is None:
+        logger.warning("Cliente HTTP compartido no inicializado por el lifespan; se crea bajo demanda.")
+        _client = _build_client()
+    return _client
+
+def timeout_for(url: str) -> httpx.Timeout:
+    """Timeout para una URL concreta: usa HTTP_HOST_TIMEOUTS si el host tiene uno propio, si no el del cliente."""
+    host_timeout = settings.HTTP_HOST_TIMEOUTS.get(httpx.URL(url).host)
+    if host_timeout is None:
+        return get_http_client().timeout
+    return httpx.Timeout(
+        host_timeout,
+        connect=min(settings.HTTP_CONNECT_TIMEOUT, host_timeout),
+        pool=settings.HTTP_POOL_TIMEOUT,
+    )
+
+async def send_webhook(content: bytes) -> Optional[str]:
+    """
+    Envía a TARGET_SERVICE_URL el JSON ya serializado de unas recomendaciones (el mismo que la respuesta HTTP
+    y la fila de la BD). Devuelve None si el servicio lo aceptó o una descripción del error si no.
+    """
+    target_url = settings.TARGET_SERVICE_URL
+    if not target_url:
         logger.warning("TARGET_SERVICE_URL no está configurada. No se enviará la petición externa.")
-        return
+        return None
 
     try:
-        # Convertir el objeto Pydantic a un diccionario para enviarlo como JSON
-        payload_dict = recommendations_payload.model_dump()
-
-        async with httpx.AsyncClient(timeout=10.0) as client: # Timeout de 10 segundos
-            logger.info(f"Enviando recomendaciones a {TARGET_SERVICE_URL}...")
-            response = await client.post(TARGET_SERVICE_URL, json=payload_dict)
-            response.raise_for_status()  # Lanza una excepción para códigos de error HTTP 
-            logger.info(f"Recomendaciones enviadas exitosamente a {TARGET_SERVICE_URL}. Status: {response.status_code}")
-            
+        client = get_http_client()
+        logger.debug("Enviando recomendaciones a %s...", target_url)
+        response = await client.post(
+            target_url,
+            content=content,
+            headers={"Content-Type": "application/json"},
+            timeout=timeout_for(target_url),
+        )
+        response.raise_for_status()  # Lanza una excepción para códigos de error HTTP 
+        logger.debug("Recomendaciones enviadas exitosamente a %s. Status: %s", target_url, response.status_code)
+        return None
     except httpx.HTTPStatusError as e:
-        logger.error(f"Error HTTP al enviar recomendaciones a {TARGET_SERVICE_URL}: {e.response.status_code} - {e.response.text}")
+        logger.error("Error HTTP al enviar recomendaciones a %s: %s - %s", target_url, e.response.status_code, e.response.text)
+        WEBHOOK_ERRORS.labels("http_status").inc()
+        return f"HTTP {e.response.status_code}"
     except httpx.RequestError as e: # Errores de red, timeout, etc.
-        logger.error(f"Error de red/petición al enviar recomendaciones a {TARGET_SERVICE_URL}: {str(e)}")
+        logger.error("Error de red/petición al enviar recomendaciones a %s: %s", target_url, e)
+        WEBHOOK_ERRORS.labels("timeout" if isinstance(e, httpx.TimeoutException) else "request_error").inc()
+        return f"{type(e).__name__}: {e}"
     except Exception as e:
-        logger.error(f"Error inesperado al enviar recomendaciones a {TARGET_SERVICE_URL}: {e}")
+        logger.error("Error inesperado al enviar recomendaciones a %s: %s", target_url, e)
+        WEBHOOK_ERRORS.labels("unexpected").inc()
+        return f"{type(e).__name__}: {e}"
+
+async def post_recommendations_to_external_service(recommendations_payload: RecommendationOutputSchema):
+    """
+    Envía el payload de recomendaciones a un servicio externo mediante una petición POST.
+    Sin reintentos: un envío fallido solo queda en el log (ver WEBHOOK_OUTBOX_ENABLED para entregas garantizadas).
+    """
+    await send_webhook(recommendations_payload.to_json())
@@ -0,0 +1,141 @@
+# app/core/logging_config.py
+# Logging no bloqueante: los módulos solo encolan el LogRecord (QueueHandler) y un hilo aparte (QueueListener) lo
+# formatea y lo escribe, así la E/S de los logs no ocupa el bucle de eventos. Cada línea lleva el id de la petición
+# (cabecera X-Request-ID) para correlacionar todo lo que se registró al atenderla.
+from app.core.config import settings
+from contextvars import ContextVar
+from typing import Optional
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+REQUEST_ID_HEADER = b"x-request-id"
+# Se respeta el id que envía el cliente (o un proxy) solo si es corto y sin caracteres raros
+_VALID_REQUEST_ID = re.compile(r"[A-Za-z0-9._\-]{1,64}")
+
+# Atributos estándar de un LogRecord: el resto son los `extra=` del llamador y van como campos del JSON
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Copia el id de la petición en curso al registro. Se ejecuta en el hilo que registra, antes de encolar."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get() or "-" # "-": fuera de una petición (arranque, tareas de fondo)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro: ts, level, logger, message, request_id, campos extra y traza si la hay."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", "-")
+        if request_id != "-":
+            entry["request_id"] = request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El QueueHandler estándar formatea el mensaje aquí, en el hilo que registra. Se deja para el listener:
+        # basta con copiar el registro para que los argumentos no cambien mientras espera en la cola.
+        return logging.makeLogRecord(vars(record))
+
+
+def setup_logging(level: Optional[str] = None) -> None:
+    """
+    Configura el logger raíz una sola vez por proceso (llamadas repetidas no hacen nada): sustituye sus handlers
+    por un QueueHandler y arranca el QueueListener que escribe en stderr, en JSON (LOG_FORMAT=json) o en texto.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    stream = logging.StreamHandler(sys.stderr)
+    if settings.LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    handler = _QueueHandler(queue.SimpleQueue())
+    handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel((level or settings.LOG_LEVEL).upper())
+
+    _listener = logging.handlers.QueueListener(handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop) # Vacía la cola antes de salir
+
+
+def log_payload(logger: logging.Logger, level: int, msg: str, payload: Optional[str], *args) -> None:
+    """
+    Registra `msg` con una respuesta cruda (de Gemini, ...) como último argumento, pero solo en una fracción
+    LOG_PAYLOAD_SAMPLE_RATE de las llamadas y recortada a LOG_PAYLOAD_MAX_CHARS; en el resto, solo su tamaño.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if payload and random.random() < settings.LOG_PAYLOAD_SAMPLE_RATE:
+        if len(payload) > settings.LOG_PAYLOAD_MAX_CHARS:
+            payload = f"{payload[:settings.LOG_PAYLOAD_MAX_CHARS]}... ({len(payload)} caracteres)"
+    else:
+        payload = f"<{len(payload or '')} caracteres, no muestreado>"
+    logger.log(level, msg, *args, payload)
+
+
+class RequestIdMiddleware:
+    """
+    Middleware ASGI puro: fija el id de la petición (el X-Request-ID recibido si es válido, si no uno nuevo)
+    para los logs emitidos mientras se atiende y lo devuelve en la cabecera X-Request-ID de la respuesta.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER:
+                candidate = value.decode("latin-1")
+                if _VALID_REQUEST_ID.fullmatch(candidate):
+                    request_id = candidate
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (REQUEST_ID_HEADER, request_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
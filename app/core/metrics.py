@@ -0,0 +1,172 @@
+# app/core/metrics.py
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from app.core.config import settings
+import time
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Buckets pensados para el rango de esta API: desde µs (caché, parseo) hasta decenas de segundos (Gemini)
+_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0)
+
+STAGE_DURATION = Histogram(
+    "ecofootprint_stage_duration_seconds",
+    "Duración de cada etapa del cálculo de recomendaciones.",
+    ["stage"],
+    buckets=_LATENCY_BUCKETS,
+)
+REQUEST_DURATION = Histogram(
+    "ecofootprint_http_request_duration_seconds",
+    "Duración de las peticiones HTTP hasta el envío de las cabeceras de respuesta.",
+    ["method", "route", "status"],
+    buckets=_LATENCY_BUCKETS,
+)
+GEMINI_TOKENS = Counter(
+    "ecofootprint_gemini_tokens",
+    "Tokens consumidos en Gemini, por modo (text/json) y tipo (prompt/output).",
+    ["mode", "kind"],
+)
+PARSE_FAILURES = Counter(
+    "ecofootprint_parse_failures",
+    "Respuestas de Gemini que no se pudieron convertir en recomendaciones, por motivo.",
+    ["reason"],
+)
+STORED_RECOMMENDATION_HITS = Counter(
+    "ecofootprint_stored_recommendation_hits",
+    "Reenvíos idénticos (usuario, fecha y entrada) respondidos con la fila ya guardada, sin llamar al LLM.",
+)
+DB_ERRORS = Counter(
+    "ecofootprint_db_errors",
+    "Errores de base de datos, por operación.",
+    ["operation"],
+)
+AUTH_TOKENS = Counter(
+    "ecofootprint_auth_tokens",
+    "Tokens Bearer procesados: verified (firma comprobada), cache_hit (ya verificado) o rejected.",
+    ["result"],
+)
+ADMISSION_REJECTIONS = Counter(
+    "ecofootprint_admission_rejections",
+    "Peticiones rechazadas con 429, por motivo: rate_limited (cubo del usuario/IP vacío), cost_above_burst "
+    "(lote mayor que el burst), gemini_queue_full o gemini_queue_timeout (compuerta de Gemini saturada).",
+    ["reason"],
+)
+GEMINI_GATE_IN_FLIGHT = Gauge(
+    "ecofootprint_gemini_gate_in_flight",
+    "Llamadas a Gemini en curso dentro de la compuerta de concurrencia.",
+)
+GEMINI_GATE_QUEUE_DEPTH = Gauge(
+    "ecofootprint_gemini_gate_queue_depth",
+    "Peticiones esperando un hueco libre en la compuerta de concurrencia de Gemini.",
+)
+SIMILARITY_LOOKUPS = Counter(
+    "ecofootprint_similarity_lookups",
+    "Búsquedas en el índice de vecinos: hit (respuesta reutilizada), miss (ninguna huella lo bastante cercana) "
+    "o conflict (vecino cercano cuyos valores citados no se pueden sustituir sin ambigüedad).",
+    ["result"],
+)
+JOBS = Counter(
+    "ecofootprint_jobs",
+    "Trabajos asíncronos por evento: submitted, succeeded, failed o requeued (devuelto a la cola).",
+    ["event"],
+)
+WEBHOOK_ERRORS = Counter(
+    "ecofootprint_webhook_errors",
+    "Errores al enviar recomendaciones a TARGET_SERVICE_URL, por motivo.",
+    ["reason"],
+)
+WEBHOOK_OUTBOX_DELIVERIES = Counter(
+    "ecofootprint_webhook_outbox_deliveries",
+    "Intentos de entrega del outbox del webhook: delivered, retry (reprogramado con backoff) o dead (dead letter).",
+    ["result"],
+)
+WEBHOOK_OUTBOX_PENDING = Gauge(
+    "ecofootprint_webhook_outbox_pending",
+    "Entregas pendientes en webhook_outbox.",
+)
+WEBHOOK_OUTBOX_LAG = Gauge(
+    "ecofootprint_webhook_outbox_lag_seconds",
+    "Antigüedad de la entrega pendiente más antigua de webhook_outbox (0 sin pendientes).",
+)
+
+# Etapas cronometradas en la petición actual; None fuera de una petición HTTP (tareas de fondo, scripts)
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Registra la duración de una etapa en el histograma y, si hay una petición en curso, en su Server-Timing."""
+    STAGE_DURATION.labels(stage).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Cronometra el bloque como la etapa `stage` (también válido alrededor de un `await`)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def latest_metrics() -> bytes:
+    """Exposición en formato texto de Prometheus para GET /metrics."""
+    return generate_latest()
+
+
+def _server_timing_header(timings: Dict[str, float], total: float) -> bytes:
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries).encode("latin-1")
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI puro (sin BaseHTTPMiddleware, que añade una tarea y colas por petición): abre el
+    registro de etapas de la petición, mide su duración y añade la cabecera Server-Timing con las etapas
+    completadas antes de enviar las cabeceras. En respuestas en streaming solo aparecen las etapas previas
+    al primer byte; el resto queda igualmente en los histogramas de /metrics.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                if settings.SERVER_TIMING_ENABLED:
+                    header = _server_timing_header(timings, time.perf_counter() - start)
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header)]}
+                REQUEST_DURATION.labels(scope["method"], _route_label(scope), str(message["status"])).observe(
+                    time.perf_counter() - start
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+
+
+def _route_label(scope) -> str:
+    """Plantilla de la ruta (no la URL real) para no disparar la cardinalidad de las métricas."""
+    # Con routers incluidos, FastAPI reciente deja en scope["route"] la ruta relativa al router ("/")
+    # y la plantilla completa en su contexto efectivo; versiones anteriores copian la ruta con el prefijo.
+    context = (scope.get("fastapi") or {}).get("effective_route_context")
+    if context is not None:
+        return context.path
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
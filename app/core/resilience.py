@@ -0,0 +1,119 @@
+# app/core/resilience.py
+from collections import deque
+from typing import Deque, Optional
+import random
+import time
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker clásico de tres estados para un servicio remoto.
+
+    - closed: las llamadas pasan; `failure_threshold` fallos seguidos lo abren.
+    - open: las llamadas se rechazan al instante durante `reset_timeout` segundos.
+    - half_open: se deja pasar una única llamada de prueba; si va bien se cierra, si falla se reabre.
+      Si la prueba no se resuelve (cancelada sin release_probe, o colgada) en `reset_timeout` segundos,
+      se admite otra: el breaker nunca se queda bloqueado en half_open.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.times_opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started_at = 0.0
+
+    def allow_request(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN and (
+            not self._probe_in_flight or time.monotonic() - self._probe_started_at >= self.reset_timeout
+        ):
+            self._probe_in_flight = True
+            self._probe_started_at = time.monotonic()
+            return True
+        self.rejected += 1
+        return False
+
+    def probe_token(self) -> Optional[float]:
+        """
+        Justo después de un allow_request() admitido: identifica la llamada de prueba si lo es (None si el breaker
+        está cerrado). Se pasa a release_probe() al terminar la llamada, pase lo que pase.
+        """
+        if self.state == self.HALF_OPEN and self._probe_in_flight:
+            return self._probe_started_at
+        return None
+
+    def release_probe(self, token: Optional[float]) -> None:
+        """
+        Libera la prueba `token` si sigue pendiente (cancelada, o terminada sin record_success/record_failure) sin
+        contarla como fallo: la siguiente llamada hará de prueba. No hace nada si ya se resolvió o si es otra prueba.
+        """
+        if token is not None and self.state == self.HALF_OPEN and self._probe_in_flight and self._probe_started_at == token:
+            self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyTracker:
+    """Ventana deslizante con las últimas `window` latencias (segundos) para estimar percentiles."""
+
+    def __init__(self, window: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Backoff exponencial con "full jitter": uniforme en [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def equal_jitter_backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Backoff exponencial con "equal jitter": d/2 + uniforme en [0, d/2], con d = min(cap, base * 2^attempt).
+    A diferencia del full jitter nunca baja de la mitad del escalón: un reintento tardío no vuelve casi enseguida.
+    """
+    delay = min(cap, base * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
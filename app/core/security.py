@@ -0,0 +1,291 @@
+# app/core/security.py
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from jose import jwk, jws, jwt
+from jose.exceptions import ExpiredSignatureError, JOSEError, JWTClaimsError
+from app.core.config import settings
+from app.core.http_client import get_http_client
+from app.core.metrics import AUTH_TOKENS, timed
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+ANONYMOUS_USER_ID = "No Login" # user_id de las peticiones sin token
+
+
+class TokenVerificationError(Exception):
+    """El token Bearer no es válido (firma, caducidad, audiencia, emisor...). `detail` es apto para la respuesta 401."""
+
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+class JWKSKeyStore:
+    """
+    Claves públicas de firma (JWKS) cargadas desde un fichero local o una URL y ya convertidas a objetos
+    de clave: el parseo de cada JWK se hace una vez por carga, no por petición. Una tarea en segundo plano
+    las recarga cada `refresh_interval` segundos; un `kid` desconocido (rotación de claves) fuerza una
+    recarga inmediata, como mucho una vez cada `min_refresh_interval` segundos.
+    """
+
+    def __init__(self, url: Optional[str], file: Optional[str], algorithms: Tuple[str, ...],
+                 refresh_interval: float, min_refresh_interval: float):
+        self.url = url
+        self.file = file
+        self.algorithms = algorithms
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self._keys: Dict[Optional[str], Any] = {} # kid -> jose Key
+        self._loaded_at: Optional[float] = None
+        self._last_attempt = 0.0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.url or self.file)
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded_at is not None
+
+    def start(self) -> None:
+        """Carga y recarga periódica en segundo plano (lifespan startup); no retrasa el arranque."""
+        if not self.configured:
+            if tokens_rejected_without_jwks():
+                logger.error(
+                    "JWT_JWKS_URL/JWT_JWKS_FILE sin configurar: todo token Bearer recibirá 401 hasta configurar el JWKS "
+                    "(JWT_UNVERIFIABLE_TOKENS=anonymous los procesa como 'No Login')."
+                )
+            else:
+                logger.warning(
+                    "JWT_JWKS_URL/JWT_JWKS_FILE sin configurar: los tokens Bearer no se verifican y sus peticiones se "
+                    "procesan como 'No Login' (JWT_UNVERIFIABLE_TOKENS=anonymous)."
+                )
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="jwks-refresh")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await self.refresh()
+            # Hasta la primera carga correcta se reintenta con el intervalo mínimo
+            await asyncio.sleep(self.refresh_interval if self.ready else self.min_refresh_interval)
+
+    async def get_key(self, kid: Optional[str]) -> Any:
+        """Clave para el `kid` de la cabecera del token; recarga el JWKS si no la conoce. None si no existe."""
+        key = self._lookup(kid)
+        if key is None and time.monotonic() - self._last_attempt >= self.min_refresh_interval:
+            await self.refresh()
+            key = self._lookup(kid)
+        return key
+
+    def _lookup(self, kid: Optional[str]) -> Any:
+        if kid is None and len(self._keys) == 1: # Tokens sin kid: solo válidos si hay una única clave
+            return next(iter(self._keys.values()))
+        return self._keys.get(kid)
+
+    async def refresh(self) -> bool:
+        """Recarga el JWKS. Ante un error conserva las claves anteriores y devuelve False."""
+        async with self._lock:
+            if self._last_attempt and time.monotonic() - self._last_attempt < self.min_refresh_interval and self.ready:
+                return True # Otra petición acaba de recargar mientras se esperaba el lock
+            self._last_attempt = time.monotonic()
+            try:
+                keys = self._parse_jwks(await self._fetch_jwks())
+            except Exception as e:
+                self.refresh_failures += 1
+                logger.error("Error al cargar el JWKS desde %s: %s", self.url or self.file, e)
+                return False
+
+            removed = set(self._keys) - set(keys)
+            self._keys = keys
+            self._loaded_at = time.monotonic()
+            self.refreshes += 1
+        if removed:
+            # Una clave retirada invalida también los tokens que ya se verificaron con ella
+            verified_token_cache.clear()
+            logger.warning("Claves JWKS retiradas (%s): caché de tokens vaciada.", ', '.join(str(kid) for kid in removed))
+        logger.info("JWKS cargado: %s claves de firma.", len(keys))
+        return True
+
+    async def _fetch_jwks(self) -> dict:
+        if self.file:
+            return json.loads(await asyncio.to_thread(Path(self.file).read_text, encoding="utf-8"))
+        response = await get_http_client().get(self.url)
+        response.raise_for_status()
+        return response.json()
+
+    def _parse_jwks(self, jwks: dict) -> Dict[Optional[str], Any]:
+        keys: Dict[Optional[str], Any] = {}
+        for key_data in jwks.get("keys", []):
+            if key_data.get("use", "sig") != "sig":
+                continue
+            # Sin "alg" en la JWK solo se puede asumir un algoritmo si hay uno único permitido
+            algorithm = key_data.get("alg") or (self.algorithms[0] if len(self.algorithms) == 1 else None)
+            if algorithm not in self.algorithms:
+                logger.warning("JWK '%s' ignorada: algoritmo %s no permitido.", key_data.get('kid'), algorithm)
+                continue
+            try:
+                keys[key_data.get("kid")] = jwk.construct(key_data, algorithm)
+            except JOSEError as e:
+                logger.warning("JWK '%s' ignorada: %s", key_data.get('kid'), e)
+        if not keys:
+            raise ValueError("el JWKS no contiene claves de firma utilizables")
+        return keys
+
+    def stats(self) -> dict:
+        return {
+            "configured": self.configured,
+            "source": self.url or self.file,
+            "keys": len(self._keys),
+            "loaded_seconds_ago": round(time.monotonic() - self._loaded_at, 1) if self.ready else None,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+        }
+
+
+class VerifiedTokenCache:
+    """
+    LRU acotada de tokens ya verificados: hash SHA-256 del token -> (exp, claims). Cada entrada caduca en el
+    `exp` del propio token, así las peticiones repetidas de una misma sesión no vuelven a verificar la firma.
+    Se guarda el hash y no el token para no retener credenciales en memoria.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[bytes, Tuple[float, dict]]" = OrderedDict()
+        self.evictions = 0
+
+    @staticmethod
+    def token_key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, key: bytes) -> Optional[dict]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, claims = entry
+        if expires_at <= time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return claims
+
+    def set(self, key: bytes, expires_at: float, claims: dict) -> None:
+        self._data[key] = (expires_at, claims)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def tokens_rejected_without_jwks() -> bool:
+    """
+    True si, sin JWKS configurado, los tokens Bearer se rechazan (401). Solo el valor explícito "anonymous" los
+    trata como 'No Login': cualquier otro, también uno mal escrito, rechaza.
+    """
+    return settings.JWT_UNVERIFIABLE_TOKENS.strip().lower() != "anonymous"
+
+
+def _allowed_algorithms() -> Tuple[str, ...]:
+    return tuple(alg.strip() for alg in settings.JWT_ALGORITHMS.split(",") if alg.strip())
+
+
+jwks_store = JWKSKeyStore(
+    url=settings.JWT_JWKS_URL,
+    file=settings.JWT_JWKS_FILE,
+    algorithms=_allowed_algorithms(),
+    refresh_interval=settings.JWT_JWKS_REFRESH_SECONDS,
+    min_refresh_interval=settings.JWT_JWKS_MIN_REFRESH_SECONDS,
+)
+verified_token_cache = VerifiedTokenCache(max_entries=settings.JWT_CACHE_MAX_ENTRIES)
+
+
+async def verify_token(token: str) -> dict:
+    """
+    Verifica firma y claims (exp, nbf, aud, iss) de un JWT y devuelve sus claims.
+    Lanza TokenVerificationError si el token no es válido.
+    """
+    cache_key = verified_token_cache.token_key(token)
+    claims = verified_token_cache.get(cache_key)
+    if claims is not None:
+        AUTH_TOKENS.labels("cache_hit").inc()
+        return claims
+
+    with timed("auth"):
+        try:
+            claims = await _verify_signature_and_claims(token)
+        except TokenVerificationError:
+            AUTH_TOKENS.labels("rejected").inc()
+            raise
+
+    AUTH_TOKENS.labels("verified").inc()
+    exp = claims.get("exp")
+    if isinstance(exp, (int, float)): # Sin exp no se cachea: no hay un instante en el que deje de ser válido
+        verified_token_cache.set(cache_key, float(exp), claims)
+    return claims
+
+
+async def _verify_signature_and_claims(token: str) -> dict:
+    if not jwks_store.configured:
+        raise TokenVerificationError("La verificación de tokens no está configurada en el servidor (JWT_JWKS_URL o JWT_JWKS_FILE).")
+    try:
+        header = jws.get_unverified_header(token)
+    except JOSEError as e:
+        raise TokenVerificationError(f"Cabecera del token ilegible: {e}")
+
+    algorithm = header.get("alg")
+    if algorithm not in jwks_store.algorithms:
+        raise TokenVerificationError(f"Algoritmo de firma no permitido: {algorithm}")
+    key = await jwks_store.get_key(header.get("kid"))
+    if key is None:
+        raise TokenVerificationError("Token firmado con una clave desconocida.")
+
+    try:
+        return jwt.decode(
+            token,
+            key,
+            algorithms=[algorithm],
+            audience=settings.JWT_AUDIENCE,
+            issuer=settings.JWT_ISSUER,
+            options={"verify_aud": settings.JWT_AUDIENCE is not None, "leeway": settings.JWT_LEEWAY_SECONDS},
+        )
+    except ExpiredSignatureError:
+        raise TokenVerificationError("El token ha expirado.")
+    except JWTClaimsError as e:
+        raise TokenVerificationError(f"Claims del token no válidos: {e}")
+    except JOSEError as e:
+        raise TokenVerificationError(f"Firma del token no válida: {e}")
+
+
+def get_auth_stats() -> dict:
+    return {
+        "jwks": jwks_store.stats(),
+        "token_cache_entries": len(verified_token_cache),
+        "token_cache_evictions": verified_token_cache.evictions,
+    }
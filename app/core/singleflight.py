@@ -0,0 +1,61 @@
+# app/core/singleflight.py
+from typing import Awaitable, Callable, Dict, Generic, TypeVar
+import asyncio
+
+T = TypeVar("T")
+
+
+class _Call(Generic[T]):
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[T]"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[T]):
+    """
+    Agrupa llamadas concurrentes con la misma clave en una sola ejecución ("single-flight").
+
+    La primera llamada lanza `fn()` en una tarea propia; las que llegan mientras sigue en curso
+    esperan esa misma tarea. El resultado o la excepción se entregan a todos los que esperan.
+    Cancelar a un llamador solo lo cancela a él (la tarea compartida está protegida con
+    asyncio.shield); la tarea compartida se cancela únicamente cuando ya nadie la espera.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, _Call[T]] = {}
+        self.executions = 0 # Llamadas que realmente ejecutaron fn()
+        self.coalesced = 0 # Llamadas que reutilizaron una ejecución en curso
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._inflight.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._inflight[key] = call
+            call.task.add_done_callback(lambda _task, key=key, call=call: self._forget(key, call))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # El último interesado se fue (cancelado): liberar la clave ya para que una
+                # llamada nueva no se enganche a una tarea que está a punto de cancelarse.
+                self._forget(key, call)
+                call.task.cancel()
+
+    def _forget(self, key: str, call: _Call[T]) -> None:
+        if self._inflight.get(key) is call:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
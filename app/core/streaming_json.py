@@ -0,0 +1,95 @@
+# app/core/streaming_json.py
+from typing import Any, Iterable, List, Optional, Set, Tuple, Union
+import json
+
+JSONPath = Tuple[Union[str, int], ...]
+
+
+class _Frame:
+    __slots__ = ("is_object", "path", "start", "key", "index")
+
+    def __init__(self, is_object: bool, path: JSONPath, start: int):
+        self.is_object = is_object
+        self.path = path
+        self.start = start
+        self.key: Optional[str] = None # Clave actual (objetos)
+        self.index = 0 # Posición actual (arrays)
+
+
+class IncrementalJSONScanner:
+    """
+    Analizador incremental de un objeto JSON que llega por fragmentos (p. ej. streaming de Gemini).
+
+    `feed()` recibe el siguiente fragmento de texto y devuelve los contenedores (objetos o arrays)
+    que se acaban de cerrar y cuya ruta está en `targets`, ya decodificados, p. ej.
+    `(("category_recommendations", "transport"), [...])`. Cada carácter se examina una sola vez;
+    el texto previo al primer '{' y posterior al objeto raíz (vallas ```json) se ignora.
+    """
+
+    def __init__(self, targets: Iterable[JSONPath]):
+        self.targets: Set[JSONPath] = set(targets)
+        self._text = ""
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._string_end = 0
+        self.done = False # El objeto raíz ya se cerró
+
+    @property
+    def text(self) -> str:
+        """Todo el texto recibido hasta el momento."""
+        return self._text
+
+    def feed(self, chunk: str) -> List[Tuple[JSONPath, Any]]:
+        self._text += chunk
+        text = self._text
+        completed: List[Tuple[JSONPath, Any]] = []
+        stack = self._stack
+        i = self._pos
+        n = len(text)
+
+        while i < n:
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._string_end = i
+                i += 1
+                continue
+
+            if not stack:
+                if c == "{" and not self.done:
+                    stack.append(_Frame(True, (), i))
+                i += 1
+                continue
+
+            frame = stack[-1]
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c == ":" and frame.is_object:
+                frame.key = json.loads(text[self._string_start:self._string_end + 1])
+            elif c == ",":
+                if frame.is_object:
+                    frame.key = None
+                else:
+                    frame.index += 1
+            elif c == "{" or c == "[":
+                child_step = frame.key if frame.is_object else frame.index
+                stack.append(_Frame(c == "{", frame.path + (child_step,), i))
+            elif c == "}" or c == "]":
+                closed = stack.pop()
+                if closed.path in self.targets:
+                    completed.append((closed.path, json.loads(text[closed.start:i + 1])))
+                if not stack:
+                    self.done = True
+            i += 1
+
+        self._pos = i
+        return completed
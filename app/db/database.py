@@ -1,146 +1,675 @@
 # app/db/database.py
-from typing import Optional
-import psycopg # O import psycopg2
-from psycopg.rows import dict_row # O from psycopg2.extras import RealDictCursor para psycopg2
-from psycopg.conninfo import make_conninfo # Para psycopg
+from typing import TYPE_CHECKING, Optional
 from app.core.config import settings
+from app.core.metrics import DB_ERRORS
+import functools
 import logging
-import json # Para convertir el payload de recomendaciones a JSON string para la BD
 from app.api.v1.schemas.recommendation import CategorySpecificSuggestion, RecommendationOutputSchema # Asumiendo tu schema de salida
 from datetime import date
 
-logging.basicConfig(level=logging.INFO)
+if TYPE_CHECKING:
+    from psycopg_pool import AsyncConnectionPool
+
 logger = logging.getLogger(__name__)
 
-# Usar el formato de URL estándar si está disponible, sino construirlo
-if settings.AWS_RDS_URL:
-    DATABASE_URL = settings.AWS_RDS_URL
-elif settings.DB_HOST and settings.DB_USER and settings.DB_PASSWORD and settings.DB_NAME:
-    # Para psycopg (v3)
-    DATABASE_URL = make_conninfo(
-        host=settings.DB_HOST,
-        user=settings.DB_USER,
-        password=settings.DB_PASSWORD,
-        dbname=settings.DB_NAME,
-        port=settings.DB_PORT,
-        sslmode=settings.DB_SSLMODE
+# psycopg y psycopg_pool se importan al abrir el pool (lifespan), no al importar el módulo: así el
+# arranque en frío no paga su coste y herramientas que solo usan build_insert_params tampoco.
+@functools.lru_cache(maxsize=1)
+def database_url() -> Optional[str]:
+    """DSN de la base de datos, construida (y registrada en el log) la primera vez que se necesita."""
+    # Usar el formato de URL estándar si está disponible, sino construirlo
+    if settings.AWS_RDS_URL:
+        url = settings.AWS_RDS_URL
+    elif settings.DB_HOST and settings.DB_USER and settings.DB_PASSWORD and settings.DB_NAME:
+        from psycopg.conninfo import make_conninfo # Para psycopg
+        # Para psycopg (v3)
+        url = make_conninfo(
+            host=settings.DB_HOST,
+            user=settings.DB_USER,
+            password=settings.DB_PASSWORD,
+            dbname=settings.DB_NAME,
+            port=settings.DB_PORT,
+            sslmode=settings.DB_SSLMODE
+        )
+        # Para psycopg2, la DSN string se vería así:
+        # DATABASE_URL = f"host='{settings.DB_HOST}' dbname='{settings.DB_NAME}' user='{settings.DB_USER}' password='{settings.DB_PASSWORD}' port='{settings.DB_PORT}' sslmode='{settings.DB_SSLMODE}'"
+    else:
+        logger.error("DATABASE_URL no se pudo construir. Verifica la configuración en .env.")
+        return None
+
+    logger.info("DATABASE_URL construida como: %s********...", url[:url.find('password=')+9]) # Oculta la contraseña en el log
+    return url
+
+_pool: Optional["AsyncConnectionPool"] = None
+
+# Esquema de user_recommendations detectado en la BD con la primera conexión (None: aún no se sabe o no se pudo
+# detectar, y cuenta DB_JSONB_STORAGE_ENABLED). Una tabla particionada es la de la migración 0004.
+_jsonb_storage: Optional[bool] = None
+
+async def _detect_storage_layout(conn) -> None:
+    """Callback `configure` del pool: se ejecuta en cada conexión nueva antes de entregarla."""
+    global _jsonb_storage
+    if _jsonb_storage is not None:
+        return
+    try:
+        cur = await conn.execute(
+            "SELECT relkind = 'p' AS partitioned FROM pg_class WHERE oid = to_regclass('user_recommendations');"
+        )
+        row = await cur.fetchone()
+        await conn.commit() # El pool exige recibir la conexión sin transacción abierta
+    except Exception as e:
+        logger.warning("No se pudo detectar el esquema de user_recommendations (se usa DB_JSONB_STORAGE_ENABLED): %s", e)
+        await conn.rollback()
+        return
+    if row is None:
+        return # Sin tabla todavía: se vuelve a intentar con la siguiente conexión
+    _jsonb_storage = bool(row["partitioned"])
+    if _jsonb_storage != bool(settings.DB_JSONB_STORAGE_ENABLED):
+        logger.warning(
+            "DB_JSONB_STORAGE_ENABLED=%s no coincide con la base de datos (migración 0004 %s): se usa el esquema de la BD.",
+            settings.DB_JSONB_STORAGE_ENABLED, "aplicada" if _jsonb_storage else "sin aplicar"
+        )
+
+def jsonb_storage_enabled() -> bool:
+    """True si las filas se guardan en el esquema compacto de la migración 0004 (payload JSONB, tabla particionada)."""
+    return bool(settings.DB_JSONB_STORAGE_ENABLED) if _jsonb_storage is None else _jsonb_storage
+
+async def open_db_pool() -> None:
+    """
+    Crea y abre el pool asíncrono de conexiones. Se llama una sola vez desde el lifespan de FastAPI.
+    La apertura no espera a que las conexiones mínimas estén listas: se crean en segundo plano,
+    así un RDS lento o caído no bloquea el arranque de uvicorn.
+    """
+    global _pool
+    if _pool is not None:
+        return
+    dsn = database_url()
+    if not dsn:
+        logger.error("No se abre el pool de conexiones: DATABASE_URL no está configurada.")
+        return
+
+    from psycopg.rows import dict_row # O from psycopg2.extras import RealDictCursor para psycopg2
+    from psycopg_pool import AsyncConnectionPool
+    pool = AsyncConnectionPool(
+        dsn,
+        min_size=settings.DB_POOL_MIN_SIZE,
+        max_size=settings.DB_POOL_MAX_SIZE,
+        timeout=settings.DB_POOL_TIMEOUT,
+        max_idle=settings.DB_POOL_MAX_IDLE,
+        max_lifetime=settings.DB_POOL_MAX_LIFETIME,
+        kwargs={"connect_timeout": settings.DB_CONNECT_TIMEOUT, "row_factory": dict_row},
+        check=AsyncConnectionPool.check_connection if settings.DB_POOL_CHECK_CONNECTIONS else None,
+        configure=_detect_storage_layout,
+        name="ecofootprint-db",
+        open=False,
     )
-    # Para psycopg2, la DSN string se vería así:
-    # DATABASE_URL = f"host='{settings.DB_HOST}' dbname='{settings.DB_NAME}' user='{settings.DB_USER}' password='{settings.DB_PASSWORD}' port='{settings.DB_PORT}' sslmode='{settings.DB_SSLMODE}'"
-else:
-    DATABASE_URL = None
-    logger.error("DATABASE_URL no se pudo construir. Verifica la configuración en .env.")
-
-if DATABASE_URL: 
-    logger.info(f"DATABASE_URL construida como: {DATABASE_URL[:DATABASE_URL.find('password=')+9]}********...") # Oculta la contraseña en el log
-
-def get_db_connection():
-    if not DATABASE_URL:
-        logger.error("Intento de conexión a BD fallido: DATABASE_URL no está configurada.")
+    try:
+        await pool.open(wait=False)
+    except Exception as e:
+        logger.error("Error al abrir el pool de conexiones a la base de datos: %s", e)
+        DB_ERRORS.labels("pool_open").inc()
+        return
+    _pool = pool
+    logger.info("Pool de conexiones abierto (min=%s, max=%s).", settings.DB_POOL_MIN_SIZE, settings.DB_POOL_MAX_SIZE)
+
+async def close_db_pool() -> None:
+    """Cierra el pool de conexiones (lifespan shutdown)."""
+    global _pool, _jsonb_storage
+    if _pool is None:
+        return
+    pool, _pool, _jsonb_storage = _pool, None, None
+    await pool.close()
+    logger.info("Pool de conexiones a la base de datos cerrado.")
+
+def db_pool_ready() -> bool:
+    """Listo para recibir tráfico: el pool está abierto, o no hay BD configurada (la API funciona sin guardar)."""
+    if _pool is None:
+        return not database_url()
+    return not _pool.closed
+
+def get_db_pool_stats() -> dict:
+    """Estadísticas del pool (conexiones en uso, esperas, errores...) para el endpoint de estado."""
+    if _pool is None:
+        return {"configured": bool(database_url()), "open": False}
+    return {"configured": True, "open": not _pool.closed, **_pool.get_stats()}
+
+INSERT_RECOMMENDATIONS_COLUMNS = (
+    "user_id",
+    "calculation_date",
+    "recommendations_payload",
+    "global_rec_suggestion",
+    "transport_rec1_suggestion",
+    "transport_rec2_suggestion",
+    "food_rec1_suggestion",
+    "food_rec2_suggestion",
+    "energy_rec1_suggestion",
+    "energy_rec2_suggestion",
+    "waste_rec1_suggestion",
+    "waste_rec2_suggestion",
+)
+
+# Con la migración 0004 la tabla guarda solo el JSONB compacto: las sugerencias desglosadas se leen de la vista
+# user_recommendations_flat en lugar de copiarse en cada fila.
+JSONB_INSERT_RECOMMENDATIONS_COLUMNS = INSERT_RECOMMENDATIONS_COLUMNS[:3]
+
+# Con IDEMPOTENT_RECOMMENDATIONS_ENABLED (migración 0003) cada fila lleva la huella de su entrada y una misma
+# (usuario, fecha, huella) no duplica la fila: se actualiza la guardada (upsert, válido también en INSERT multi-fila).
+# Solo se reescribe si el payload cambia (p. ej. una fila guardada que ya no valida y se regeneró): un reenvío
+# simultáneo con la misma respuesta no toca la fila ni la devuelve en RETURNING.
+IDEMPOTENT_CONFLICT_TARGET = "(user_id, calculation_date, input_fingerprint)"
+
+def _insert_recommendations_sql(row_count: int, returning: bool = False) -> str:
+    """
+    INSERT de `row_count` filas en una sola sentencia (VALUES (...), (...), ...). En el modo idempotente una fila
+    con la misma huella sustituye a la guardada. Con `returning` devuelve el id de cada fila insertada o
+    actualizada (ninguna si la guardada ya tenía el mismo payload).
+    """
+    return _build_insert_recommendations_sql(
+        row_count, settings.IDEMPOTENT_RECOMMENDATIONS_ENABLED, jsonb_storage_enabled(), returning
+    )
+
+@functools.lru_cache(maxsize=64)
+def _build_insert_recommendations_sql(row_count: int, idempotent: bool, jsonb: bool, returning: bool = False) -> str:
+    columns = JSONB_INSERT_RECOMMENDATIONS_COLUMNS if jsonb else INSERT_RECOMMENDATIONS_COLUMNS
+    columns += ("input_fingerprint",) if idempotent else ()
+    placeholders = ["%s::jsonb" if jsonb and column == "recommendations_payload" else "%s" for column in columns]
+    row_placeholders = "(" + ", ".join(placeholders) + ")"
+    on_conflict = ""
+    if idempotent:
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns[2:-1]) # Sin la clave del conflicto
+        on_conflict = (
+            f" ON CONFLICT {IDEMPOTENT_CONFLICT_TARGET} DO UPDATE SET {updates}"
+            " WHERE user_recommendations.recommendations_payload IS DISTINCT FROM EXCLUDED.recommendations_payload"
+        )
+    return (
+        f"INSERT INTO user_recommendations ({', '.join(columns)}) "
+        f"VALUES {', '.join([row_placeholders] * row_count)}{on_conflict}{' RETURNING id' if returning else ''};"
+    )
+
+def _unique_insert_rows(rows: list[tuple]) -> list[tuple]:
+    """
+    Con el upsert, una misma (usuario, fecha, huella) no puede aparecer dos veces en el INSERT ("cannot affect row
+    a second time"): se queda la última. Las filas sin huella (anónimas) nunca chocan y se conservan todas.
+    """
+    if not settings.IDEMPOTENT_RECOMMENDATIONS_ENABLED:
+        return rows
+    unique: dict = {}
+    for index, row in enumerate(rows):
+        unique[(row[0], row[1], row[-1]) if row[-1] is not None else index] = row
+    return list(unique.values())
+
+_INSERT_OUTBOX_SQL = "INSERT INTO webhook_outbox (payload) VALUES (%s);"
+
+def build_insert_params(
+    user_id: str,
+    calculation_date: date,
+    recommendations: RecommendationOutputSchema,
+    input_fingerprint: Optional[str] = None
+) -> tuple:
+    """
+    Construye la tupla de parámetros (JSON completo y desglosado) de una fila. Vale para los dos esquemas:
+    _insert_params descarta las columnas desglosadas si la tabla es la compacta, al insertar y no al construirla
+    (las filas del write-behind se construyen antes de saber qué esquema tiene la BD).
+    """
+    recommendations_json_str = recommendations.to_json().decode() # Misma serialización que la respuesta HTTP
+
+    # Extraer las sugerencias individuales
+    # La global_recommendation es del tipo FullRecommendation, así que tiene .suggestion
+    global_suggestion = recommendations.global_recommendation.suggestion if recommendations.global_recommendation else None
+
+    # Las recomendaciones por categoría ahora contienen objetos CategorySpecificSuggestion
+    def get_specific_suggestion_or_none(sug_list: list[CategorySpecificSuggestion], index: int) -> Optional[str]:
+        return sug_list[index].suggestion if len(sug_list) > index and sug_list[index] else None
+
+    transport_sugs = recommendations.category_recommendations.transport
+    food_sugs = recommendations.category_recommendations.food
+    energy_sugs = recommendations.category_recommendations.energy
+    waste_sugs = recommendations.category_recommendations.waste
+
+    params = (
+        user_id,
+        calculation_date,
+        recommendations_json_str,
+        global_suggestion,
+        get_specific_suggestion_or_none(transport_sugs, 0),
+        get_specific_suggestion_or_none(transport_sugs, 1),
+        get_specific_suggestion_or_none(food_sugs, 0),
+        get_specific_suggestion_or_none(food_sugs, 1),
+        get_specific_suggestion_or_none(energy_sugs, 0),
+        get_specific_suggestion_or_none(energy_sugs, 1),
+        get_specific_suggestion_or_none(waste_sugs, 0),
+        get_specific_suggestion_or_none(waste_sugs, 1),
+    )
+    if settings.IDEMPOTENT_RECOMMENDATIONS_ENABLED:
+        params += (input_fingerprint,)
+    return params
+
+def _insert_params(rows: list[tuple]) -> list:
+    """Parámetros de _insert_recommendations_sql para filas de build_insert_params, según el esquema en uso."""
+    if not jsonb_storage_enabled():
+        return [value for row in rows for value in row]
+    copied = len(INSERT_RECOMMENDATIONS_COLUMNS)
+    return [value for row in rows for value in (*row[:3], *row[copied:])]
+
+async def ensure_recommendation_partitions(months_ahead: int) -> bool:
+    """
+    Crea (si faltan) las particiones mensuales de user_recommendations desde el mes actual hasta `months_ahead`
+    meses después, vía la función SQL de la migración 0004. Idempotente; devuelve False si falla.
+    """
+    if _pool is None:
+        return False
+    try:
+        async with _pool.connection() as conn:
+            if not jsonb_storage_enabled():
+                return True # Esquema antiguo, sin particiones
+            await conn.execute("SELECT ensure_user_recommendations_partitions(%s);", (months_ahead,))
+        return True
+    except Exception as e:
+        logger.error("Error al crear las particiones mensuales de user_recommendations: %s", e)
+        DB_ERRORS.labels("partitions").inc()
+        return False
+
+async def insert_recommendations(
+    user_id: str,
+    calculation_date: date,
+    recommendations: RecommendationOutputSchema, # Usa el schema actualizado
+    input_fingerprint: Optional[str] = None,
+    outbox_payload: Optional[str] = None
+) -> bool:
+    """
+    Inserta las recomendaciones (JSON completo y desglosado) para un usuario usando una conexión del pool.
+    Con `outbox_payload` añade su entrega a webhook_outbox en la misma transacción: o se guardan ambas o ninguna.
+    Si el modo idempotente no escribe nada (la fila guardada ya tenía el mismo payload), tampoco se encola la entrega.
+    """
+    if _pool is None:
+        logger.error("No se puede insertar en la BD: el pool de conexiones no está abierto.")
+        DB_ERRORS.labels("pool_closed").inc()
+        return False
+
+    from psycopg_pool import PoolTimeout # Ya importado al abrir el pool
+    try:
+        row = build_insert_params(user_id, calculation_date, recommendations, input_fingerprint)
+        # pool.connection() hace commit al salir del bloque y rollback si hay excepción
+        async with _pool.connection() as conn:
+            params = _insert_params([row]) # Ya con una conexión: el esquema de la BD está detectado
+            async with conn.cursor() as cur:
+                if outbox_payload is None:
+                    await cur.execute(_insert_recommendations_sql(1), params)
+                else:
+                    await cur.execute(_insert_recommendations_sql(1, returning=True), params)
+                    if await cur.fetchone() is not None:
+                        await cur.execute(_INSERT_OUTBOX_SQL, (outbox_payload,))
+        logger.debug("Recomendaciones (completo y desglosado) insertadas para el usuario %s en la fecha %s.", user_id, calculation_date)
+        return True
+    except PoolTimeout as e:
+        logger.error("Timeout esperando una conexión libre del pool para insertar recomendaciones de %s: %s", user_id, e)
+        DB_ERRORS.labels("pool_timeout").inc()
+        return False
+    except Exception as e:
+        logger.error("Error al insertar recomendaciones desglosadas en la base de datos para %s: %s", user_id, e)
+        DB_ERRORS.labels("insert").inc()
+        return False
+
+async def insert_recommendations_batch(rows: list[tuple]) -> bool:
+    """
+    Inserta varias filas (tuplas de build_insert_params) con un único INSERT multi-fila y un solo commit.
+    Devuelve False si la sentencia falla; en ese caso no se ha insertado ninguna fila. Si el lote repite una
+    misma (usuario, fecha, huella) se guarda la última.
+    """
+    if not rows:
+        return True
+    if _pool is None:
+        logger.error("No se puede insertar el lote en la BD: el pool de conexiones no está abierto.")
+        DB_ERRORS.labels("pool_closed").inc()
+        return False
+
+    rows = _unique_insert_rows(rows)
+    try:
+        async with _pool.connection() as conn:
+            params = _insert_params(rows)
+            async with conn.cursor() as cur:
+                await cur.execute(_insert_recommendations_sql(len(rows)), params)
+        return True
+    except Exception as e:
+        logger.error("Error al insertar un lote de %s recomendaciones en la base de datos: %s", len(rows), e)
+        DB_ERRORS.labels("insert_batch").inc()
+        return False
+
+async def fetch_recommendation_by_fingerprint(
+    user_id: str,
+    calculation_date: date,
+    input_fingerprint: str
+) -> Optional[str]:
+    """JSON guardado para la misma entrada (usuario, fecha y huella de la entrada), o None si no existe o hay error."""
+    if _pool is None:
         return None
     try:
-        logger.info(f"Intentando conectar a la base de datos con DSN (parcial): {DATABASE_URL[:DATABASE_URL.find('password=')+9]}********...")
-        # Puedes añadir un connect_timeout si psycopg lo soporta directamente en la DSN o como parámetro
-        # Para psycopg3, el timeout se puede pasar en la DSN: ?connect_timeout=10
-        # O como parámetro: psycopg.connect(DATABASE_URL, connect_timeout=10, row_factory=dict_row)
-        # Un timeout corto (ej. 10 segundos) ayudará a diagnosticar si es un problema de red/accesibilidad.
-        conn = psycopg.connect(DATABASE_URL, connect_timeout=10, row_factory=dict_row)
-        logger.info("¡Conexión a la base de datos establecida exitosamente!")
-        return conn
-    except psycopg.OperationalError as e: # Captura errores específicos de conexión
-        logger.error(f"Error OPERACIONAL al conectar a la base de datos: {e}")
-        logger.error(f"Detalles del error: {e.pgcode} - {e.pgerror}")
-        logger.error(f"DSN usada (parcial): {DATABASE_URL[:DATABASE_URL.find('password=')+9]}********...")
+        async with _pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT recommendations_payload::text AS payload FROM user_recommendations "
+                    "WHERE user_id = %s AND calculation_date = %s AND input_fingerprint = %s LIMIT 1;",
+                    (user_id, calculation_date, input_fingerprint)
+                )
+                row = await cur.fetchone()
+        return row["payload"] if row else None
+    except Exception as e:
+        logger.error("Error al buscar recomendaciones ya guardadas de %s para %s: %s", user_id, calculation_date, e)
+        DB_ERRORS.labels("idempotent_lookup").inc()
+        return None
+
+async def fetch_cached_recommendation(cache_key: str) -> Optional[str]:
+    """Lee una entrada vigente del nivel compartido de la caché (tabla recommendation_cache)."""
+    if _pool is None:
         return None
+    try:
+        async with _pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT payload FROM recommendation_cache WHERE cache_key = %s AND expires_at > now();",
+                    (cache_key,)
+                )
+                row = await cur.fetchone()
+        return row["payload"] if row else None
     except Exception as e:
-        logger.error(f"Error GENERAL al conectar a la base de datos: {e}")
+        logger.error("Error al leer la caché compartida de recomendaciones: %s", e)
+        DB_ERRORS.labels("cache_fetch").inc()
         return None
 
-def insert_recommendations(
+async def store_cached_recommendation(cache_key: str, payload: str, ttl_seconds: float) -> bool:
+    """Guarda (o reemplaza) una entrada en el nivel compartido de la caché."""
+    if _pool is None:
+        return False
+    try:
+        async with _pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    INSERT INTO recommendation_cache (cache_key, payload, expires_at)
+                    VALUES (%s, %s, now() + make_interval(secs => %s))
+                    ON CONFLICT (cache_key) DO UPDATE
+                        SET payload = EXCLUDED.payload, expires_at = EXCLUDED.expires_at;
+                    """,
+                    (cache_key, payload, ttl_seconds)
+                )
+        return True
+    except Exception as e:
+        logger.error("Error al escribir en la caché compartida de recomendaciones: %s", e)
+        DB_ERRORS.labels("cache_store").inc()
+        return False
+
+async def purge_expired_cached_recommendations() -> int:
+    """Borra las entradas caducadas de la caché compartida. Devuelve cuántas se eliminaron."""
+    if _pool is None:
+        return 0
+    try:
+        async with _pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("DELETE FROM recommendation_cache WHERE expires_at <= now();")
+                return cur.rowcount
+    except Exception as e:
+        logger.error("Error al purgar la caché compartida de recomendaciones: %s", e)
+        DB_ERRORS.labels("cache_purge").inc()
+        return 0
+
+def _history_sql(with_payload: bool, with_cursor: bool) -> str:
+    """Página del historial de un usuario, más reciente primero (índice idx_user_recommendations_history)."""
+    columns = "id, calculation_date, xmin::text AS row_version"
+    if with_payload:
+        columns += ", recommendations_payload::text AS payload" # Texto tal cual: sin parsear el JSON guardado
+    keyset = " AND (calculation_date, id) < (%s, %s)" if with_cursor else ""
+    return (
+        f"SELECT {columns} FROM user_recommendations WHERE user_id = %s{keyset} "
+        "ORDER BY calculation_date DESC, id DESC LIMIT %s;"
+    )
+
+async def fetch_recommendation_history(
     user_id: str,
-    calculation_date: date,
-    recommendations: RecommendationOutputSchema # Usa el schema actualizado
-) -> bool:
-    """Inserta las recomendaciones (JSON completo y desglosado) para un usuario."""
-    if not DATABASE_URL:
-        logger.error("No se puede insertar en la BD: DATABASE_URL no está configurada.")
-        return False
-
-    conn = None
-    try:
-        conn = get_db_connection()
-        if conn is None:
-            return False
-
-        recommendations_json_str = recommendations.model_dump_json(indent=2)
-
-        # Extraer las sugerencias individuales
-        # La global_recommendation es del tipo FullRecommendation, así que tiene .suggestion
-        global_suggestion = recommendations.global_recommendation.suggestion if recommendations.global_recommendation else None
-
-        # Las recomendaciones por categoría ahora contienen objetos CategorySpecificSuggestion
-        def get_specific_suggestion_or_none(sug_list: list[CategorySpecificSuggestion], index: int) -> Optional[str]:
-            return sug_list[index].suggestion if len(sug_list) > index and sug_list[index] else None
-
-        transport_sugs = recommendations.category_recommendations.transport
-        transport_sug1 = get_specific_suggestion_or_none(transport_sugs, 0)
-        transport_sug2 = get_specific_suggestion_or_none(transport_sugs, 1)
-
-        food_sugs = recommendations.category_recommendations.food
-        food_sug1 = get_specific_suggestion_or_none(food_sugs, 0)
-        food_sug2 = get_specific_suggestion_or_none(food_sugs, 1)
-
-        energy_sugs = recommendations.category_recommendations.energy
-        energy_sug1 = get_specific_suggestion_or_none(energy_sugs, 0)
-        energy_sug2 = get_specific_suggestion_or_none(energy_sugs, 1)
-
-        waste_sugs = recommendations.category_recommendations.waste
-        waste_sug1 = get_specific_suggestion_or_none(waste_sugs, 0)
-        waste_sug2 = get_specific_suggestion_or_none(waste_sugs, 1)
-
-        sql = """
-            INSERT INTO user_recommendations (
-                user_id,
-                calculation_date,
-                recommendations_payload,
-                global_rec_suggestion,
-                transport_rec1_suggestion,
-                transport_rec2_suggestion,
-                food_rec1_suggestion,
-                food_rec2_suggestion,
-                energy_rec1_suggestion,
-                energy_rec2_suggestion,
-                waste_rec1_suggestion,
-                waste_rec2_suggestion
+    limit: int,
+    after: Optional[tuple[date, int]] = None,
+    with_payload: bool = True
+) -> Optional[list[dict]]:
+    """
+    Filas (id, calculation_date, row_version y, si se pide, payload) del historial de `user_id` posteriores
+    al cursor `after` = (calculation_date, id) en orden descendente. Sin payload la consulta no lee el JSON,
+    lo que basta para calcular el ETag de una página. Devuelve None si la BD no está disponible.
+    """
+    if _pool is None:
+        logger.error("No se puede leer el historial: el pool de conexiones no está abierto.")
+        DB_ERRORS.labels("pool_closed").inc()
+        return None
+    params = (user_id, *after, limit) if after else (user_id, limit)
+    try:
+        async with _pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(_history_sql(with_payload, after is not None), params)
+                return await cur.fetchall()
+    except Exception as e:
+        logger.error("Error al leer el historial de recomendaciones de %s: %s", user_id, e)
+        DB_ERRORS.labels("history").inc()
+        return None
+
+# Trabajos asíncronos (migrations/0005). El más prioritario y antiguo primero; SKIP LOCKED reparte la cola entre
+# workers y réplicas sin bloqueos, y un 'running' con el lease caducado (worker caído) vuelve a reclamarse.
+_CLAIM_JOB_SQL = """
+UPDATE recommendation_jobs
+SET status = 'running', attempts = attempts + 1, started_at = now(),
+    locked_until = now() + make_interval(secs => %s)
+WHERE id = (
+    SELECT id FROM recommendation_jobs
+    WHERE status = 'queued' OR (status = 'running' AND locked_until < now())
+    ORDER BY priority DESC, created_at
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id::text AS id, user_id, engine, input_payload::text AS input_payload, attempts;
+"""
+
+async def insert_job(job_id: str, user_id: str, priority: int, engine: Optional[str], input_payload: str) -> bool:
+    """Encola un trabajo ('queued'). Devuelve False si la BD no está disponible."""
+    if _pool is None:
+        logger.error("No se puede encolar el trabajo: el pool de conexiones no está abierto.")
+        DB_ERRORS.labels("pool_closed").inc()
+        return False
+    try:
+        async with _pool.connection() as conn:
+            await conn.execute(
+                "INSERT INTO recommendation_jobs (id, user_id, priority, engine, input_payload) "
+                "VALUES (%s::uuid, %s, %s, %s, %s::jsonb);",
+                (job_id, user_id, priority, engine, input_payload)
             )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-        """
-        with conn.cursor() as cur:
-            cur.execute(sql, (
-                user_id,
-                calculation_date,
-                recommendations_json_str,
-                global_suggestion,
-                transport_sug1,
-                transport_sug2,
-                food_sug1,
-                food_sug2,
-                energy_sug1,
-                energy_sug2,
-                waste_sug1,
-                waste_sug2
-            ))
-            conn.commit()
-        logger.info(f"Recomendaciones (completo y desglosado) insertadas para el usuario {user_id} en la fecha {calculation_date}.")
         return True
     except Exception as e:
-        logger.error(f"Error al insertar recomendaciones desglosadas en la base de datos para {user_id}: {e}")
-        if conn:
-            conn.rollback()
+        logger.error("Error al encolar el trabajo %s de %s: %s", job_id, user_id, e)
+        DB_ERRORS.labels("job_insert").inc()
         return False
-    finally:
-        if conn:
-            conn.close()
-            logger.info("Conexión a la base de datos cerrada.")
 
+async def claim_job(lease_seconds: float) -> Optional[dict]:
+    """Reclama el siguiente trabajo pendiente (lo pasa a 'running' durante `lease_seconds`), o None si no hay."""
+    if _pool is None:
+        return None
+    try:
+        async with _pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(_CLAIM_JOB_SQL, (lease_seconds,))
+                return await cur.fetchone()
+    except Exception as e:
+        logger.error("Error al reclamar un trabajo de la cola: %s", e)
+        DB_ERRORS.labels("job_claim").inc()
+        return None
 
+async def finish_job(job_id: str, result_payload: Optional[bytes], error: Optional[str] = None) -> bool:
+    """Marca el trabajo como 'succeeded' con su resultado, o como 'failed' con `error` si no hay resultado."""
+    if _pool is None:
+        return False
+    try:
+        async with _pool.connection() as conn:
+            await conn.execute(
+                "UPDATE recommendation_jobs SET status = %s, result_payload = %s::jsonb, error = %s, "
+                "finished_at = now(), locked_until = NULL WHERE id = %s::uuid;",
+                ("succeeded" if result_payload is not None else "failed",
+                 result_payload.decode() if result_payload is not None else None, error, job_id)
+            )
+        return True
+    except Exception as e:
+        logger.error("Error al guardar el resultado del trabajo %s: %s", job_id, e)
+        DB_ERRORS.labels("job_finish").inc()
+        return False
+
+async def release_job(job_id: str) -> bool:
+    """Devuelve a la cola un trabajo reclamado sin consumir el intento (apagado o Gemini saturado)."""
+    if _pool is None:
+        return False
+    try:
+        async with _pool.connection() as conn:
+            await conn.execute(
+                "UPDATE recommendation_jobs SET status = 'queued', attempts = attempts - 1, started_at = NULL, "
+                "locked_until = NULL WHERE id = %s::uuid AND status = 'running';",
+                (job_id,)
+            )
+        return True
+    except Exception as e:
+        logger.error("Error al devolver a la cola el trabajo %s: %s", job_id, e)
+        DB_ERRORS.labels("job_release").inc()
+        return False
+
+async def fetch_job(job_id: str) -> Optional[dict]:
+    """Estado de un trabajo (con el resultado como texto JSON, sin parsear); {} si no existe, None si la BD no está disponible."""
+    if _pool is None:
+        logger.error("No se puede leer el trabajo: el pool de conexiones no está abierto.")
+        DB_ERRORS.labels("pool_closed").inc()
+        return None
+    try:
+        async with _pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT id::text AS id, user_id, status, priority, result_payload::text AS result, error, attempts, "
+                    "created_at, started_at, finished_at FROM recommendation_jobs WHERE id = %s::uuid;",
+                    (job_id,)
+                )
+                return await cur.fetchone() or {}
+    except Exception as e:
+        logger.error("Error al leer el trabajo %s: %s", job_id, e)
+        DB_ERRORS.labels("job_fetch").inc()
+        return None
+
+async def purge_finished_jobs(retention_hours: float) -> int:
+    """Borra los trabajos terminados hace más de `retention_hours`. Devuelve cuántos se eliminaron."""
+    if _pool is None:
+        return 0
+    try:
+        async with _pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "DELETE FROM recommendation_jobs WHERE finished_at < now() - %s * INTERVAL '1 hour';",
+                    (retention_hours,)
+                )
+                return cur.rowcount
+    except Exception as e:
+        logger.error("Error al purgar trabajos terminados: %s", e)
+        DB_ERRORS.labels("job_purge").inc()
+        return 0
+
+# --- Outbox del webhook (migrations/0006_webhook_outbox.sql) ---
+
+# Reclama un lote de entregas vencidas: next_attempt_at se aplaza `lease` segundos mientras se envían, así otra
+# réplica no las toma a la vez y, si este proceso cae, vuelven a estar pendientes cuando vence el plazo.
+_CLAIM_OUTBOX_SQL = """
+UPDATE webhook_outbox
+SET next_attempt_at = now() + make_interval(secs => %s)
+WHERE id IN (
+    SELECT id FROM webhook_outbox
+    WHERE status = 'pending' AND next_attempt_at <= now()
+    ORDER BY next_attempt_at
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, payload, attempts, extract(epoch FROM now() - created_at)::float8 AS age_seconds;
+"""
+
+async def claim_outbox_entries(batch_size: int, lease_seconds: float) -> list[dict]:
+    """Hasta `batch_size` entregas pendientes y vencidas, reservadas durante `lease_seconds`; [] si no hay o hay error."""
+    if _pool is None:
+        return []
+    try:
+        async with _pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(_CLAIM_OUTBOX_SQL, (lease_seconds, batch_size))
+                return await cur.fetchall()
+    except Exception as e:
+        logger.error("Error al reclamar entregas del outbox del webhook: %s", e)
+        DB_ERRORS.labels("outbox_claim").inc()
+        return []
+
+async def mark_outbox_delivered(entry_ids: list[int]) -> bool:
+    """Marca como entregadas las entradas de `entry_ids` (una sola sentencia)."""
+    if _pool is None or not entry_ids:
+        return False
+    try:
+        async with _pool.connection() as conn:
+            await conn.execute(
+                "UPDATE webhook_outbox SET status = 'delivered', attempts = attempts + 1, delivered_at = now(), "
+                "last_error = NULL WHERE id = ANY(%s);",
+                (entry_ids,)
+            )
+        return True
+    except Exception as e:
+        logger.error("Error al marcar %s entregas del outbox como enviadas: %s", len(entry_ids), e)
+        DB_ERRORS.labels("outbox_delivered").inc()
+        return False
+
+async def mark_outbox_failed(failures: list[tuple[int, Optional[float], str]]) -> bool:
+    """
+    Registra entregas fallidas, cada una como (id, segundos hasta el reintento, error). Sin segundos (None),
+    la entrada pasa a 'dead' y el dispatcher no la vuelve a intentar.
+    """
+    if _pool is None or not failures:
+        return False
+    try:
+        async with _pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany(
+                    "UPDATE webhook_outbox SET attempts = attempts + 1, last_error = %s, "
+                    "status = CASE WHEN %s::float8 IS NULL THEN 'dead' ELSE 'pending' END, "
+                    "next_attempt_at = now() + make_interval(secs => COALESCE(%s::float8, 0)) WHERE id = %s;",
+                    [(error, delay, delay, entry_id) for entry_id, delay, error in failures]
+                )
+        return True
+    except Exception as e:
+        logger.error("Error al reprogramar %s entregas fallidas del outbox: %s", len(failures), e)
+        DB_ERRORS.labels("outbox_failed").inc()
+        return False
+
+async def fetch_outbox_backlog() -> Optional[dict]:
+    """Entregas pendientes y antigüedad en segundos de la más antigua (0 si no hay), o None si hay error."""
+    if _pool is None:
+        return None
+    try:
+        async with _pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT count(*) AS pending, COALESCE(extract(epoch FROM now() - min(created_at)), 0)::float8 "
+                    "AS lag_seconds FROM webhook_outbox WHERE status = 'pending';"
+                )
+                return await cur.fetchone()
+    except Exception as e:
+        logger.error("Error al leer el backlog del outbox del webhook: %s", e)
+        DB_ERRORS.labels("outbox_backlog").inc()
+        return None
+
+async def purge_delivered_outbox(retention_hours: float) -> int:
+    """Borra las entregas hechas hace más de `retention_hours` (las 'dead' se conservan). Devuelve cuántas."""
+    if _pool is None:
+        return 0
+    try:
+        async with _pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "DELETE FROM webhook_outbox WHERE status = 'delivered' AND delivered_at < now() - %s * INTERVAL '1 hour';",
+                    (retention_hours,)
+                )
+                return cur.rowcount
+    except Exception as e:
+        logger.error("Error al purgar entregas antiguas del outbox del webhook: %s", e)
+        DB_ERRORS.labels("outbox_purge").inc()
+        return 0
@@ -0,0 +1,142 @@
+# app/db/write_behind.py
+from typing import List, Optional
+from app.api.v1.schemas.recommendation import RecommendationOutputSchema
+from app.core.config import settings
+from app.core.metrics import timed
+from app.db.database import build_insert_params, insert_recommendations_batch
+from datetime import date
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_STOP = object() # Centinela para que el flusher vacíe la cola y termine
+
+
+class WriteBehindQueue:
+    """
+    Cola acotada de filas de user_recommendations que una tarea en segundo plano inserta por lotes.
+
+    Un lote se envía cuando alcanza `batch_size` filas o cuando la fila más antigua lleva
+    `flush_interval` segundos esperando. Con la cola llena, `enqueue` espera hasta
+    `enqueue_timeout` (backpressure) y, si no hay hueco, devuelve False para que el llamador
+    inserte la fila directamente. Al parar se vacía la cola antes de terminar.
+    """
+
+    def __init__(self, max_size: int, batch_size: int, flush_interval: float, enqueue_timeout: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued_rows = 0
+        self.rejected_rows = 0 # Cola llena tras enqueue_timeout: el llamador insertó directo
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self.batches = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if not self.running:
+            self._task = asyncio.create_task(self._run(), name="write-behind-flusher")
+            logger.info("Write-behind iniciado (lote=%s, intervalo=%ss).", self.batch_size, self.flush_interval)
+
+    async def stop(self) -> None:
+        """Vacía la cola pendiente y detiene el flusher (lifespan shutdown)."""
+        if not self.running:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        logger.info("Write-behind detenido. Filas insertadas: %s, fallidas: %s.", self.flushed_rows, self.failed_rows)
+
+    async def enqueue(
+        self,
+        user_id: str,
+        calculation_date: date,
+        recommendations: RecommendationOutputSchema,
+        input_fingerprint: Optional[str] = None
+    ) -> bool:
+        """Encola una fila. Devuelve False si el flusher no está activo o la cola sigue llena tras el timeout."""
+        if not self.running:
+            return False
+        # Se serializa ahora: cambios posteriores al objeto (p. ej. notas) no afectan a la fila guardada
+        row = build_insert_params(user_id, calculation_date, recommendations, input_fingerprint)
+        try:
+            await asyncio.wait_for(self._queue.put(row), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected_rows += 1
+            logger.warning("Cola write-behind llena: la fila se insertará de forma directa.")
+            return False
+        self.enqueued_rows += 1
+        return True
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+            batch: List[tuple] = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is _STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+            await self._flush(batch)
+
+        # Drenaje final: todo lo que quedó en cola tras el centinela
+        remaining: List[tuple] = []
+        while not self._queue.empty():
+            row = self._queue.get_nowait()
+            if row is not _STOP:
+                remaining.append(row)
+        for start in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[start:start + self.batch_size])
+
+    async def _flush(self, batch: List[tuple]) -> None:
+        self.batches += 1
+        with timed("db_batch"):
+            inserted = await insert_recommendations_batch(batch)
+        if inserted:
+            self.flushed_rows += len(batch)
+            return
+        # El INSERT multi-fila es atómico: si falla, se reintenta fila a fila para aislar las filas problemáticas
+        logger.warning("Falló el lote write-behind de %s filas; reintentando fila a fila.", len(batch))
+        for row in batch:
+            if await insert_recommendations_batch([row]):
+                self.flushed_rows += 1
+            else:
+                self.failed_rows += 1
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.DB_WRITE_BEHIND_ENABLED,
+            "running": self.running,
+            "queue_depth": self._queue.qsize(),
+            "enqueued_rows": self.enqueued_rows,
+            "rejected_rows": self.rejected_rows,
+            "flushed_rows": self.flushed_rows,
+            "failed_rows": self.failed_rows,
+            "batches": self.batches,
+        }
+
+
+write_behind_queue = WriteBehindQueue(
+    max_size=settings.DB_WRITE_BEHIND_MAX_QUEUE,
+    batch_size=settings.DB_WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=settings.DB_WRITE_BEHIND_FLUSH_INTERVAL,
+    enqueue_timeout=settings.DB_WRITE_BEHIND_ENQUEUE_TIMEOUT,
+)
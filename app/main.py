@@ -1,16 +1,80 @@
 # app/main.py
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response, status
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.v1.endpoints import recommendations
+from app.db.database import open_db_pool, close_db_pool, get_db_pool_stats, db_pool_ready, ensure_recommendation_partitions
+from app.db.write_behind import write_behind_queue
+from app.services.job_service import job_workers
+from app.services.webhook_outbox import webhook_outbox
+from app.core.config import settings
+from app.services.recommendation_cache import recommendation_cache
+from app.services.similarity_index import similarity_index
+from app.core.gemini_client import get_gemini_stats, warm_gemini_client, gemini_client_ready
+from app.core.http_client import open_http_client, close_http_client, http_client_ready
+from app.core.security import jwks_store, get_auth_stats
+from app.core.admission import get_admission_stats
+from app.core.metrics import MetricsMiddleware, METRICS_CONTENT_TYPE, latest_metrics
+from app.core.logging_config import RequestIdMiddleware, setup_logging
+import asyncio
+import importlib
 import logging
+import time
 
-logging.basicConfig(level=logging.INFO)
+setup_logging() # Única configuración del logging del proceso
 logger = logging.getLogger(__name__)
 
+_warm_up_done = False
+
+async def _warm_up() -> None:
+    """Carga en segundo plano lo que es lento de importar (SDK de Gemini, NumPy) sin retrasar el arranque."""
+    global _warm_up_done
+    start = time.perf_counter()
+    try:
+        await warm_gemini_client()
+        await asyncio.to_thread(importlib.import_module, "app.services.local_engine")
+    except Exception as e:
+        logger.error("Error durante el calentamiento en segundo plano: %s", e)
+    _warm_up_done = True
+    logger.info("Calentamiento completado en %.2fs.", time.perf_counter() - start)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Recursos compartidos por todas las peticiones: se abren al arrancar y se cierran al apagar.
+    # Nada de esto espera a la red (el pool conecta en segundo plano), así uvicorn acepta conexiones
+    # enseguida; /health/ready indica cuándo está todo listo.
+    await open_db_pool()
+    await open_http_client()
+    if settings.DB_WRITE_BEHIND_ENABLED:
+        write_behind_queue.start()
+    if settings.JOBS_ENABLED:
+        job_workers.start() # Drenan la cola de recommendation_jobs (Postgres), también la que quedó de otro arranque
+    if settings.WEBHOOK_OUTBOX_ENABLED:
+        webhook_outbox.start() # Entrega lo pendiente en webhook_outbox, también lo que quedó de otro arranque
+    jwks_store.start() # Carga las claves de firma en segundo plano y las recarga periódicamente
+    warm_up_task = asyncio.create_task(_warm_up(), name="warm-up")
+    # Particiones de los próximos meses si la BD tiene el esquema de la migración 0004; mientras tanto la
+    # partición DEFAULT recoge cualquier fecha
+    partitions_task = asyncio.create_task(
+        ensure_recommendation_partitions(settings.DB_PARTITIONS_MONTHS_AHEAD), name="db-partitions"
+    )
+    yield
+    for task in (warm_up_task, partitions_task):
+        if not task.done():
+            task.cancel()
+    await job_workers.stop() # Espera a los trabajos en curso; los que no acaban vuelven a la cola
+    await jwks_store.stop()
+    await write_behind_queue.stop() # Vacía las filas pendientes antes de cerrar el pool
+    await webhook_outbox.stop() # Antes de cerrar el cliente HTTP; lo pendiente sigue en la BD para el próximo arranque
+    await close_http_client()
+    await close_db_pool()
+
 app = FastAPI(
     title="EcoFootprint Recommendation API",
     description="API to generate carbon footprint reduction recommendations using AI.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware to allow any origin
@@ -22,6 +86,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Tiempos por etapa: histogramas en /metrics y cabecera Server-Timing en cada respuesta
+app.add_middleware(MetricsMiddleware)
+
+# X-Request-ID: correlaciona los logs de cada petición (el último añadido es el más externo)
+app.add_middleware(RequestIdMiddleware)
+
 # Include the API router
 app.include_router(
     recommendations.router,
@@ -31,5 +101,46 @@ app.include_router(
 
 @app.get("/", tags=["Health Check"])
 async def read_root():
-    logger.info("Health check endpoint '/' accessed.")
+    logger.debug("Health check endpoint '/' accessed.")
     return {"message": "Welcome to the EcoFootprint Recommendation API!"}
+
+@app.get("/health/live", tags=["Health Check"])
+async def liveness():
+    """Liveness probe: the process is up and serving the event loop. Never checks dependencies."""
+    return {"status": "alive"}
+
+@app.get("/health/ready", tags=["Health Check"])
+async def readiness():
+    """Readiness probe: 200 once the DB pool, the HTTP client, the Gemini client and the JWKS keys are ready, 503 before."""
+    checks = {
+        "database": db_pool_ready(),
+        "http_client": http_client_ready(),
+        "gemini": gemini_client_ready(),
+        "jwks": jwks_store.ready if jwks_store.configured else True, # Sin JWKS los tokens reciben 401 (o se ignoran)
+        "warm_up": _warm_up_done,
+    }
+    ready = all(checks.values())
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if ready else "starting", "checks": checks},
+    )
+
+@app.get("/stats", tags=["Health Check"])
+async def read_stats():
+    """Runtime statistics of shared resources (DB pool, recommendation cache, Gemini client, ...)."""
+    return {
+        "db_pool": get_db_pool_stats(),
+        "write_behind": write_behind_queue.stats(),
+        "jobs": job_workers.stats(),
+        "webhook_outbox": webhook_outbox.stats(),
+        "cache": recommendation_cache.stats(),
+        "similarity": similarity_index.stats(),
+        "gemini": get_gemini_stats(),
+        "auth": get_auth_stats(),
+        "admission": get_admission_stats(),
+    }
+
+@app.get("/metrics", tags=["Health Check"], include_in_schema=False)
+async def read_metrics():
+    """Prometheus metrics: per-stage latency histograms, Gemini tokens, parse failures, DB and webhook errors."""
+    return Response(content=latest_metrics(), media_type=METRICS_CONTENT_TYPE)
@@ -0,0 +1,60 @@
+# app/services/footprint_key.py
+from app.api.v1.schemas.footprint import FootprintInputSchema
+from typing import Tuple
+import hashlib
+
+# Orden canónico de los 16 campos de hábitos. Cualquier clave o vector derivado de una huella
+# usa este orden, así dos peticiones con los mismos valores producen siempre la misma codificación.
+HABIT_FIELDS: Tuple[Tuple[str, str], ...] = (
+    ("energy", "applianceHours"),
+    ("energy", "lightBulbs"),
+    ("energy", "gasTanks"),
+    ("energy", "hvacHours"),
+    ("food", "redMeat"),
+    ("food", "whiteMeat"),
+    ("food", "dairy"),
+    ("food", "vegetarian"),
+    ("transport", "carKm"),
+    ("transport", "publicKm"),
+    ("transport", "domesticFlights"),
+    ("transport", "internationalFlights"),
+    ("waste", "trashBags"),
+    ("waste", "foodWaste"),
+    ("waste", "plasticBottles"),
+    ("waste", "paperPackages"),
+)
+
+def footprint_values(data: FootprintInputSchema) -> Tuple[float, ...]:
+    """Devuelve los 16 valores de hábitos en orden canónico seguidos de `result` (None se trata como 0.0)."""
+    values = [float(getattr(getattr(data, section), field) or 0.0) for section, field in HABIT_FIELDS]
+    values.append(float(data.result))
+    return tuple(values)
+
+def _bucket(value: float, quantum: float) -> str:
+    # Se usa el índice entero del intervalo y no el valor redondeado, para evitar ruido de coma flotante (0.30000000000000004)
+    if quantum <= 0:
+        return repr(value)
+    return str(round(value / quantum))
+
+def quantized_footprint_key(
+    data: FootprintInputSchema,
+    namespace: str,
+    quantum: float,
+    result_quantum: float
+) -> str:
+    """
+    Clave canónica de una huella: los hábitos se cuantizan en intervalos de `quantum` y `result`
+    en intervalos de `result_quantum`. La fecha no forma parte de la clave porque no influye en el prompt.
+    """
+    values = footprint_values(data)
+    parts = [_bucket(v, quantum) for v in values[:-1]]
+    parts.append(_bucket(values[-1], result_quantum))
+    digest = hashlib.blake2b("|".join(parts).encode(), digest_size=16).hexdigest()
+    return f"{namespace}:{digest}"
+
+def input_fingerprint(data: FootprintInputSchema, engine: str) -> str:
+    """
+    Huella exacta (sin cuantizar) de los valores de una entrada y del motor que la procesa, para reconocer
+    reenvíos idénticos en user_recommendations. La fecha va en su propia columna, no en la huella.
+    """
+    return quantized_footprint_key(data, engine, 0.0, 0.0)
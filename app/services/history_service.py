@@ -0,0 +1,103 @@
+# app/services/history_service.py
+from app.core.metrics import timed
+from app.db.database import fetch_recommendation_history
+from datetime import date
+from typing import List, Optional, Tuple
+import base64
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryPage:
+    """Página del historial ya serializada. `body` es None si el cliente ya tiene esta versión (304)."""
+
+    def __init__(self, etag: str, body: Optional[bytes]):
+        self.etag = etag
+        self.body = body
+
+    @property
+    def not_modified(self) -> bool:
+        return self.body is None
+
+
+def encode_cursor(calculation_date: date, row_id: int) -> str:
+    """Cursor opaco (base64url) con la posición (calculation_date, id) de la última fila entregada."""
+    raw = f"{calculation_date.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[date, int]:
+    """Inverso de encode_cursor. Lanza ValueError si el cursor no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        date_part, id_part = raw.split("|")
+        return date.fromisoformat(date_part), int(id_part)
+    except Exception as e:
+        raise ValueError(f"Cursor de paginación no válido: {cursor!r}") from e
+
+
+def _page_etag(user_id: str, cursor: Optional[str], limit: int, rows: List[dict]) -> str:
+    """
+    ETag de una página: identidad de la consulta más (id, xmin) de cada fila. xmin cambia con cualquier
+    UPDATE de la fila, así que dos páginas con el mismo ETag tienen exactamente el mismo contenido.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{user_id}\x00{cursor or ''}\x00{limit}".encode())
+    for row in rows:
+        digest.update(f"\x00{row['id']}:{row['row_version']}".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """Comparación débil de If-None-Match (RFC 9110): admite listas, '*' y etiquetas W/."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in (candidate.removeprefix("W/") for candidate in candidates)
+
+
+def _serialize_page(rows: List[dict], limit: int) -> bytes:
+    # El payload guardado ya es el JSON de RecommendationOutputSchema: se incrusta tal cual, sin parsearlo
+    items = [
+        f'{{"id":{row["id"]},"calculation_date":"{row["calculation_date"].isoformat()}",'
+        f'"recommendations":{row["payload"] or "null"}}}'
+        for row in rows[:limit]
+    ]
+    next_cursor = None
+    if len(rows) > limit: # Se pidió una fila de más solo para saber si hay otra página
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last["calculation_date"], last["id"])
+    return f'{{"items":[{",".join(items)}],"next_cursor":{json.dumps(next_cursor)}}}'.encode()
+
+
+async def get_recommendation_history(
+    user_id: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = None
+) -> Optional[HistoryPage]:
+    """
+    Página del historial de `user_id` (más reciente primero). Con If-None-Match se consulta primero solo
+    (id, xmin) de las filas, sin leer los JSON: si el ETag coincide se responde 304 sin cargar ni enviar nada más.
+    Devuelve None si la BD no está disponible; lanza ValueError si el cursor no es válido.
+    """
+    after = decode_cursor(cursor) if cursor else None
+
+    if if_none_match:
+        with timed("db"):
+            versions = await fetch_recommendation_history(user_id, limit + 1, after, with_payload=False)
+        if versions is None:
+            return None
+        etag = _page_etag(user_id, cursor, limit, versions)
+        if etag_matches(etag, if_none_match):
+            logger.info("Historial de %s: página sin cambios (304).", user_id)
+            return HistoryPage(etag, None)
+
+    with timed("db"):
+        rows = await fetch_recommendation_history(user_id, limit + 1, after)
+    if rows is None:
+        return None
+    return HistoryPage(_page_etag(user_id, cursor, limit, rows), _serialize_page(rows, limit))
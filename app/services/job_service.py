@@ -0,0 +1,235 @@
+# app/services/job_service.py
+from app.api.v1.schemas.footprint import FootprintInputSchema
+from app.core.admission import AdmissionRejected
+from app.core.config import settings
+from app.core.logging_config import request_id_var
+from app.core.metrics import JOBS
+from app.core.security import ANONYMOUS_USER_ID
+from app.db.database import claim_job, fetch_job, finish_job, insert_job, purge_finished_jobs, release_job
+from app.services.recommendation_service import is_error_output, get_recommendations_for_footprint
+from datetime import datetime
+from typing import List, Optional
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Los usuarios con sesión se atienden antes que el tráfico 'No Login' (ORDER BY priority DESC, created_at)
+AUTHENTICATED_PRIORITY = 10
+ANONYMOUS_PRIORITY = 0
+_PURGE_INTERVAL_SECONDS = 3600.0
+
+
+def job_priority(user_id: str) -> int:
+    return ANONYMOUS_PRIORITY if user_id == ANONYMOUS_USER_ID else AUTHENTICATED_PRIORITY
+
+
+class JobWorkerPool:
+    """
+    Workers en proceso que drenan la cola de recommendation_jobs (Postgres). Cada worker reclama el trabajo
+    pendiente más prioritario, ejecuta get_recommendations_for_footprint y guarda el resultado. El estado vive
+    en la BD: si el proceso cae, el lease (`lease_seconds`) caduca y otro worker lo retoma; `max_attempts`
+    evita que un trabajo que tumba al worker se reintente para siempre. Con la cola vacía cada worker espera
+    `poll_interval` segundos, o menos si se encola un trabajo en este mismo proceso.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        poll_interval: float,
+        lease_seconds: float,
+        max_attempts: int,
+        retention_hours: float,
+        shutdown_timeout: float
+    ):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_hours = retention_hours
+        self.shutdown_timeout = shutdown_timeout
+        self._tasks: List[asyncio.Task] = []
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._last_purge = 0.0
+        self.in_flight = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.requeued = 0
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._run(), name=f"job-worker-{i}") for i in range(self.workers)]
+        logger.info("Workers de trabajos asíncronos iniciados (%s).", self.workers)
+
+    async def stop(self) -> None:
+        """Deja terminar los trabajos en curso (hasta `shutdown_timeout`); los que no acaban vuelven a la cola."""
+        if not self._tasks:
+            return
+        self._stopping = True
+        self._wake.set()
+        _, pending = await asyncio.wait(self._tasks, timeout=self.shutdown_timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+        logger.info("Workers de trabajos detenidos. Completados: %s, fallidos: %s.", self.succeeded, self.failed)
+
+    def notify(self) -> None:
+        """Despierta a los workers ociosos (se acaba de encolar un trabajo en este proceso)."""
+        self._wake.set()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            job = await claim_job(self.lease_seconds)
+            if job is None:
+                await self._purge_if_due()
+                await self._idle()
+                continue
+            await self._process(job)
+
+    async def _idle(self) -> None:
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        if not self._stopping:
+            self._wake.clear()
+
+    async def _purge_if_due(self) -> None:
+        now = time.monotonic()
+        if now - self._last_purge < _PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = now
+        purged = await purge_finished_jobs(self.retention_hours)
+        if purged:
+            logger.info("Purgados %s trabajos terminados hace más de %s h.", purged, self.retention_hours)
+
+    async def _process(self, job: dict) -> None:
+        job_id = job["id"]
+        request_id_var.set(job_id) # Los logs del trabajo se correlacionan por su id (cada worker es su propia tarea)
+        if job["attempts"] > self.max_attempts:
+            logger.error("Trabajo %s abandonado tras %s intentos interrumpidos.", job_id, self.max_attempts)
+            await self._finish(job_id, None, f"Abandonado tras {self.max_attempts} intentos interrumpidos.")
+            return
+
+        self.in_flight += 1
+        try:
+            footprint_data = FootprintInputSchema.model_validate_json(job["input_payload"])
+            result = await get_recommendations_for_footprint(footprint_data, job["user_id"], job["engine"])
+        except AdmissionRejected as e:
+            # Gemini saturado: el trabajo vuelve a la cola sin gastar intento y este worker se aparta un momento
+            logger.warning("Trabajo %s devuelto a la cola (%s); reintento en %.1fs.", job_id, e.reason, e.retry_after)
+            await self._requeue(job_id)
+            await asyncio.sleep(e.retry_after)
+            return
+        except asyncio.CancelledError:
+            await self._requeue(job_id) # Apagado: otro worker (o este proceso al volver) lo retomará
+            raise
+        except Exception as e:
+            logger.exception("Error inesperado procesando el trabajo %s.", job_id)
+            await self._finish(job_id, None, f"An internal server error occurred: {e}")
+            return
+        finally:
+            self.in_flight -= 1
+
+        if is_error_output(result):
+            await self._finish(job_id, None, result.notes or result.global_recommendation.suggestion)
+        else:
+            await self._finish(job_id, result.to_json())
+
+    async def _finish(self, job_id: str, result_payload: Optional[bytes], error: Optional[str] = None) -> None:
+        await finish_job(job_id, result_payload, error)
+        if result_payload is not None:
+            self.succeeded += 1
+            JOBS.labels("succeeded").inc()
+        else:
+            self.failed += 1
+            JOBS.labels("failed").inc()
+
+    async def _requeue(self, job_id: str) -> None:
+        await release_job(job_id)
+        self.requeued += 1
+        JOBS.labels("requeued").inc()
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "requeued": self.requeued,
+        }
+
+
+job_workers = JobWorkerPool(
+    workers=settings.JOBS_WORKERS,
+    poll_interval=settings.JOBS_POLL_INTERVAL,
+    lease_seconds=settings.JOBS_LEASE_SECONDS,
+    max_attempts=settings.JOBS_MAX_ATTEMPTS,
+    retention_hours=settings.JOBS_RETENTION_HOURS,
+    shutdown_timeout=settings.JOBS_SHUTDOWN_TIMEOUT,
+)
+
+
+async def submit_job(footprint_data: FootprintInputSchema, user_id: str, engine: Optional[str] = None) -> Optional[str]:
+    """Encola la huella y devuelve el id del trabajo, o None si la BD no está disponible."""
+    job_id = str(uuid.uuid4())
+    if not await insert_job(job_id, user_id, job_priority(user_id), engine, footprint_data.model_dump_json()):
+        return None
+    JOBS.labels("submitted").inc()
+    job_workers.notify()
+    logger.info("Trabajo %s encolado para %s (prioridad %s).", job_id, user_id, job_priority(user_id))
+    return job_id
+
+
+class JobSnapshot:
+    """Estado de un trabajo ya serializado para GET /jobs/{id}."""
+
+    def __init__(self, status: str, body: bytes):
+        self.status = status
+        self.body = body
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _serialize_job(row: dict) -> bytes:
+    # El resultado guardado ya es el JSON de RecommendationOutputSchema: se incrusta tal cual, sin parsearlo
+    fields = json.dumps({
+        "id": row["id"],
+        "status": row["status"],
+        "created_at": _isoformat(row["created_at"]),
+        "started_at": _isoformat(row["started_at"]),
+        "finished_at": _isoformat(row["finished_at"]),
+        "error": row["error"],
+    }, ensure_ascii=False, separators=(",", ":"))
+    return f'{fields[:-1]},"result":{row["result"] or "null"}}}'.encode()
+
+
+async def get_job(job_id: str, user_id: str) -> Optional[JobSnapshot]:
+    """
+    Estado del trabajo, o None si la BD no está disponible. Lanza LookupError si no existe o es de otro usuario:
+    los trabajos de usuarios con sesión solo los ve su 'sub'; los de 'No Login', quien conozca el id (UUID aleatorio).
+    """
+    row = await fetch_job(job_id)
+    if row is None:
+        return None
+    if not row or (row["user_id"] != ANONYMOUS_USER_ID and row["user_id"] != user_id):
+        raise LookupError(f"Trabajo no encontrado: {job_id}")
+    return JobSnapshot(row["status"], _serialize_job(row))
@@ -0,0 +1,175 @@
+# app/services/local_engine.py
+# Motor local y determinista de recomendaciones (sin LLM).
+#
+# Estima las emisiones anuales de cada uno de los 16 hábitos con una tabla de factores de emisión,
+# calcula cuánto se podría ahorrar en cada uno y rellena RecommendationOutputSchema con plantillas
+# parametrizadas: la recomendación global sale del hábito con mayor ahorro potencial y las dos
+# sugerencias de cada categoría de sus dos hábitos con mayor ahorro. El cálculo numérico es
+# vectorial (NumPy) sobre una matriz (N, 16), así que un lote cuesta casi lo mismo que una huella.
+from typing import List, Sequence
+from app.api.v1.schemas.footprint import FootprintInputSchema
+from app.api.v1.schemas.recommendation import FullRecommendation, CategorySpecificSuggestion, RecommendationsByCategory, RecommendationOutputSchema
+from app.services.footprint_key import HABIT_FIELDS, footprint_values
+import numpy as np
+
+LOCAL_ENGINE_NOTE = "Recomendaciones generadas por el motor local de estimación (sin IA)."
+
+CATEGORY_KEYS = ("energy", "food", "transport", "waste") # Mismo orden que HABIT_FIELDS (4 hábitos cada una)
+
+# kg CO2e al año por unidad de cada hábito, en el orden de HABIT_FIELDS.
+# Supuestos: red eléctrica 0.4 kg/kWh; bombona de GLP de 15 kg; raciones de 150 g de carne.
+EMISSION_FACTORS = np.array([
+    73.0,    # applianceHours: h/día x 0.5 kW x 365 días
+    29.2,    # lightBulbs: bombilla x 0.04 kW x 5 h/día x 365 días
+    536.4,   # gasTanks: tanque/mes x 15 kg x 2.98 kg CO2/kg x 12 meses
+    219.0,   # hvacHours: h/día x 1.5 kW x 365 días
+    210.6,   # redMeat: vez/semana x 0.15 kg x 27 kg CO2e/kg x 52 semanas
+    53.8,    # whiteMeat: vez/semana x 0.15 kg x 6.9 kg CO2e/kg x 52 semanas
+    41.6,    # dairy: vez/semana x 0.8 kg CO2e x 52 semanas
+    26.0,    # vegetarian: comida/semana x 0.5 kg CO2e x 52 semanas
+    8.84,    # carKm: km/semana x 0.17 kg/km x 52 semanas
+    2.6,     # publicKm: km/semana x 0.05 kg/km x 52 semanas
+    250.0,   # domesticFlights: vuelo/año
+    1500.0,  # internationalFlights: vuelo/año
+    130.0,   # trashBags: bolsa/semana x 5 kg x 0.5 kg CO2e/kg x 52 semanas
+    156.0,   # foodWaste: bolsa/semana x 5 kg x 0.6 kg CO2e/kg (metano) x 52 semanas
+    4.16,    # plasticBottles: unidad/semana x 0.08 kg x 52 semanas
+    5.2,     # paperPackages: unidad/semana x 0.1 kg x 52 semanas
+], dtype=np.float64)
+
+# Fracción de las emisiones de cada hábito que se puede evitar de forma realista con la acción de su plantilla
+REDUCTION_POTENTIAL = np.array([
+    0.25, 0.75, 0.30, 0.30,   # energía
+    0.50, 0.30, 0.30, 0.0,    # alimentación (las comidas vegetarianas ya son la alternativa)
+    0.40, 0.0, 0.50, 0.50,    # transporte (el transporte público ya es la alternativa)
+    0.40, 0.60, 0.80, 0.50,   # residuos
+], dtype=np.float64)
+
+# Plantillas por hábito (orden de HABIT_FIELDS). Marcadores: {value} valor del usuario,
+# {emissions} kg CO2e/año estimados del hábito, {savings} kg CO2e/año evitables.
+SUGGESTION_TEMPLATES = (
+    "Apaga y desenchufa los electrodomésticos que no uses: con {value} horas diarias de uso generan unos {emissions} kg CO2e al año y reducir un 25% evitaría unos {savings} kg, porque menos consumo eléctrico significa menos generación fósil.",
+    "Cambia a bombillas LED y apaga las luces de las estancias vacías: tus {value} bombillas encendidas suponen unos {emissions} kg CO2e al año y podrías evitar unos {savings} kg, ya que un LED consume hasta un 80% menos.",
+    "Reduce el uso de gas envasado (actualmente {value} tanques al mes) con cocción eficiente, tapas en las ollas y un calentador bien regulado: emite unos {emissions} kg CO2e al año y podrías evitar unos {savings} kg.",
+    "Ajusta el termostato 1-2 °C y aísla puertas y ventanas: {value} horas diarias de calefacción o aire acondicionado suponen unos {emissions} kg CO2e al año y podrías evitar unos {savings} kg, porque la climatización es de los mayores consumos del hogar.",
+    "Reduce a la mitad tu consumo de carne roja (ahora {value} veces por semana) y sustitúyela por legumbres o pollo: equivale a unos {emissions} kg CO2e al año y evitarías unos {savings} kg, ya que la ganadería bovina emite mucho metano.",
+    "Sustituye parte de la carne blanca ({value} veces por semana) por proteína vegetal: supone unos {emissions} kg CO2e al año y podrías evitar unos {savings} kg, porque las legumbres tienen una huella muy inferior.",
+    "Prueba alternativas vegetales a algunos lácteos (ahora {value} veces por semana): suman unos {emissions} kg CO2e al año y podrías evitar unos {savings} kg, porque la producción de leche y queso genera metano.",
+    "Mantén y amplía tus {value} comidas vegetarianas semanales: cada comida sin carne evita varios kilos de CO2e frente a una con carne roja.",
+    "Sustituye algunos trayectos en coche por transporte público, bici o coche compartido: tus {value} km semanales emiten unos {emissions} kg CO2e al año y podrías evitar unos {savings} kg, porque el coche privado es el medio más contaminante por pasajero.",
+    "Sigue usando el transporte público ({value} km semanales): emite una fracción de lo que emitiría el mismo recorrido en coche.",
+    "Cambia parte de tus {value} vuelos nacionales anuales por tren o autobús: suponen unos {emissions} kg CO2e al año y podrías evitar unos {savings} kg, porque en distancias cortas el avión es el medio más intensivo en carbono.",
+    "Reduce tus {value} vuelos internacionales anuales, agrupando viajes o usando videollamadas: suponen unos {emissions} kg CO2e al año y podrías evitar unos {savings} kg, ya que un solo vuelo largo puede superar meses de emisiones diarias.",
+    "Separa y recicla para reducir tus {value} bolsas semanales de basura general: generan unos {emissions} kg CO2e al año y podrías evitar unos {savings} kg, porque lo que va al vertedero se descompone emitiendo metano.",
+    "Planifica compras y composta restos para reducir tus {value} bolsas semanales de residuos de comida: emiten unos {emissions} kg CO2e al año y podrías evitar unos {savings} kg, ya que la comida en el vertedero produce metano.",
+    "Usa una botella reutilizable en lugar de tus {value} botellas de plástico semanales: suponen unos {emissions} kg CO2e al año y podrías evitar unos {savings} kg, porque fabricar plástico consume petróleo y energía.",
+    "Reduce y recicla los {value} paquetes de papel o cartón semanales comprando a granel: suponen unos {emissions} kg CO2e al año y podrías evitar unos {savings} kg de emisiones de fabricación y transporte.",
+)
+
+# Sugerencias genéricas para categorías sin ahorro estimable (p. ej. todos sus hábitos a cero)
+FALLBACK_SUGGESTIONS = {
+    "energy": (
+        "Contrata electricidad de origen renovable: reduce las emisiones de todo tu consumo eléctrico sin cambiar tus hábitos.",
+        "Elige electrodomésticos de alta eficiencia energética cuando renueves los actuales, porque consumen bastante menos durante toda su vida útil.",
+    ),
+    "food": (
+        "Prioriza alimentos locales y de temporada, ya que requieren menos transporte y almacenamiento refrigerado.",
+        "Aprovecha las sobras y compra solo lo que vas a consumir: evitar el desperdicio ahorra todas las emisiones de producir esa comida.",
+    ),
+    "transport": (
+        "Para trayectos cortos camina o usa la bicicleta: no emiten CO2 y además mejoran tu salud.",
+        "Si usas coche, mantén los neumáticos a la presión correcta y conduce de forma suave, porque reduce el consumo de combustible hasta un 10%.",
+    ),
+    "waste": (
+        "Lleva tus propias bolsas y envases al hacer la compra para evitar residuos de un solo uso.",
+        "Repara y dona objetos antes de tirarlos: alargar su vida útil evita las emisiones de fabricar otros nuevos.",
+    ),
+}
+
+HABIT_LABELS = (
+    "el uso de electrodomésticos", "la iluminación", "el gas envasado", "la climatización",
+    "la carne roja", "la carne blanca", "los lácteos", "las comidas vegetarianas",
+    "los trayectos en coche", "el transporte público", "los vuelos nacionales", "los vuelos internacionales",
+    "la basura general", "los residuos de comida", "las botellas de plástico", "los envases de papel y cartón",
+)
+
+assert len(EMISSION_FACTORS) == len(REDUCTION_POTENTIAL) == len(SUGGESTION_TEMPLATES) == len(HABIT_LABELS) == len(HABIT_FIELDS)
+
+
+def _format_number(value: float) -> str:
+    return f"{value:g}" # 100.0 -> "100", 25.25 -> "25.25"
+
+
+def _suggestion_text(habit_index: int, value: float, emissions: float, savings: float) -> str:
+    return SUGGESTION_TEMPLATES[habit_index].format(
+        value=_format_number(value),
+        emissions=f"{emissions:.0f}",
+        savings=f"{savings:.0f}",
+    )
+
+
+def estimate_emissions(habits: np.ndarray) -> np.ndarray:
+    """Emisiones anuales estimadas (kg CO2e) por hábito para una matriz (N, 16) de hábitos."""
+    return habits * EMISSION_FACTORS
+
+
+def generate_local_recommendations_batch(items: Sequence[FootprintInputSchema]) -> List[RecommendationOutputSchema]:
+    """Genera recomendaciones para un lote de huellas con una sola pasada vectorial."""
+    if not items:
+        return []
+    values = np.array([footprint_values(item) for item in items], dtype=np.float64)
+    habits = np.clip(values[:, :-1], 0.0, None)
+    results = values[:, -1]
+
+    emissions = estimate_emissions(habits)
+    savings = emissions * REDUCTION_POTENTIAL
+    # Dentro de cada categoría (bloques de 4 hábitos), índices ordenados de mayor a menor ahorro
+    ranked_in_category = np.argsort(-savings.reshape(len(items), 4, 4), axis=2, kind="stable")
+    best_habit = np.argmax(savings, axis=1)
+    total_emissions = emissions.sum(axis=1)
+
+    outputs = []
+    for row in range(len(items)):
+        top = int(best_habit[row])
+        top_savings = savings[row, top]
+        if top_savings > 0:
+            share = 100.0 * top_savings / total_emissions[row] if total_emissions[row] > 0 else 0.0
+            action = _suggestion_text(top, habits[row, top], emissions[row, top], top_savings)
+            global_text = (
+                f"Tu mayor oportunidad está en {HABIT_LABELS[top]}: {action[0].lower()}{action[1:]} "
+                f"Es cerca del {share:.0f}% de las emisiones estimadas de tus hábitos "
+                f"(huella total declarada: {_format_number(results[row])} t CO2e/año)."
+            )
+        else:
+            global_text = (
+                "Tus hábitos declarados ya tienen emisiones muy bajas; el siguiente paso con más impacto es "
+                "contratar energía renovable y mantener estos hábitos, porque así tu huella se mantiene baja a largo plazo."
+            )
+
+        by_category = {}
+        for category_index, category in enumerate(CATEGORY_KEYS):
+            suggestions = []
+            for local_index in ranked_in_category[row, category_index]:
+                habit = category_index * 4 + int(local_index)
+                if savings[row, habit] <= 0:
+                    break
+                suggestions.append(CategorySpecificSuggestion(
+                    suggestion=_suggestion_text(habit, habits[row, habit], emissions[row, habit], savings[row, habit])
+                ))
+                if len(suggestions) == 2:
+                    break
+            for fallback in FALLBACK_SUGGESTIONS[category][:2 - len(suggestions)]:
+                suggestions.append(CategorySpecificSuggestion(suggestion=fallback))
+            by_category[category] = suggestions
+
+        outputs.append(RecommendationOutputSchema(
+            global_recommendation=FullRecommendation(category="General", suggestion=global_text),
+            category_recommendations=RecommendationsByCategory(**by_category),
+            notes=LOCAL_ENGINE_NOTE,
+        ))
+    return outputs
+
+
+def generate_local_recommendations(data: FootprintInputSchema) -> RecommendationOutputSchema:
+    """Recomendaciones locales para una sola huella."""
+    return generate_local_recommendations_batch([data])[0]
@@ -0,0 +1,144 @@
+# app/services/recommendation_cache.py
+from collections import OrderedDict
+from typing import Optional, Tuple
+from app.api.v1.schemas.footprint import FootprintInputSchema
+from app.api.v1.schemas.recommendation import RecommendationOutputSchema
+from app.core.config import settings
+from app.db.database import fetch_cached_recommendation, store_cached_recommendation, purge_expired_cached_recommendations
+from app.services.footprint_key import quantized_footprint_key
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LocalLRUCache:
+    """
+    LRU en memoria del proceso con TTL por entrada y límite por número de entradas y por bytes.
+    Guarda el JSON serializado en bytes (no el objeto Pydantic) para que el llamador nunca comparta
+    una instancia mutable con otras peticiones; esos bytes se reutilizan tal cual como respuesta.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[str, Tuple[float, bytes, int]]" = OrderedDict() # key -> (expires_at, payload, size)
+        self._bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, payload, _ = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._data.move_to_end(key)
+        return payload
+
+    def set(self, key: str, payload: bytes) -> None:
+        size = len(payload)
+        if size > self.max_bytes:
+            return # Nunca cabría: no expulsar toda la caché por una sola entrada
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (time.monotonic() + self.ttl_seconds, payload, size)
+        self._bytes += size
+        while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._data))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+
+class RecommendationCache:
+    """
+    Caché de dos niveles para RecommendationOutputSchema:
+    1. LRU local del worker (microsegundos).
+    2. Opcional: tabla UNLOGGED en Postgres compartida por todos los workers de uvicorn.
+    Un acierto en el nivel compartido se copia al nivel local.
+    """
+
+    def __init__(self, local: LocalLRUCache, shared_enabled: bool, ttl_seconds: float, purge_every: int):
+        self.local = local
+        self.shared_enabled = shared_enabled
+        self.ttl_seconds = ttl_seconds
+        self.purge_every = purge_every
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._shared_writes = 0
+
+    async def get(self, key: str) -> Optional[RecommendationOutputSchema]:
+        payload = self.local.get(key)
+        if payload is not None:
+            self.local_hits += 1
+            return RecommendationOutputSchema.from_json(payload)
+
+        if self.shared_enabled:
+            shared_payload = await fetch_cached_recommendation(key)
+            if shared_payload is not None:
+                self.shared_hits += 1
+                payload = shared_payload.encode()
+                self.local.set(key, payload)
+                return RecommendationOutputSchema.from_json(payload)
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, recommendations: RecommendationOutputSchema) -> None:
+        payload = recommendations.to_json() # Queda guardado en el objeto: la BD y el webhook reutilizan la misma serialización
+        self.local.set(key, payload)
+        if self.shared_enabled:
+            await store_cached_recommendation(key, payload.decode(), self.ttl_seconds)
+            self._shared_writes += 1
+            if self.purge_every > 0 and self._shared_writes % self.purge_every == 0:
+                purged = await purge_expired_cached_recommendations()
+                logger.info("Caché compartida: %s entradas caducadas eliminadas.", purged)
+
+    def stats(self) -> dict:
+        hits = self.local_hits + self.shared_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": settings.CACHE_ENABLED,
+            "shared_enabled": self.shared_enabled,
+            "hits": hits,
+            "local_hits": self.local_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "evictions": self.local.evictions,
+            "expirations": self.local.expirations,
+            "entries": len(self.local),
+            "bytes": self.local.size_bytes,
+        }
+
+
+recommendation_cache = RecommendationCache(
+    local=LocalLRUCache(
+        max_entries=settings.CACHE_MAX_ENTRIES,
+        max_bytes=settings.CACHE_MAX_BYTES,
+        ttl_seconds=settings.CACHE_TTL_SECONDS,
+    ),
+    shared_enabled=settings.CACHE_SHARED_ENABLED,
+    ttl_seconds=settings.CACHE_TTL_SECONDS,
+    purge_every=settings.CACHE_SHARED_PURGE_EVERY,
+)
+
+def footprint_cache_key(data: FootprintInputSchema, namespace: str) -> str:
+    """Clave de caché para una huella según la cuantización configurada."""
+    return quantized_footprint_key(data, namespace, settings.CACHE_QUANTUM, settings.CACHE_RESULT_QUANTUM)
@@ -1,16 +1,33 @@
 # app/services/recommendation_service.py
 from app.api.v1.schemas.footprint import FootprintInputSchema
-from app.core.gemini_client import generate_text_from_gemini
-from typing import List, Optional
-from app.api.v1.schemas.recommendation import FullRecommendation, CategorySpecificSuggestion, RecommendationsByCategory, RecommendationOutputSchema
+from app.core.admission import AdmissionRejected
+from app.core.gemini_client import generate_text_from_gemini, stream_text_from_gemini
+from app.core.streaming_json import IncrementalJSONScanner
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Type
+from app.api.v1.schemas.recommendation import FullRecommendation, CategoryGenerationSchema, CategorySpecificSuggestion, RecommendationsByCategory, RecommendationOutputSchema, RecommendationGenerationSchema, normalize_category_suggestions
+from pydantic import BaseModel, ValidationError
 from app.core.http_client import post_recommendations_to_external_service
-from app.db.database import insert_recommendations
+from app.db.database import fetch_recommendation_by_fingerprint, insert_recommendations
+from app.db.write_behind import write_behind_queue
+from app.services.recommendation_cache import recommendation_cache, footprint_cache_key
+from app.services.similarity_index import similarity_index
+from app.services.webhook_outbox import webhook_outbox
+from app.services.footprint_key import input_fingerprint
+from app.core.metrics import PARSE_FAILURES, STORED_RECOMMENDATION_HITS, observe_stage, timed
+from app.core.security import ANONYMOUS_USER_ID
+from app.core.config import settings
+from app.core.logging_config import log_payload
 from datetime import date, datetime
-import json
+import asyncio
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+# Cambiar este valor al modificar el prompt o el parser invalida las entradas de caché existentes
+CACHE_NAMESPACE = "rec-v1"
+STRUCTURED_CACHE_NAMESPACE = "rec-json-v1" # Prompt compacto + response schema (GEMINI_STRUCTURED_OUTPUT)
+
 def _create_prompt(data: FootprintInputSchema) -> str:
     """
     Crea un prompt detallado para la API de Gemini, solicitando una recomendación global
@@ -110,188 +127,653 @@ Genera las recomendaciones ahora.
     return prompt.strip()
 
 
+def _habit_lines(data: FootprintInputSchema) -> Dict[str, str]:
+    """Línea de hábitos (valor, rango) de cada categoría, compartida por el prompt compacto y los prompts en paralelo."""
+    t, f, e, w = data.transport, data.food, data.energy, data.waste
+    return {
+        "transport": f"- Transporte: coche {t.carKm} km/semana (0-500); transporte público {t.publicKm} km/semana (0-500); vuelos nacionales {t.domesticFlights}/año (0-20); vuelos internacionales {t.internationalFlights}/año (0-10).",
+        "food": f"- Alimentación (veces/semana): carne roja {f.redMeat} (0-14); carne blanca {f.whiteMeat} (0-14); lácteos {f.dairy} (0-21); comidas vegetarianas {f.vegetarian} (0-21).",
+        "energy": f"- Energía: electrodomésticos/luces {e.applianceHours} h/día (0-24); bombillas encendidas {e.lightBulbs} (0-20); gas envasado {e.gasTanks} tanques/mes (0-5); calefacción/aire acondicionado {e.hvacHours} h/día (0-24).",
+        "waste": f"- Residuos (por semana): bolsas de basura {w.trashBags} (0-10); bolsas de residuos de comida {w.foodWaste} (0-10); botellas de plástico {w.plasticBottles} (0-50); paquetes de papel/cartón {w.paperPackages} (0-10).",
+    }
+
+
+def _create_compact_prompt(data: FootprintInputSchema) -> str:
+    """
+    Prompt corto para el modo de salida estructurada: la forma del JSON la impone el response schema
+    (RecommendationGenerationSchema), así que no hacen falta el ejemplo ni las reglas de formato.
+    """
+    habits = "\n".join(_habit_lines(data).values())
+    return f"""Eres un asesor ambiental experto. Huella de carbono anual del usuario: {data.result} t CO2e/año.
+Hábitos (valor, rango):
+{habits}
+Da 1 recomendación general de alto impacto (category "General") y exactamente 2 sugerencias para cada categoría (transport, food, energy, waste), personalizadas con estos datos. Cada texto, en español, explica brevemente por qué o cómo reduce la huella anual."""
+
+
+# Modo GEMINI_PARALLEL_CATEGORIES: cinco prompts independientes, cada uno con solo los datos que necesita
+PARALLEL_CACHE_NAMESPACE = "rec-parallel-v1"
+PARALLEL_SECTIONS = ("global_recommendation", "transport", "food", "energy", "waste")
+_CATEGORY_LABELS = {"transport": "transporte", "food": "alimentación", "energy": "energía", "waste": "residuos"}
+
+
+def _create_global_prompt(data: FootprintInputSchema) -> str:
+    """La recomendación general necesita todos los hábitos para elegir la acción de mayor impacto."""
+    habits = "\n".join(_habit_lines(data).values())
+    return f"""Eres un asesor ambiental experto. Huella de carbono anual del usuario: {data.result} t CO2e/año.
+Hábitos (valor, rango):
+{habits}
+Da 1 recomendación general de alto impacto (category "General"), personalizada con estos datos. El texto, en español, explica brevemente por qué o cómo reduce la huella anual."""
+
+
+def _create_category_prompt(data: FootprintInputSchema, category: str) -> str:
+    """Prompt de una sola categoría: la huella total como contexto y solo los hábitos de esa categoría."""
+    label = _CATEGORY_LABELS[category]
+    return f"""Eres un asesor ambiental experto. Huella de carbono anual del usuario: {data.result} t CO2e/año.
+Hábitos de {label} (valor, rango):
+{_habit_lines(data)[category]}
+Da exactamente 2 sugerencias (suggestions) para reducir la huella de {label}, personalizadas con estos datos. Cada texto, en español, explica brevemente por qué o cómo reduce la huella anual."""
+
+
+def _parallel_requests(data: FootprintInputSchema) -> Dict[str, Tuple[str, Type[BaseModel]]]:
+    """(prompt, response_model) de cada sección, en el orden de PARALLEL_SECTIONS."""
+    requests: Dict[str, Tuple[str, Type[BaseModel]]] = {"global_recommendation": (_create_global_prompt(data), FullRecommendation)}
+    for category in _CATEGORY_LABELS:
+        requests[category] = (_create_category_prompt(data, category), CategoryGenerationSchema)
+    return requests
+
+
+def _cache_namespace() -> str:
+    """Namespace de caché del modo configurado (cada modo usa un prompt distinto)."""
+    if settings.GEMINI_PARALLEL_CATEGORIES:
+        return PARALLEL_CACHE_NAMESPACE
+    if settings.GEMINI_STRUCTURED_OUTPUT:
+        return STRUCTURED_CACHE_NAMESPACE
+    return CACHE_NAMESPACE
+
+
+def _generation_request(data: FootprintInputSchema) -> Tuple[str, Optional[Type[BaseModel]], str]:
+    """Devuelve (prompt, response_model, namespace de caché) según el modo configurado."""
+    if settings.GEMINI_PARALLEL_CATEGORIES: # Los cinco prompts se construyen en _parallel_requests
+        return "", None, _cache_namespace()
+    if settings.GEMINI_STRUCTURED_OUTPUT:
+        return _create_compact_prompt(data), RecommendationGenerationSchema, _cache_namespace()
+    return _create_prompt(data), None, _cache_namespace()
+
+
+def _placeholder_categories(text: str) -> RecommendationsByCategory:
+    item = CategorySpecificSuggestion(suggestion=text)
+    return RecommendationsByCategory(**{category: [item, item] for category in RecommendationsByCategory.model_fields})
+
+# Piezas de las respuestas de error, construidas una sola vez: son inmutables y se comparten entre peticiones
+_NO_RESPONSE_TEXT = "Failed to get recommendations from AI model."
+_PREVIOUS_ERROR_CATEGORIES = _placeholder_categories("No specific suggestion due to previous error.")
+_JSON_ERROR_CATEGORIES = _placeholder_categories("Error parsing data.")
+_STRUCTURE_ERROR_CATEGORIES = _placeholder_categories("Error in data structure.")
+_UNEXPECTED_ERROR_CATEGORIES = _placeholder_categories("Unexpected processing error.")
+_JSON_ERROR_GLOBAL = FullRecommendation(category="Error", suggestion="AI response format error (JSONDecodeError).")
+
+
+def _validation_error_summary(error: ValidationError) -> str:
+    """Resumen corto de un ValidationError (las tres primeras rutas y mensajes)."""
+    details = "; ".join(
+        f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors(include_url=False)[:3]
+    )
+    return f"{error.error_count()} validation error(s): {details}"
+
+
 def _parse_gemini_response_structured(response_text: str | None) -> RecommendationOutputSchema | None:
     # Manejo de error inicial (si la respuesta de Gemini es vacía o un error conocido)
     if not response_text or response_text.startswith("Error") or response_text.startswith("Blocked"):
-        logger.warning(f"Received invalid or error response from Gemini: {response_text}")
-        error_global_rec = FullRecommendation(category="Error", suggestion=response_text or "Failed to get recommendations from AI model.")
-        empty_cat_recs_data = {
-            "transport": [], "food": [], "energy": [], "waste": []
-        }
-        # Rellenar con sugerencias de error si se desea, o dejarlas vacías.
-        for cat in empty_cat_recs_data:
-            empty_cat_recs_data[cat] = [
-                CategorySpecificSuggestion(suggestion="No specific suggestion due to previous error."),
-                CategorySpecificSuggestion(suggestion="No specific suggestion due to previous error.")
-            ]
-
-        empty_cat_recs = RecommendationsByCategory(**empty_cat_recs_data)
+        logger.warning("Received invalid or error response from Gemini: %s", response_text)
+        PARSE_FAILURES.labels("empty_response" if not response_text else "gemini_error").inc()
         return RecommendationOutputSchema(
-            global_recommendation=error_global_rec,
-            category_recommendations=empty_cat_recs,
-            notes=response_text or "Failed to get recommendations from AI model."
+            global_recommendation=FullRecommendation(category="Error", suggestion=response_text or _NO_RESPONSE_TEXT),
+            category_recommendations=_PREVIOUS_ERROR_CATEGORIES,
+            notes=response_text or _NO_RESPONSE_TEXT
         )
 
+    cleaned_text = response_text.strip().removeprefix("```json").removesuffix("```").strip()
+    try:
+        # Una sola pasada: el JSON se valida directamente contra el schema (sin dict intermedio);
+        # el relleno/truncado a dos sugerencias por categoría lo hacen los validadores del schema.
+        output = RecommendationOutputSchema.model_validate_json(cleaned_text)
+        if output.notes is not None: # 'notes' es un campo propio de la API, nunca del modelo de IA
+            output.notes = None
+        return output
+
+    except ValidationError as e:
+        if any(err["type"] == "json_invalid" for err in e.errors(include_url=False)):
+            log_payload(logger, logging.ERROR, "Failed to parse Gemini JSON response: %s. Response text was: %s", response_text, e)
+            PARSE_FAILURES.labels("invalid_json").inc()
+            notes = f"AI response format error (JSONDecodeError). Raw: {response_text[:200]}..."
+            return RecommendationOutputSchema(global_recommendation=_JSON_ERROR_GLOBAL, category_recommendations=_JSON_ERROR_CATEGORIES, notes=notes)
+
+        summary = _validation_error_summary(e)
+        log_payload(logger, logging.ERROR, "Structural validation error parsing Gemini response: %s. Response text: %s", response_text, summary)
+        PARSE_FAILURES.labels("invalid_structure").inc()
+        error_global_rec = FullRecommendation(category="Error", suggestion=f"AI response structure error: {summary}.")
+        notes = f"AI response structure error: {summary}. Raw: {response_text[:200]}..."
+        return RecommendationOutputSchema(global_recommendation=error_global_rec, category_recommendations=_STRUCTURE_ERROR_CATEGORIES, notes=notes)
+
+    except Exception as e:
+        log_payload(logger, logging.ERROR, "Unexpected error parsing Gemini response: %s. Response text: %s", response_text, e)
+        PARSE_FAILURES.labels("unexpected").inc()
+        error_global_rec = FullRecommendation(category="Error", suggestion=f"Unexpected error processing AI response: {e}")
+        notes = f"Unexpected error processing AI response: {e}"
+        return RecommendationOutputSchema(global_recommendation=error_global_rec, category_recommendations=_UNEXPECTED_ERROR_CATEGORIES, notes=notes)
+
+def _generate_local_recommendations(footprint_data: FootprintInputSchema) -> RecommendationOutputSchema:
+    # Import diferido: el motor local carga NumPy, que no hace falta para arrancar (el lifespan lo precarga)
+    from app.services.local_engine import generate_local_recommendations
+    return generate_local_recommendations(footprint_data)
+
+
+def is_error_output(output: Optional[RecommendationOutputSchema]) -> bool:
+    """True si el parser devolvió None o un objeto marcado como error (notas o categoría 'Error')."""
+    return output is None or \
+       bool(output.notes and ("error" in output.notes.lower() or "fallo" in output.notes.lower())) or \
+       bool(output.global_recommendation and output.global_recommendation.category.lower() == "error")
+
+
+def engine_name(engine: Optional[str]) -> str:
+    return "local" if (engine or settings.RECOMMENDATION_ENGINE) == "local" else "gemini"
+
+
+def footprint_date(footprint_data: FootprintInputSchema) -> date:
+    """Fecha de la huella como date. Lanza ValueError si el formato no es válido."""
+    if isinstance(footprint_data.date, str):
+        return datetime.strptime(footprint_data.date, "%Y-%m-%d").date()
+    if isinstance(footprint_data.date, date): # Si ya es un objeto date
+        return footprint_data.date
+    # Manejar caso inesperado, podría ser un error de validación del input
+    raise ValueError(f"Tipo de fecha no esperado para footprint_data.date: {type(footprint_data.date)}")
+
+
+def idempotency_fingerprint(footprint_data: FootprintInputSchema, user_id: str, engine: str) -> Optional[str]:
+    """Huella de la entrada para el modo idempotente; None si está desactivado o la petición es anónima."""
+    if not settings.IDEMPOTENT_RECOMMENDATIONS_ENABLED or user_id == ANONYMOUS_USER_ID:
+        return None # 'No Login' agrupa a todos los anónimos: no se puede saber si es un reenvío del mismo usuario
+    return input_fingerprint(footprint_data, engine)
+
+
+async def _stored_recommendations(
+    footprint_data: FootprintInputSchema,
+    user_id: str,
+    engine: str
+) -> Optional[RecommendationOutputSchema]:
+    """Recomendaciones ya guardadas para esta misma entrada (usuario, fecha, valores y motor), si existen."""
+    fingerprint = idempotency_fingerprint(footprint_data, user_id, engine)
+    if fingerprint is None:
+        return None
+    try:
+        calculation_date = footprint_date(footprint_data)
+    except ValueError:
+        return None # Se informará del formato en _persist_and_publish
+    with timed("db"):
+        payload = await fetch_recommendation_by_fingerprint(user_id, calculation_date, fingerprint)
+    if payload is None:
+        return None
+    try:
+        # El JSONB de Postgres no conserva el texto original: se vuelve a serializar como una respuesta recién generada
+        stored_output = RecommendationOutputSchema.from_json(payload, reuse_text=False)
+    except ValidationError as e:
+        logger.warning("La fila guardada para %s (%s) no es válida; se regenera: %s", user_id, calculation_date, e)
+        return None
+    STORED_RECOMMENDATION_HITS.inc()
+    logger.info("Reenvío idéntico de %s para %s: se devuelve la fila guardada (sin LLM ni nueva fila).", user_id, calculation_date)
+    return stored_output
+
+
+def _parse_parallel_section(section: str, response_text: Optional[str], response_model: Type[BaseModel]) -> Optional[BaseModel]:
+    """Valida la respuesta de una sección del modo paralelo; None si Gemini falló o el JSON no es válido."""
+    if not response_text or response_text.startswith("Error") or response_text.startswith("Blocked"):
+        logger.warning("Sección '%s' sin respuesta válida de Gemini: %s", section, response_text)
+        PARSE_FAILURES.labels("empty_response" if not response_text else "gemini_error").inc()
+        return None
     try:
-        cleaned_text = response_text.strip().removeprefix("```json").removesuffix("```").strip()
-        data = json.loads(cleaned_text)
-
-        # Validación de la estructura principal
-        if not isinstance(data, dict) or "global_recommendation" not in data or "category_recommendations" not in data:
-            logger.error(f"Gemini response missing main keys. Response: {cleaned_text}")
-            raise ValueError("Main keys 'global_recommendation' or 'category_recommendations' missing in AI response.")
-
-        # Parsear recomendación global
-        global_rec_data = data.get("global_recommendation", {})
-        if not isinstance(global_rec_data, dict) or "category" not in global_rec_data or "suggestion" not in global_rec_data:
-            logger.error(f"Invalid global_recommendation structure: {global_rec_data}")
-            raise ValueError("Invalid structure for 'global_recommendation'.")
-        global_recommendation = FullRecommendation(
-            category=str(global_rec_data.get("category", "General")),
-            suggestion=str(global_rec_data.get("suggestion", "No global suggestion provided."))
+        return response_model.model_validate_json(response_text.strip().removeprefix("```json").removesuffix("```").strip())
+    except ValidationError as e:
+        invalid_json = any(err["type"] == "json_invalid" for err in e.errors(include_url=False))
+        log_payload(
+            logger, logging.ERROR, "Respuesta de Gemini no válida para la sección '%s': %s. Respuesta: %s", response_text,
+            section, _validation_error_summary(e)
         )
+        PARSE_FAILURES.labels("invalid_json" if invalid_json else "invalid_structure").inc()
+        return None
 
-        # Parsear recomendaciones por categoría (ahora solo con 'suggestion')
-        cat_recs_data = data.get("category_recommendations", {})
-        parsed_category_suggestions = {}
-        categories_to_check = ["transport", "food", "energy", "waste"]
-
-        for cat_key in categories_to_check:
-            specific_suggestions_list = []
-            cat_specific_item_list = cat_recs_data.get(cat_key, []) # Lista de objetos {suggestion: "..."}
-            if isinstance(cat_specific_item_list, list):
-                for item_data in cat_specific_item_list:
-                    # Ahora esperamos solo la clave 'suggestion'
-                    if isinstance(item_data, dict) and "suggestion" in item_data:
-                        specific_suggestions_list.append(CategorySpecificSuggestion(
-                            suggestion=str(item_data.get("suggestion", "No suggestion provided."))
-                        ))
-                    else:
-                        logger.warning(f"Skipping invalid item in '{cat_key}' suggestions (expected {{'suggestion': ...}}): {item_data}")
-            else:
-                logger.warning(f"Expected a list for '{cat_key}' recommendations, got: {type(cat_specific_item_list)}")
-            
-            # Rellenar si no hay suficientes sugerencias para cumplir con el "exactamente dos"
-            # Esto es importante si Gemini no sigue las instrucciones al pie de la letra.
-            while len(specific_suggestions_list) < 2:
-                logger.warning(f"Not enough suggestions for '{cat_key}', padding with default.")
-                specific_suggestions_list.append(CategorySpecificSuggestion(suggestion=f"No specific suggestion provided by AI for {cat_key} (slot {len(specific_suggestions_list)+1})."))
-            
-            # Truncar si hay demasiadas (aunque el prompt pide 2)
-            parsed_category_suggestions[cat_key] = specific_suggestions_list[:2]
 
+async def _generate_parallel_section(
+    section: str,
+    prompt: str,
+    response_model: Type[BaseModel]
+) -> Tuple[str, Optional[BaseModel], Optional[AdmissionRejected]]:
+    try:
+        response_text = await generate_text_from_gemini(prompt, response_model=response_model)
+    except AdmissionRejected as e:
+        return section, None, e
+    return section, _parse_parallel_section(section, response_text, response_model), None
 
-        category_recommendations_obj = RecommendationsByCategory(**parsed_category_suggestions)
 
+async def _parallel_sections(data: FootprintInputSchema) -> AsyncIterator[Tuple[str, Optional[BaseModel], Optional[AdmissionRejected]]]:
+    """Lanza los cinco prompts a la vez y produce (sección, resultado o None, rechazo) según van terminando."""
+    tasks = [
+        asyncio.create_task(_generate_parallel_section(section, prompt, response_model))
+        for section, (prompt, response_model) in _parallel_requests(data).items()
+    ]
+    try:
+        for next_completed in asyncio.as_completed(tasks):
+            yield await next_completed
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def _merge_parallel_sections(
+    data: FootprintInputSchema,
+    sections: Dict[str, BaseModel],
+    rejections: List[AdmissionRejected]
+) -> Tuple[RecommendationOutputSchema, bool]:
+    """
+    Une las secciones en un RecommendationOutputSchema. Devuelve (salida, completa). Una sección fallida se
+    degrada sola: motor local si LOCAL_ENGINE_FALLBACK, o el texto de relleno habitual, y se indica en las notas.
+    Si fallan las cinco, salida de error (o AdmissionRejected si alguna no se admitió).
+    """
+    failed = [section for section in PARALLEL_SECTIONS if section not in sections]
+    if len(failed) == len(PARALLEL_SECTIONS):
+        if rejections:
+            raise rejections[0]
+        notes = "Fallo: ninguna de las llamadas en paralelo a Gemini devolvió una respuesta válida."
         return RecommendationOutputSchema(
-            global_recommendation=global_recommendation,
-            category_recommendations=category_recommendations_obj
-        )
+            global_recommendation=FullRecommendation(category="Error", suggestion=notes),
+            category_recommendations=_PREVIOUS_ERROR_CATEGORIES,
+            notes=notes
+        ), False
+
+    local_output = _generate_local_recommendations(data) if failed and settings.LOCAL_ENGINE_FALLBACK else None
+    global_part = sections.get("global_recommendation")
+    if global_part is not None:
+        global_recommendation = FullRecommendation(category="General", suggestion=global_part.suggestion)
+    elif local_output is not None:
+        global_recommendation = local_output.global_recommendation
+    else:
+        global_recommendation = FullRecommendation(category="General", suggestion="No global suggestion provided by AI.")
+
+    categories = {
+        category: sections[category].suggestions if category in sections
+        else getattr(local_output.category_recommendations, category) if local_output is not None
+        else [] # RecommendationsByCategory rellena con el texto por defecto
+        for category in _CATEGORY_LABELS
+    }
+    output = RecommendationOutputSchema(
+        global_recommendation=global_recommendation,
+        category_recommendations=RecommendationsByCategory(**categories)
+    )
+    if failed:
+        source = "motor local" if local_output is not None else "texto por defecto"
+        logger.warning("Secciones sin respuesta de Gemini: %s. Se usa %s.", ', '.join(failed), source)
+        output.add_note(f"Secciones generadas sin IA ({source}): {', '.join(failed)}.")
+    return output, not failed
 
-    # Bloques catch para errores (JSONDecodeError, ValueError, Exception general)
-    # Son similares a los de la respuesta anterior, pero asegúrate de que construyen
-    # el RecommendationOutputSchema con el nuevo FullRecommendation y CategorySpecificSuggestion.
-    except json.JSONDecodeError as e:
-        logger.error(f"Failed to parse Gemini JSON response: {e}. Response text was: {response_text}")
-        error_global_rec = FullRecommendation(category="Error", suggestion=f"AI response format error (JSONDecodeError).")
-        notes = f"AI response format error (JSONDecodeError). Raw: {response_text[:200]}..."
-        # Crear una estructura de error para category_recommendations
-        error_cat_recs_data = {cat: [CategorySpecificSuggestion(suggestion="Error parsing data.")]*2 for cat in categories_to_check}
-        error_cat_recs = RecommendationsByCategory(**error_cat_recs_data)
-        return RecommendationOutputSchema(global_recommendation=error_global_rec, category_recommendations=error_cat_recs, notes=notes)
-
-    except ValueError as e: # Para nuestros errores de validación de estructura
-        logger.error(f"Structural validation error parsing Gemini response: {e}. Response text: {response_text}")
-        error_global_rec = FullRecommendation(category="Error", suggestion=f"AI response structure error: {e}.")
-        notes = f"AI response structure error: {e}. Raw: {response_text[:200]}..."
-        error_cat_recs_data = {cat: [CategorySpecificSuggestion(suggestion="Error in data structure.")]*2 for cat in categories_to_check}
-        error_cat_recs = RecommendationsByCategory(**error_cat_recs_data)
-        return RecommendationOutputSchema(global_recommendation=error_global_rec, category_recommendations=error_cat_recs, notes=notes)
 
-    except Exception as e:
-        logger.error(f"Unexpected error parsing Gemini response: {e}. Response text: {response_text}")
-        error_global_rec = FullRecommendation(category="Error", suggestion=f"Unexpected error processing AI response: {e}")
-        notes = f"Unexpected error processing AI response: {e}"
-        error_cat_recs_data = {cat: [CategorySpecificSuggestion(suggestion="Unexpected processing error.")]*2 for cat in categories_to_check}
-        error_cat_recs = RecommendationsByCategory(**error_cat_recs_data)
-        return RecommendationOutputSchema(global_recommendation=error_global_rec, category_recommendations=error_cat_recs, notes=notes)
+async def _generate_parallel(data: FootprintInputSchema) -> Tuple[RecommendationOutputSchema, bool]:
+    sections: Dict[str, BaseModel] = {}
+    rejections: List[AdmissionRejected] = []
+    async for section, part, rejection in _parallel_sections(data):
+        if part is not None:
+            sections[section] = part
+        elif rejection is not None:
+            rejections.append(rejection)
+    return _merge_parallel_sections(data, sections, rejections)
 
-async def get_recommendations_for_footprint(
+
+def _output_section_payload(section: str, output: RecommendationOutputSchema) -> Any:
+    if section == "global_recommendation":
+        return output.global_recommendation.model_dump()
+    return [item.model_dump() for item in getattr(output.category_recommendations, section)]
+
+
+async def _generate_with_gemini(
     footprint_data: FootprintInputSchema,
-    user_id_from_token: str 
-) -> RecommendationOutputSchema:
-    logger.info(f"Procesando recomendaciones para usuario: {user_id_from_token}, fecha huella: {footprint_data.date}")
+    prompt: str,
+    response_model: Optional[Type[BaseModel]]
+) -> Tuple[Optional[RecommendationOutputSchema], bool]:
+    """
+    Pasos 1-3 (prompt, Gemini y parseo), sin caché, BD ni webhook: los añade quien llama (la API o el backfill).
+    Devuelve (salida o None, completa) y lanza AdmissionRejected si la compuerta de Gemini no admite la llamada.
+    """
+    if settings.GEMINI_PARALLEL_CATEGORIES:
+        # 1-3. Cinco prompts pequeños a la vez; cada sección se valida por separado y se unen
+        with timed("gemini"):
+            return await _generate_parallel(footprint_data)
 
-    # 1. Generar el prompt para Gemini
-    #    _create_prompt debe estar adaptado para solicitar la estructura que _parse_gemini_response_structured espera.
-    prompt = _create_prompt(footprint_data)
-    logger.debug(f"Generated Gemini Prompt (Structured Output Request):\n{prompt}")
+    # 1. El prompt ya se generó antes (_create_prompt o _create_compact_prompt según el modo);
+    #    ambos piden la estructura que _parse_gemini_response_structured espera.
+    logger.debug("Generated Gemini Prompt (Structured Output Request):\n%s", prompt)
 
     # 2. Obtener respuesta de Gemini
-    gemini_response_text = await generate_text_from_gemini(prompt)
-    logger.debug(f"Received Gemini Response Text (Structured):\n{gemini_response_text}")
+    with timed("gemini"):
+        gemini_response_text = await generate_text_from_gemini(prompt, response_model=response_model)
+    logger.debug("Received Gemini Response Text (Structured):\n%s", gemini_response_text)
 
     # 3. Parsear la respuesta de Gemini al nuevo RecommendationOutputSchema
     #    _parse_gemini_response_structured debe estar actualizada para manejar la nueva estructura de schemas
     #    y devolver un RecommendationOutputSchema.
-    parsed_output: Optional[RecommendationOutputSchema] = _parse_gemini_response_structured(gemini_response_text)
-
-    # Manejo si el parseo falla y devuelve None (o una estructura con errores)
-    if parsed_output is None or \
-       (parsed_output.notes and ("error" in parsed_output.notes.lower() or "fallo" in parsed_output.notes.lower())) or \
-       (parsed_output.global_recommendation and parsed_output.global_recommendation.category.lower() == "error"):
-
-        logger.warning("Error detectado en la respuesta parseada de Gemini. No se guardará en BD.")
-        # Si parsed_output es None, necesitamos crear un objeto de error para devolver
-        if parsed_output is None:
-            error_text = "Fallo interno: el parseo de la respuesta de IA devolvió None."
-            logger.error(error_text)
-            error_global_rec = FullRecommendation(category="Error", suggestion=error_text)
-            # Crear RecommendationsByCategory vacío o con marcadores de error si se prefiere
-            from app.api.v1.schemas.recommendation import RecommendationsByCategory # Importar si no está ya
-            empty_cat_recs = RecommendationsByCategory(transport=[], food=[], energy=[], waste=[])
-            return RecommendationOutputSchema(
-                global_recommendation=error_global_rec,
-                category_recommendations=empty_cat_recs,
-                notes=error_text
-            )
-        return parsed_output # Devolver el output con las notas de error ya incluidas por el parser
+    with timed("parse"):
+        return _parse_gemini_response_structured(gemini_response_text), True
+
 
+async def generate_output(
+    footprint_data: FootprintInputSchema,
+    engine: Optional[str] = None
+) -> Tuple[Optional[RecommendationOutputSchema], str, bool]:
+    """
+    Genera las recomendaciones con el motor pedido, sin caché, BD ni webhook (los añade quien llama: la API o
+    el backfill). Si Gemini devuelve un error y LOCAL_ENGINE_FALLBACK está activo, se usa el motor local.
+    Devuelve (salida o None, motor que la generó, completa) y lanza AdmissionRejected si la compuerta de
+    Gemini no admite la llamada: cada llamador decide si espera o tira del motor local.
+    """
+    if engine_name(engine) == "local":
+        with timed("local_engine"):
+            return _generate_local_recommendations(footprint_data), "local", True
+
+    with timed("prompt"):
+        prompt, response_model, _ = _generation_request(footprint_data)
+    output, complete = await _generate_with_gemini(footprint_data, prompt, response_model)
+    if is_error_output(output) and settings.LOCAL_ENGINE_FALLBACK:
+        logger.warning("Error detectado en la respuesta de Gemini. Se usa el motor local como respaldo.")
+        with timed("local_engine"):
+            return _generate_local_recommendations(footprint_data), "local", True
+    return output, "gemini", complete
+
+
+async def get_recommendations_for_footprint(
+    footprint_data: FootprintInputSchema,
+    user_id_from_token: str,
+    engine: Optional[str] = None
+) -> RecommendationOutputSchema:
+    """`engine` ("gemini" o "local") permite elegir el motor por petición; por defecto RECOMMENDATION_ENGINE."""
+    logger.debug("Procesando recomendaciones para usuario: %s, fecha huella: %s", user_id_from_token, footprint_data.date)
+
+    engine = engine_name(engine)
+    # Modo idempotente: un reenvío idéntico devuelve lo ya guardado (ni LLM, ni fila nueva, ni webhook)
+    stored_output = await _stored_recommendations(footprint_data, user_id_from_token, engine)
+    if stored_output is not None:
+        return stored_output
+
+    if engine == "local":
+        # Motor local: determinista y sin llamada al LLM (ni caché, que no aporta nada aquí)
+        local_output, _, _ = await generate_output(footprint_data, engine)
+        return await _persist_and_publish(local_output, footprint_data, user_id_from_token, engine)
+
+    # 0. Buscar en caché: una huella igual (o cuantizada al mismo valor) servida hace poco evita la llamada al LLM
+    cache_key = footprint_cache_key(footprint_data, _cache_namespace()) if settings.CACHE_ENABLED else None
+    parsed_output: Optional[RecommendationOutputSchema] = None
+    if cache_key:
+        with timed("cache"):
+            parsed_output = await recommendation_cache.get(cache_key)
+        if parsed_output is not None:
+            logger.debug("Recomendaciones servidas desde caché (sin llamada a Gemini).")
+    if parsed_output is None and settings.SIMILARITY_INDEX_ENABLED:
+        # 0b. Sin acierto exacto: la respuesta de una huella vecina, con los valores citados adaptados a esta
+        with timed("similarity"):
+            parsed_output = similarity_index.lookup(footprint_data)
+
+    if parsed_output is None:
+        try:
+            # complete=False si alguna sección del modo paralelo se degradó (no se cachea)
+            parsed_output, engine, complete = await generate_output(footprint_data, engine)
+        except AdmissionRejected:
+            # Compuerta de Gemini saturada: sin respaldo local se propaga (el endpoint responde 429)
+            if not settings.LOCAL_ENGINE_FALLBACK:
+                raise
+            logger.warning("Compuerta de Gemini saturada. Se usa el motor local como respaldo.")
+            parsed_output, engine, _ = await generate_output(footprint_data, "local")
+
+        if engine == "local": # Respaldo local: ni caché ni índice de similitud, que guardan respuestas de Gemini
+            return await _persist_and_publish(parsed_output, footprint_data, user_id_from_token, engine)
+
+        if is_error_output(parsed_output):
+
+            logger.warning("Error detectado en la respuesta parseada de Gemini. No se guardará en BD.")
+            # Si parsed_output es None, necesitamos crear un objeto de error para devolver
+            if parsed_output is None:
+                error_text = "Fallo interno: el parseo de la respuesta de IA devolvió None."
+                logger.error(error_text)
+                error_global_rec = FullRecommendation(category="Error", suggestion=error_text)
+                return RecommendationOutputSchema(
+                    global_recommendation=error_global_rec,
+                    category_recommendations=_PREVIOUS_ERROR_CATEGORIES,
+                    notes=error_text
+                )
+            return parsed_output # Devolver el output con las notas de error ya incluidas por el parser
+
+        # Solo se cachean respuestas válidas y completas (y antes de añadir notas propias de esta petición)
+        if cache_key and complete:
+            await recommendation_cache.set(cache_key, parsed_output)
+        if settings.SIMILARITY_INDEX_ENABLED and complete:
+            similarity_index.add(footprint_data, parsed_output)
+
+    return await _persist_and_publish(parsed_output, footprint_data, user_id_from_token, engine)
+
+
+async def _persist_and_publish(
+    parsed_output: RecommendationOutputSchema,
+    footprint_data: FootprintInputSchema,
+    user_id_from_token: str,
+    engine: str
+) -> RecommendationOutputSchema:
+    """
+    Pasos finales comunes a todas las variantes: guardar en BD y enviar al servicio externo.
+    `engine` es el motor que generó realmente la respuesta (forma parte de la huella del modo idempotente).
+    Con WEBHOOK_OUTBOX_ENABLED el envío se guarda en webhook_outbox junto a la fila y lo hace el dispatcher.
+    """
     # 4. Convertir la fecha del input para la base de datos
     try:
-        if isinstance(footprint_data.date, str):
-             calculation_dt_obj = datetime.strptime(footprint_data.date, "%Y-%m-%d").date()
-        elif isinstance(footprint_data.date, date): # Si ya es un objeto date
-             calculation_dt_obj = footprint_data.date
-        else:
-            # Manejar caso inesperado, podría ser un error de validación del input
-            raise ValueError(f"Tipo de fecha no esperado para footprint_data.date: {type(footprint_data.date)}")
+        calculation_dt_obj = footprint_date(footprint_data)
     except ValueError as e:
         error_msg = f"Formato de fecha inválido: {footprint_data.date}. Error: {e}. No se guardará en BD."
         logger.error(error_msg)
-        parsed_output.notes = (parsed_output.notes + " | " if parsed_output.notes else "") + error_msg
+        parsed_output.add_note(error_msg)
         return parsed_output
 
     # 5. Guardar las recomendaciones en la base de datos
-    logger.info(f"Intentando guardar recomendaciones para el usuario {user_id_from_token} en la base de datos.")
-    save_to_db_successful = insert_recommendations(
-        user_id=user_id_from_token,
-        calculation_date=calculation_dt_obj,
-        recommendations=parsed_output # parsed_output es del tipo RecommendationOutputSchema
-    )
+    #    En modo write-behind la fila se encola y se inserta por lotes fuera del camino de la respuesta;
+    #    si la cola no la acepta (llena o detenida) se inserta directamente. Con el outbox del webhook la fila
+    #    se inserta siempre directamente, junto a su entrega: en la cola en memoria un reinicio la perdería.
+    save_to_db_successful = False
+    fingerprint = idempotency_fingerprint(footprint_data, user_id_from_token, engine)
+    outbox_payload = None
+    if settings.WEBHOOK_OUTBOX_ENABLED and settings.TARGET_SERVICE_URL:
+        outbox_payload = parsed_output.to_json().decode()
+    with timed("db"):
+        if settings.DB_WRITE_BEHIND_ENABLED and outbox_payload is None:
+            save_to_db_successful = await write_behind_queue.enqueue(
+                user_id=user_id_from_token,
+                calculation_date=calculation_dt_obj,
+                recommendations=parsed_output,
+                input_fingerprint=fingerprint
+            )
+            if save_to_db_successful:
+                logger.debug("Recomendaciones encoladas (write-behind) para el usuario %s.", user_id_from_token)
+        if not save_to_db_successful:
+            logger.debug("Intentando guardar recomendaciones para el usuario %s en la base de datos.", user_id_from_token)
+            save_to_db_successful = await insert_recommendations(
+                user_id=user_id_from_token,
+                calculation_date=calculation_dt_obj,
+                recommendations=parsed_output, # parsed_output es del tipo RecommendationOutputSchema
+                input_fingerprint=fingerprint,
+                outbox_payload=outbox_payload
+            )
 
     if not save_to_db_successful:
         warning_msg = f"No se pudieron guardar las recomendaciones en la BD para el usuario {user_id_from_token}."
         logger.warning(warning_msg)
-        parsed_output.notes = (parsed_output.notes + " | " if parsed_output.notes else "") + warning_msg
+        parsed_output.add_note(warning_msg)
     else:
-        logger.info("Recomendaciones guardadas en BD exitosamente.")
+        logger.debug("Recomendaciones guardadas en BD exitosamente.")
 
     # 6. (Opcional) Enviar a servicio externo si es necesario
-    await post_recommendations_to_external_service(parsed_output)
+    #    Con el outbox la entrega ya quedó guardada con la fila: el dispatcher la envía fuera de la respuesta.
+    if outbox_payload is None:
+        with timed("webhook"):
+            await post_recommendations_to_external_service(parsed_output)
+    elif save_to_db_successful:
+        webhook_outbox.notify()
+    else:
+        webhook_outbox.send_detached(outbox_payload.encode()) # Sin fila no hay outbox: un intento en segundo plano
 
     if parsed_output.notes:
-         logger.warning(f"Notas finales del proceso de recomendación: {parsed_output.notes}")
+         logger.warning("Notas finales del proceso de recomendación: %s", parsed_output.notes)
+
+    logger.debug("Proceso completo de recomendaciones para el usuario %s.", user_id_from_token)
+    return parsed_output
+
+# Secciones de la respuesta que se emiten como eventos SSE en cuanto Gemini termina de escribirlas
+STREAM_SECTIONS = {
+    ("global_recommendation",): "global_recommendation",
+    ("category_recommendations", "transport"): "transport",
+    ("category_recommendations", "food"): "food",
+    ("category_recommendations", "energy"): "energy",
+    ("category_recommendations", "waste"): "waste",
+}
+
+def _stream_section_payload(event: str, raw_value) -> Any:
+    """Normaliza una sección cruda del stream igual que lo hará el parser final (mismos rellenos y truncados)."""
+    if event == "global_recommendation":
+        if not isinstance(raw_value, dict):
+            return None
+        return {
+            "category": str(raw_value.get("category", "General")),
+            "suggestion": str(raw_value.get("suggestion", "No global suggestion provided.")),
+        }
+    return normalize_category_suggestions(event, raw_value)
+
+def _parallel_section_payload(section: str, part: BaseModel) -> Any:
+    """Evento SSE de una sección del modo paralelo, normalizado igual que al unir las cinco respuestas."""
+    if section == "global_recommendation":
+        return _stream_section_payload(section, {"category": "General", "suggestion": part.suggestion})
+    return _stream_section_payload(section, part.model_dump()["suggestions"])
 
-    logger.info(f"Proceso completo de recomendaciones para el usuario {user_id_from_token}.")
-    return parsed_output
\ No newline at end of file
+async def stream_recommendations_for_footprint(
+    footprint_data: FootprintInputSchema,
+    user_id_from_token: str,
+    engine: Optional[str] = None
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Variante en streaming de get_recommendations_for_footprint. Produce tuplas (evento, datos):
+    'global_recommendation' y una por categoría ('transport', 'food', 'energy', 'waste') en cuanto
+    cada sección está completa (datos ya serializables a JSON); al final 'done' con el
+    RecommendationOutputSchema resultante, o 'error' si la generación falla.
+    """
+    logger.debug("Procesando recomendaciones (streaming) para usuario: %s, fecha huella: %s", user_id_from_token, footprint_data.date)
+
+    engine = engine_name(engine)
+    stored_output = await _stored_recommendations(footprint_data, user_id_from_token, engine)
+    if stored_output is not None:
+        yield "global_recommendation", stored_output.global_recommendation.model_dump()
+        for event, items in stored_output.category_recommendations:
+            yield event, [item.model_dump() for item in items]
+        yield "done", stored_output
+        return
+
+    with timed("prompt"):
+        prompt, response_model, cache_namespace = _generation_request(footprint_data)
+    use_local_engine = engine == "local"
+    cache_key = footprint_cache_key(footprint_data, cache_namespace) if settings.CACHE_ENABLED and not use_local_engine else None
+    parsed_output = None
+    if cache_key:
+        with timed("cache"):
+            parsed_output = await recommendation_cache.get(cache_key)
+    if parsed_output is None and settings.SIMILARITY_INDEX_ENABLED and not use_local_engine:
+        with timed("similarity"):
+            parsed_output = similarity_index.lookup(footprint_data)
+    if use_local_engine:
+        with timed("local_engine"):
+            parsed_output = _generate_local_recommendations(footprint_data)
+
+    if parsed_output is not None:
+        # Caché, vecino o motor local: la respuesta completa ya está disponible, se emite de golpe
+        yield "global_recommendation", parsed_output.global_recommendation.model_dump()
+        for event, items in parsed_output.category_recommendations:
+            yield event, [item.model_dump() for item in items]
+    else:
+        complete = True # False si alguna sección del modo paralelo se degradó (no se cachea)
+        if settings.GEMINI_PARALLEL_CATEGORIES:
+            # Cinco prompts a la vez: cada sección se emite en cuanto su llamada termina, en el orden en que acaben
+            sections: Dict[str, BaseModel] = {}
+            rejections: List[AdmissionRejected] = []
+            gemini_start = time.perf_counter()
+            try:
+                async for section, part, rejection in _parallel_sections(footprint_data):
+                    if part is not None:
+                        sections[section] = part
+                        yield section, _parallel_section_payload(section, part)
+                    elif rejection is not None:
+                        rejections.append(rejection)
+            finally:
+                observe_stage("gemini", time.perf_counter() - gemini_start)
+            try:
+                with timed("parse"):
+                    parsed_output, complete = _merge_parallel_sections(footprint_data, sections, rejections)
+            except AdmissionRejected as e:
+                logger.warning("Streaming con Gemini no admitido (%s).", e.reason)
+                if not settings.LOCAL_ENGINE_FALLBACK:
+                    yield "error", {"detail": e.detail, "status_code": 429, "retry_after": e.retry_after_header}
+                    return
+            else:
+                if not is_error_output(parsed_output):
+                    # Secciones degradadas: se emiten con el contenido que las sustituye
+                    for section in PARALLEL_SECTIONS:
+                        if section not in sections:
+                            yield section, _output_section_payload(section, parsed_output)
+        else:
+            scanner = IncrementalJSONScanner(STREAM_SECTIONS)
+            gemini_start = time.perf_counter() # Incluye el tiempo que el cliente tarda en consumir cada evento
+            try:
+                async for chunk in stream_text_from_gemini(prompt, response_model=response_model):
+                    for path, raw_value in scanner.feed(chunk):
+                        event = STREAM_SECTIONS[path]
+                        payload = _stream_section_payload(event, raw_value)
+                        if payload is not None:
+                            yield event, payload
+            except AdmissionRejected as e:
+                logger.warning("Streaming con Gemini no admitido (%s).", e.reason)
+                if not settings.LOCAL_ENGINE_FALLBACK:
+                    yield "error", {"detail": e.detail, "status_code": 429, "retry_after": e.retry_after_header}
+                    return
+            except Exception as e:
+                logger.error("Error during streaming generation with Gemini: %s", e)
+                if not settings.LOCAL_ENGINE_FALLBACK:
+                    yield "error", {"detail": f"Error communicating with Gemini: {e}"}
+                    return
+                # Con respaldo local, el texto parcial no parseará y se usará el motor local abajo
+            finally:
+                observe_stage("gemini", time.perf_counter() - gemini_start)
+
+            with timed("parse"):
+                parsed_output = _parse_gemini_response_structured(scanner.text)
+
+        if is_error_output(parsed_output) and settings.LOCAL_ENGINE_FALLBACK:
+            logger.warning("Error detectado en la respuesta (streaming) de Gemini. Se usa el motor local como respaldo.")
+            # Se reemiten todas las secciones: sustituyen a las que Gemini hubiera enviado antes de fallar
+            with timed("local_engine"):
+                parsed_output = _generate_local_recommendations(footprint_data)
+            cache_key = None
+            engine = "local"
+            yield "global_recommendation", parsed_output.global_recommendation.model_dump()
+            for event, items in parsed_output.category_recommendations:
+                yield event, [item.model_dump() for item in items]
+        if is_error_output(parsed_output):
+            logger.warning("Error detectado en la respuesta (streaming) de Gemini. No se guardará en BD.")
+            detail = (parsed_output.notes if parsed_output and parsed_output.notes
+                      else "Fallo interno: el parseo de la respuesta de IA devolvió None.")
+            yield "error", {"detail": f"Error al generar recomendaciones: {detail}"}
+            return
+        if cache_key and complete:
+            await recommendation_cache.set(cache_key, parsed_output)
+        if settings.SIMILARITY_INDEX_ENABLED and complete and engine != "local":
+            similarity_index.add(footprint_data, parsed_output)
+
+    final_output = await _persist_and_publish(parsed_output, footprint_data, user_id_from_token, engine)
+    yield "done", final_output
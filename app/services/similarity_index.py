@@ -0,0 +1,210 @@
+# app/services/similarity_index.py
+# Reutilización por vecino más cercano: la caché exacta solo acierta si la huella cae en el mismo intervalo
+# cuantizado, y la mayoría de usuarios se diferencian en unos pocos km o en una comida. Este índice guarda las
+# últimas recomendaciones generadas por Gemini junto al vector de hábitos de su huella; una huella nueva a menos
+# de SIMILARITY_MAX_DISTANCE de una guardada reutiliza esa respuesta, con los valores del usuario que cita el
+# texto sustituidos por los de la nueva huella, en lugar de llamar a Gemini.
+from app.api.v1.schemas.footprint import FootprintInputSchema
+from app.api.v1.schemas.recommendation import RecommendationOutputSchema
+from app.core.config import settings
+from app.core.metrics import SIMILARITY_LOOKUPS
+from app.services.footprint_key import footprint_values
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+import logging
+import math
+import re
+import time
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VECTOR_DIMENSIONS = 17 # 16 hábitos en el orden de HABIT_FIELDS + `result`
+
+# Número suelto dentro del texto: no parte de una palabra (CO2), de un rango (1-2) ni de un porcentaje (50%)
+_NUMBER_RE = re.compile(r"(?<![\w.,\-])\d+(?:[.,]\d+)?(?![\w%]|[.,]\d)")
+
+
+def habit_vector(values: Sequence[float]) -> "np.ndarray":
+    """
+    Vector normalizado de una huella: log1p de cada valor, así la distancia mide diferencias relativas
+    (100 frente a 110 km pesa como 1 frente a 1.1 vuelos) y ningún hábito domina por sus unidades.
+    """
+    import numpy as np # Diferido como en el motor local: el lifespan lo precarga en segundo plano
+    return np.log1p(np.maximum(np.asarray(values, dtype=np.float32), 0.0))
+
+
+def _format_number(value: float, decimal_separator: str) -> str:
+    if value == int(value):
+        return str(int(value))
+    return f"{value:g}".replace(".", decimal_separator)
+
+
+# Por debajo de esto un número del texto es tan probable que sea un paso, un objetivo ("de 2 a 1 vuelos") o una
+# cifra derivada como el valor del usuario: no se sustituye
+MIN_RETEMPLATE_VALUE = 10.0
+
+
+def retemplate(payload: str, old_values: Sequence[float], new_values: Sequence[float]) -> Optional[str]:
+    """
+    Sustituye en el JSON de una respuesta los valores de la huella original (old_values) que aparecen citados
+    en el texto por los de la nueva. Solo se sustituye un valor que cambió si no hay duda de que la cifra del
+    texto es ese valor: lo tenía un único hábito, es al menos MIN_RETEMPLATE_VALUE y aparece una sola vez.
+    Si el texto cita un valor que cambió sin cumplir eso, devuelve None (conflicto: se llama a Gemini). Las
+    cifras derivadas (kg ahorrados, ...) se conservan; con vecinos cercanos siguen siendo una buena aproximación.
+    """
+    replacements: Dict[float, Optional[float]] = {} # None: valor ambiguo
+    for old, new in zip(old_values, new_values):
+        if replacements.setdefault(old, new) != new:
+            replacements[old] = None
+    replacements = {old: new for old, new in replacements.items() if old != new}
+    if not replacements:
+        return payload
+
+    matches = [(match, float(match.group(0).replace(",", "."))) for match in _NUMBER_RE.finditer(payload)]
+    quoted: Dict[float, int] = {}
+    for _, value in matches:
+        if value in replacements:
+            quoted[value] = quoted.get(value, 0) + 1
+    if not quoted:
+        return payload
+    for value, count in quoted.items():
+        if replacements[value] is None or value < MIN_RETEMPLATE_VALUE or count > 1:
+            return None
+
+    parts: List[str] = []
+    last = 0
+    for match, value in matches:
+        if value in quoted:
+            token = match.group(0)
+            parts.append(payload[last:match.start()])
+            parts.append(_format_number(replacements[value], "," if "," in token else "."))
+            last = match.end()
+    parts.append(payload[last:])
+    return "".join(parts)
+
+
+class SimilarityIndex:
+    """
+    Índice en memoria de hasta `capacity` respuestas. Los vectores viven en una matriz NumPy contigua de float32
+    reservada en la primera inserción, una columna por entrada (17, capacity), con sus normas al cuadrado
+    precalculadas. Una búsqueda es un producto vector-matriz y un argmin sobre las columnas ocupadas: está
+    limitada por el ancho de banda de memoria (~7 MB con 100k entradas, unos 0.4 ms en una vCPU modesta).
+    Las entradas se reemplazan en anillo, la más antigua primero. Como todas viven `ttl_seconds`, caducan en ese
+    mismo orden: basta con invalidar las más antiguas (norma infinita) antes de cada búsqueda.
+    """
+
+    def __init__(self, capacity: int, max_distance: float, ttl_seconds: float):
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+        self._vectors: Optional["np.ndarray"] = None
+        self._sq_norms: Optional["np.ndarray"] = None
+        self._expires_at: List[float] = []
+        self._values: List[Optional[Tuple[float, ...]]] = []
+        self._payloads: List[Optional[str]] = []
+        self._filled = 0 # Columnas usadas alguna vez (las búsquedas recorren solo estas)
+        self._live = 0 # Entradas vigentes: las `_live` anteriores a `_next` en el anillo
+        self._next = 0 # Siguiente hueco del anillo
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _allocate(self) -> None:
+        import numpy as np
+        self._vectors = np.zeros((VECTOR_DIMENSIONS, self.capacity), dtype=np.float32)
+        self._sq_norms = np.full(self.capacity, np.inf, dtype=np.float32)
+        self._expires_at = [0.0] * self.capacity
+        self._values = [None] * self.capacity
+        self._payloads = [None] * self.capacity
+
+    def _expire(self, now: float) -> None:
+        while self._live:
+            slot = (self._next - self._live) % self.capacity
+            if self._expires_at[slot] > now:
+                return
+            self._invalidate(slot)
+            self.expirations += 1
+
+    def _invalidate(self, slot: int) -> None:
+        self._sq_norms[slot] = float("inf") # Nunca será la más cercana
+        self._values[slot] = None
+        self._payloads[slot] = None
+        self._live -= 1
+
+    def add(self, data: FootprintInputSchema, output: RecommendationOutputSchema) -> None:
+        """Guarda una respuesta válida y completa de Gemini (nunca una reutilizada, ni del motor local)."""
+        if self.capacity <= 0:
+            return
+        if self._vectors is None:
+            self._allocate()
+        values = footprint_values(data)
+        vector = habit_vector(values)
+        slot = self._next
+        if self._payloads[slot] is not None:
+            self._invalidate(slot) # Anillo lleno: se sustituye la entrada más antigua
+            self.evictions += 1
+        self._vectors[:, slot] = vector
+        self._sq_norms[slot] = vector @ vector
+        self._expires_at[slot] = time.monotonic() + self.ttl_seconds
+        self._values[slot] = values
+        self._payloads[slot] = output.to_json().decode()
+        self._next = (slot + 1) % self.capacity
+        self._filled = max(self._filled, slot + 1)
+        self._live += 1
+
+    def nearest(self, values: Sequence[float]) -> Tuple[int, float]:
+        """(hueco, distancia) de la entrada vigente más cercana; (-1, inf) si no hay ninguna."""
+        import numpy as np
+        self._expire(time.monotonic())
+        if not self._live:
+            return -1, math.inf
+        query = habit_vector(values)
+        sq_distances = query @ self._vectors[:, :self._filled] # |v|² - 2 q·v + |q|², en el sitio
+        sq_distances *= -2.0
+        sq_distances += self._sq_norms[:self._filled]
+        slot = int(np.argmin(sq_distances))
+        return slot, math.sqrt(max(float(sq_distances[slot]) + float(query @ query), 0.0))
+
+    def lookup(self, data: FootprintInputSchema) -> Optional[RecommendationOutputSchema]:
+        """Respuesta del vecino más cercano adaptada a `data`, o None si no hay ninguno a menos de max_distance."""
+        values = footprint_values(data)
+        slot, distance = self.nearest(values)
+        if distance > self.max_distance:
+            self.misses += 1
+            SIMILARITY_LOOKUPS.labels("miss").inc()
+            return None
+        payload = retemplate(self._payloads[slot], self._values[slot], values)
+        if payload is None:
+            self.conflicts += 1
+            SIMILARITY_LOOKUPS.labels("conflict").inc()
+            return None
+        self.hits += 1
+        SIMILARITY_LOOKUPS.labels("hit").inc()
+        logger.info("Recomendaciones reutilizadas de una huella similar (distancia %.3f), sin llamada a Gemini.", distance)
+        return RecommendationOutputSchema.from_json(payload)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.conflicts
+        return {
+            "enabled": settings.SIMILARITY_INDEX_ENABLED,
+            "entries": self._live,
+            "capacity": self.capacity,
+            "max_distance": self.max_distance,
+            "hits": self.hits,
+            "misses": self.misses,
+            "conflicts": self.conflicts,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+similarity_index = SimilarityIndex(
+    capacity=settings.SIMILARITY_INDEX_CAPACITY,
+    max_distance=settings.SIMILARITY_MAX_DISTANCE,
+    ttl_seconds=settings.SIMILARITY_TTL_SECONDS,
+)
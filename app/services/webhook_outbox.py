@@ -0,0 +1,204 @@
+# app/services/webhook_outbox.py
+from app.core.config import settings
+from app.core.http_client import send_webhook
+from app.core.metrics import WEBHOOK_OUTBOX_DELIVERIES, WEBHOOK_OUTBOX_LAG, WEBHOOK_OUTBOX_PENDING
+from app.core.resilience import equal_jitter_backoff_delay
+from app.db.database import (
+    claim_outbox_entries, fetch_outbox_backlog, mark_outbox_delivered, mark_outbox_failed, purge_delivered_outbox
+)
+from typing import List, Optional, Set, Tuple
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_PURGE_INTERVAL_SECONDS = 3600.0
+_BACKLOG_INTERVAL_SECONDS = 5.0 # Cada cuánto se actualizan las métricas de pendientes y lag
+_SHUTDOWN_TIMEOUT_SECONDS = 5.0
+
+
+class WebhookOutboxDispatcher:
+    """
+    Tarea en segundo plano que entrega las filas de webhook_outbox (Postgres) a TARGET_SERVICE_URL. Reclama
+    lotes de hasta `batch_size` entregas vencidas y las envía con como mucho `concurrency` POST simultáneos;
+    las fallidas se reprograman con backoff exponencial y, tras `max_attempts`, quedan en dead letter.
+    El estado vive en la BD: lo que este proceso no llegó a enviar lo retoma él mismo u otra réplica al vencer
+    la reserva (`lease_seconds`). Con el outbox vacío espera `poll_interval` segundos, o menos si se guarda
+    una entrega en este mismo proceso.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        concurrency: int,
+        poll_interval: float,
+        lease_seconds: float,
+        max_attempts: int,
+        backoff_base: float,
+        backoff_max: float,
+        retention_hours: float
+    ):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retention_hours = retention_hours
+        self._task: Optional[asyncio.Task] = None
+        self._detached: Set[asyncio.Task] = set()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._last_purge = 0.0
+        self._last_backlog = 0.0
+        self.in_flight = 0
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+        self.detached_sends = 0
+        self.pending: Optional[int] = None
+        self.lag_seconds: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(), name="webhook-outbox-dispatcher")
+        logger.info("Dispatcher del outbox del webhook iniciado (lote=%s, concurrencia=%s).", self.batch_size, self.concurrency)
+
+    async def stop(self) -> None:
+        """Deja terminar el lote en curso (unos segundos); lo que no se envía se retoma al vencer su reserva."""
+        tasks = [task for task in (self._task, *self._detached) if task is not None]
+        if not tasks:
+            return
+        self._stopping = True
+        self._wake.set()
+        _, pending = await asyncio.wait(tasks, timeout=_SHUTDOWN_TIMEOUT_SECONDS)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._task = None
+        logger.info("Dispatcher del outbox detenido. Entregadas: %s, en dead letter: %s.", self.delivered, self.dead)
+
+    def notify(self) -> None:
+        """Despierta al dispatcher ocioso (se acaba de guardar una entrega en este proceso)."""
+        self._wake.set()
+
+    def send_detached(self, content: bytes) -> None:
+        """
+        Envío sin outbox, cuando la fila no se pudo guardar (BD caída): un único intento en segundo plano,
+        igualmente fuera del camino de la respuesta.
+        """
+        self.detached_sends += 1
+        task = asyncio.create_task(send_webhook(content), name="webhook-detached-send")
+        self._detached.add(task)
+        task.add_done_callback(self._detached.discard)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            await self._refresh_backlog_if_due()
+            entries = await claim_outbox_entries(self.batch_size, self.lease_seconds)
+            if not entries:
+                await self._purge_if_due()
+                await self._idle()
+                continue
+            await self._deliver(entries)
+
+    async def _idle(self) -> None:
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        if not self._stopping:
+            self._wake.clear()
+
+    async def _deliver(self, entries: List[dict]) -> None:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(entry: dict) -> Optional[str]:
+            async with semaphore:
+                self.in_flight += 1
+                try:
+                    return await send_webhook(entry["payload"].encode())
+                finally:
+                    self.in_flight -= 1
+
+        errors = await asyncio.gather(*(send(entry) for entry in entries))
+        delivered: List[int] = []
+        failures: List[Tuple[int, Optional[float], str]] = []
+        for entry, error in zip(entries, errors):
+            if error is None:
+                delivered.append(entry["id"])
+                continue
+            attempts = entry["attempts"] + 1
+            if attempts >= self.max_attempts:
+                logger.error("Entrega %s del webhook a dead letter tras %s intentos: %s", entry["id"], attempts, error)
+                failures.append((entry["id"], None, error))
+                self.dead += 1
+                WEBHOOK_OUTBOX_DELIVERIES.labels("dead").inc()
+            else:
+                # Equal jitter: el receptor que falla recibe reintentos cada vez más espaciados, no uno casi inmediato
+                delay = equal_jitter_backoff_delay(attempts, self.backoff_base, self.backoff_max)
+                failures.append((entry["id"], delay, error))
+                self.retried += 1
+                WEBHOOK_OUTBOX_DELIVERIES.labels("retry").inc()
+
+        if delivered:
+            await mark_outbox_delivered(delivered)
+            self.delivered += len(delivered)
+            WEBHOOK_OUTBOX_DELIVERIES.labels("delivered").inc(len(delivered))
+        if failures:
+            await mark_outbox_failed(failures)
+
+    async def _refresh_backlog_if_due(self) -> None:
+        now = time.monotonic()
+        if now - self._last_backlog < _BACKLOG_INTERVAL_SECONDS:
+            return
+        self._last_backlog = now
+        backlog = await fetch_outbox_backlog()
+        if backlog is None:
+            return
+        self.pending = backlog["pending"]
+        self.lag_seconds = backlog["lag_seconds"]
+        WEBHOOK_OUTBOX_PENDING.set(self.pending)
+        WEBHOOK_OUTBOX_LAG.set(self.lag_seconds)
+
+    async def _purge_if_due(self) -> None:
+        now = time.monotonic()
+        if now - self._last_purge < _PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = now
+        purged = await purge_delivered_outbox(self.retention_hours)
+        if purged:
+            logger.info("Purgadas %s entregas del webhook hechas hace más de %s h.", purged, self.retention_hours)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.WEBHOOK_OUTBOX_ENABLED,
+            "running": self.running,
+            "in_flight": self.in_flight,
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "dead": self.dead,
+            "detached_sends": self.detached_sends,
+            "pending": self.pending,
+            "lag_seconds": self.lag_seconds,
+        }
+
+
+webhook_outbox = WebhookOutboxDispatcher(
+    batch_size=settings.WEBHOOK_OUTBOX_BATCH_SIZE,
+    concurrency=settings.WEBHOOK_OUTBOX_CONCURRENCY,
+    poll_interval=settings.WEBHOOK_OUTBOX_POLL_INTERVAL,
+    lease_seconds=settings.WEBHOOK_OUTBOX_LEASE_SECONDS,
+    max_attempts=settings.WEBHOOK_OUTBOX_MAX_ATTEMPTS,
+    backoff_base=settings.WEBHOOK_OUTBOX_BACKOFF_BASE,
+    backoff_max=settings.WEBHOOK_OUTBOX_BACKOFF_MAX,
+    retention_hours=settings.WEBHOOK_OUTBOX_RETENTION_HOURS,
+)
@@ -0,0 +1,146 @@
+# benchmarks/bench_cold_start.py
+# Informe de arranque en frío: cada ronda lanza un intérprete nuevo que importa app.main, ejecuta el
+# lifespan y mide, desde el lanzamiento del proceso:
+#   import_ms       - importar app.main
+#   startup_ms      - fin del startup del lifespan (a partir de aquí uvicorn ya aceptaría conexiones)
+#   first_live_ms   - primera respuesta de GET /health/live
+#   ready_ms        - primera respuesta 200 de GET /health/ready (calentamiento en segundo plano terminado)
+#   first_post_ms   - latencia de la primera POST /api/v1/recommendations/ (Gemini, BD y webhook simulados)
+# Además guarda los módulos con más tiempo de import acumulado (python -X importtime).
+#
+# Uso (desde la raíz del repo):
+#   python -m benchmarks.bench_cold_start [--runs 5] [--compare benchmarks/results/cold_start_<anterior>.json]
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SPAWN_TIME_ENV = "COLD_START_SPAWN_TIME"
+MILESTONES = ("import_ms", "startup_ms", "first_live_ms", "ready_ms", "first_post_ms")
+
+
+async def _child_measure(spawned_at: float) -> Dict[str, float]:
+    """Se ejecuta en el proceso hijo: tiempos (ms) desde el lanzamiento del proceso."""
+    def since_spawn() -> float:
+        return round((time.time() - spawned_at) * 1000, 1)
+
+    from app.main import app
+    timings = {"import_ms": since_spawn()}
+
+    import logging
+    logging.disable(logging.CRITICAL)
+    import httpx
+    from app.core import gemini_client, http_client
+    from app.db import database
+    from benchmarks.bench_local_engine import random_footprint
+    from benchmarks.stand_ins import FakeGeminiModel, InMemoryPool, LatencyProfile, WebhookReceiver, load_recorded_responses
+    import random
+
+    # BD y webhook simulados (sin red); Gemini real se inicializa en el calentamiento y se sustituye
+    # por el doble justo antes de la primera POST para no depender de la API key ni de la red.
+    database._pool = InMemoryPool(latency=0.0)
+    http_client._client = WebhookReceiver(latency=0.0).client()
+
+    async with app.router.lifespan_context(app):
+        timings["startup_ms"] = since_spawn()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://cold") as client:
+            await client.get("/health/live")
+            timings["first_live_ms"] = since_spawn()
+            while (await client.get("/health/ready")).status_code != 200:
+                await asyncio.sleep(0.005)
+            timings["ready_ms"] = since_spawn()
+
+            gemini_client.model = FakeGeminiModel(load_recorded_responses(), LatencyProfile(median=0.0))
+            body = random_footprint(random.Random(0)).model_dump()
+            start = time.perf_counter()
+            await client.post("/api/v1/recommendations/", json=body)
+            timings["first_post_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return timings
+
+
+def _run_child() -> Dict[str, float]:
+    env = {**os.environ, SPAWN_TIME_ENV: repr(time.time())}
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_cold_start", "--child"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _top_imports(limit: int) -> List[Dict[str, object]]:
+    """Módulos de primer nivel bajo app.main con más tiempo acumulado de import (µs)."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        rows.append({"module": name.strip(), "cumulative_us": int(cumulative)})
+    rows.sort(key=lambda row: row["cumulative_us"], reverse=True)
+    return rows[:limit]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "nogit"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Informe de arranque en frío de la API")
+    parser.add_argument("--runs", type=int, default=5, help="Procesos nuevos a medir")
+    parser.add_argument("--top", type=int, default=15, help="Módulos a incluir del informe de importtime")
+    parser.add_argument("--output-dir", type=Path, default=Path(__file__).parent / "results")
+    parser.add_argument("--compare", type=Path, default=None, help="Informe anterior con el que comparar las medianas")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(_child_measure(float(os.environ[SPAWN_TIME_ENV])))))
+        return
+
+    runs = [_run_child() for _ in range(args.runs)]
+    medians = {name: statistics.median(run[name] for run in runs) for name in MILESTONES}
+    for name in MILESTONES:
+        values = [run[name] for run in runs]
+        print(f"{name:<14} mediana {medians[name]:8.1f} ms   min {min(values):8.1f}   max {max(values):8.1f}")
+
+    commit = _git_commit()
+    started = datetime.now(timezone.utc)
+    report = {
+        "meta": {"timestamp": started.isoformat(), "git_commit": commit, "python": sys.version.split()[0], "runs": args.runs},
+        "medians_ms": medians,
+        "runs": runs,
+        "top_imports": _top_imports(args.top),
+    }
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    output = args.output_dir / f"cold_start_{started.strftime('%Y%m%dT%H%M%SZ')}_{commit}.json"
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"\nResultados guardados en {output}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        print(f"\nComparación con {args.compare.name} (commit {baseline['meta'].get('git_commit')}):")
+        for name in MILESTONES:
+            old = baseline["medians_ms"].get(name)
+            if old:
+                print(f"  {name:<14} {medians[name] - old:+8.1f} ms ({(medians[name] - old) / old * 100:+.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# benchmarks/bench_local_engine.py
+# Mide la latencia del motor local de recomendaciones (sin IA), de una en una y por lotes.
+#
+# Uso (desde la raíz del repo):
+#   python -m benchmarks.bench_local_engine [--n 5000] [--batch 500] [--seed 42]
+import argparse
+import random
+import statistics
+import time
+
+from app.api.v1.schemas.footprint import FootprintInputSchema
+from app.services.footprint_key import HABIT_FIELDS
+from app.services.local_engine import generate_local_recommendations, generate_local_recommendations_batch
+
+
+def random_footprint(rng: random.Random) -> FootprintInputSchema:
+    sections = {"energy": {}, "food": {}, "transport": {}, "waste": {}}
+    for section, field in HABIT_FIELDS:
+        sections[section][field] = round(rng.uniform(0, 50), 1) if rng.random() < 0.8 else 0
+    return FootprintInputSchema(date="2025-04-29", result=round(rng.uniform(1, 30), 2), **sections)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark del motor local de recomendaciones")
+    parser.add_argument("--n", type=int, default=5000, help="Número de huellas aleatorias")
+    parser.add_argument("--batch", type=int, default=500, help="Tamaño de lote para la variante vectorizada")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    footprints = [random_footprint(rng) for _ in range(args.n)]
+    generate_local_recommendations(footprints[0]) # Calentamiento (imports, cachés de NumPy)
+
+    latencies = []
+    start = time.perf_counter()
+    for footprint in footprints:
+        t0 = time.perf_counter()
+        generate_local_recommendations(footprint)
+        latencies.append(time.perf_counter() - t0)
+    single_total = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for offset in range(0, args.n, args.batch):
+        generate_local_recommendations_batch(footprints[offset:offset + args.batch])
+    batch_total = time.perf_counter() - start
+
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] * 1000
+    print(f"Huellas: {args.n}")
+    print(f"Una a una : p50={p50:.3f} ms  p99={p99:.3f} ms  -> {args.n / single_total:,.0f} recomendaciones/s por núcleo")
+    print(f"Lotes de {args.batch}: {batch_total / args.n * 1000:.3f} ms/huella -> {args.n / batch_total:,.0f} recomendaciones/s por núcleo")
+
+
+if __name__ == "__main__":
+    main()
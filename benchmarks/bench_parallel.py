@@ -0,0 +1,132 @@
+# benchmarks/bench_parallel.py
+# Latencia de extremo a extremo y tokens de la generación con Gemini: un único prompt (texto libre o salida
+# estructurada) frente al modo GEMINI_PARALLEL_CATEGORIES (cinco prompts pequeños a la vez: global + una por
+# categoría). El Gemini simulado tarda una latencia base (log-normal) más un tiempo proporcional a los tokens
+# de salida, que es lo que el modo paralelo reparte entre cinco llamadas. Mide generación + parseo por huella,
+# de una en una, y los tokens de prompt y de salida contados por gemini_client.
+#
+# Uso (desde la raíz del repo):
+#   python -m benchmarks.bench_parallel [--n 20] [--tokens-per-second 150] [--base-median 0.35] [--error-rate 0.1]
+import argparse
+import asyncio
+import json
+import logging
+import random
+import statistics
+import time
+from typing import Dict, List
+
+from app.api.v1.schemas.footprint import FootprintInputSchema
+from app.api.v1.schemas.recommendation import RecommendationGenerationSchema
+from app.core import gemini_client
+from app.core.config import settings
+from app.services import recommendation_service as service
+from benchmarks.bench_local_engine import random_footprint
+from benchmarks.stand_ins import FakeGeminiModel, LatencyProfile, load_recorded_responses
+
+MODES = ("single_text", "single_json", "parallel")
+
+
+class SectionedGeminiModel(FakeGeminiModel):
+    """Responde a cada prompt del modo paralelo solo con su sección de una respuesta grabada."""
+
+    def respond(self, prompt: str) -> str:
+        text = self._pick()
+        recorded = json.loads(text.strip().removeprefix("```json").removesuffix("```"))
+        for category, label in service._CATEGORY_LABELS.items():
+            if f"para reducir la huella de {label}," in prompt:
+                return json.dumps({"suggestions": recorded["category_recommendations"][category]}, ensure_ascii=False)
+        if 'Da 1 recomendación general de alto impacto (category "General"),' in prompt:
+            return json.dumps(recorded["global_recommendation"], ensure_ascii=False)
+        return text # Prompt único: la respuesta grabada tal cual
+
+
+async def generate(mode: str, data: FootprintInputSchema) -> service.RecommendationOutputSchema:
+    if mode == "parallel":
+        output, _ = await service._generate_parallel(data)
+        return output
+    if mode == "single_json":
+        text = await gemini_client.generate_text_from_gemini(service._create_compact_prompt(data), RecommendationGenerationSchema)
+    else:
+        text = await gemini_client.generate_text_from_gemini(service._create_prompt(data))
+    return service._parse_gemini_response_structured(text)
+
+
+def _token_totals() -> Dict[str, int]:
+    return {
+        key: sum(counters[key] for counters in gemini_client._token_usage.values())
+        for key in ("calls", "prompt_tokens", "output_tokens")
+    }
+
+
+async def run_mode(mode: str, footprints: List[FootprintInputSchema], model: FakeGeminiModel) -> dict:
+    gemini_client._breaker.record_success()
+    before = _token_totals()
+    latencies: List[float] = []
+    degraded = failed = 0
+    for data in footprints:
+        start = time.perf_counter()
+        output = await generate(mode, data)
+        latencies.append(time.perf_counter() - start)
+        if service.is_error_output(output):
+            failed += 1
+        elif output.notes:
+            degraded += 1
+    after = _token_totals()
+    latencies.sort()
+    n = len(footprints)
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[min(n - 1, int(n * 0.95))] * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "calls": (after["calls"] - before["calls"]) / n,
+        "prompt_tokens": (after["prompt_tokens"] - before["prompt_tokens"]) / n,
+        "output_tokens": (after["output_tokens"] - before["output_tokens"]) / n,
+        "degraded": degraded,
+        "failed": failed,
+    }
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    settings.GEMINI_MAX_RETRIES = 0 # Un fallo simulado se ve como fallo, sin que los reintentos lo oculten
+    settings.GEMINI_HEDGE_ENABLED = False
+    settings.LOCAL_ENGINE_FALLBACK = args.local_fallback
+    rng = random.Random(args.seed)
+    footprints = [random_footprint(rng) for _ in range(args.n)]
+    model = SectionedGeminiModel(
+        load_recorded_responses(),
+        LatencyProfile(median=args.base_median, p99=args.base_p99),
+        error_rate=args.error_rate,
+        seed=args.seed,
+        tokens_per_second=args.tokens_per_second,
+    )
+    gemini_client.model = model
+
+    print(f"{args.n} huellas, latencia base mediana {args.base_median}s, {args.tokens_per_second} tokens/s, "
+          f"errores {args.error_rate:.0%} por llamada")
+    print(f"{'modo':<12} {'p50 ms':>9} {'p95 ms':>9} {'media ms':>9} {'llamadas':>9} {'tok prompt':>11} "
+          f"{'tok salida':>11} {'degradadas':>11} {'fallidas':>9}")
+    for mode in args.modes:
+        r = await run_mode(mode, footprints, model)
+        print(f"{mode:<12} {r['p50_ms']:9.0f} {r['p95_ms']:9.0f} {r['mean_ms']:9.0f} {r['calls']:9.1f} "
+              f"{r['prompt_tokens']:11.0f} {r['output_tokens']:11.0f} {r['degraded']:11d} {r['failed']:9d}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de generación en un prompt frente a cinco en paralelo")
+    parser.add_argument("--n", type=int, default=20, help="Huellas por modo")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--tokens-per-second", type=float, default=150.0, help="Velocidad de salida del Gemini simulado")
+    parser.add_argument("--base-median", type=float, default=0.35, help="Latencia base mediana por llamada (s)")
+    parser.add_argument("--base-p99", type=float, default=1.0, help="Latencia base p99 por llamada (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probabilidad de fallo de cada llamada")
+    parser.add_argument("--local-fallback", action="store_true", help="Activa LOCAL_ENGINE_FALLBACK (secciones fallidas con el motor local)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL) # Los avisos de cada fallo simulado no aportan nada a la medición
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# benchmarks/bench_parse.py
+# Microbenchmark del camino "texto de Gemini -> respuesta HTTP + fila de BD + webhook".
+#
+# Compara el camino actual (una validación directa desde el JSON y una única serialización reutilizada)
+# con una réplica del anterior: json.loads + recorrido manual del dict + reconstrucción de los modelos,
+# revalidación de FastAPI vía response_model, model_dump_json(indent=2) para la BD y model_dump() + json
+# para el webhook. Mide tiempo por petición y memoria por petición (tracemalloc): pico de memoria asignada,
+# incluidos los objetos temporales, y bloques/bytes que siguen vivos al terminar.
+#
+# Uso (desde la raíz del repo):
+#   python -m benchmarks.bench_parse [--n 5000]
+from typing import Callable
+import argparse
+import json
+import logging
+import sys
+import time
+import tracemalloc
+
+from app.api.v1.schemas.recommendation import (
+    CategorySpecificSuggestion,
+    FullRecommendation,
+    RecommendationOutputSchema,
+    RecommendationsByCategory,
+)
+from app.services.recommendation_service import _parse_gemini_response_structured
+from benchmarks.stand_ins import load_recorded_responses
+
+
+def legacy_parse(response_text: str) -> RecommendationOutputSchema:
+    """Réplica del parser anterior (camino feliz): dict intermedio y modelos construidos uno a uno."""
+    cleaned_text = response_text.strip().removeprefix("```json").removesuffix("```").strip()
+    data = json.loads(cleaned_text)
+    global_rec_data = data.get("global_recommendation", {})
+    global_recommendation = FullRecommendation(
+        category=str(global_rec_data.get("category", "General")),
+        suggestion=str(global_rec_data.get("suggestion", "No global suggestion provided.")),
+    )
+    cat_recs_data = data.get("category_recommendations", {})
+    parsed = {}
+    for cat_key in ["transport", "food", "energy", "waste"]:
+        suggestions = []
+        for item_data in cat_recs_data.get(cat_key, []):
+            if isinstance(item_data, dict) and "suggestion" in item_data:
+                suggestions.append(CategorySpecificSuggestion(suggestion=str(item_data.get("suggestion", "No suggestion provided."))))
+        parsed[cat_key] = suggestions[:2]
+    return RecommendationOutputSchema(
+        global_recommendation=global_recommendation,
+        category_recommendations=RecommendationsByCategory(**parsed),
+    )
+
+
+def legacy_request(response_text: str) -> tuple:
+    output = legacy_parse(response_text)
+    db_payload = output.model_dump_json(indent=2) # insert_recommendations
+    webhook_body = json.dumps(output.model_dump()).encode() # httpx json=model_dump()
+    # FastAPI con response_model: vuelca, revalida y serializa de nuevo
+    http_body = json.dumps(
+        RecommendationOutputSchema.model_validate(output.model_dump()).model_dump(mode="json")
+    ).encode()
+    return db_payload, webhook_body, http_body
+
+
+def current_request(response_text: str) -> tuple:
+    output = _parse_gemini_response_structured(response_text)
+    db_payload = output.to_json().decode() # build_insert_params
+    webhook_body = output.to_json() # post_recommendations_to_external_service
+    http_body = output.to_json() # Response(content=...)
+    return db_payload, webhook_body, http_body
+
+
+def measure(name: str, fn: Callable[[str], tuple], responses: list, n: int) -> None:
+    for text in responses: # Calentamiento
+        fn(text)
+
+    start = time.perf_counter()
+    for i in range(n):
+        fn(responses[i % len(responses)])
+    elapsed = time.perf_counter() - start
+
+    # Memoria por petición: pico de memoria asignada durante la petición (incluye temporales) y lo que
+    # sigue vivo al terminar (el resultado), medido con tracemalloc petición a petición
+    samples = min(n, 1000)
+    peak_total = retained_total = blocks_total = 0
+    tracemalloc.start()
+    for i in range(samples):
+        text = responses[i % len(responses)]
+        blocks_before = sys.getallocatedblocks()
+        current_before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = fn(text)
+        current_after, peak = tracemalloc.get_traced_memory()
+        blocks_total += sys.getallocatedblocks() - blocks_before
+        peak_total += peak - current_before
+        retained_total += current_after - current_before
+        del result
+    tracemalloc.stop()
+
+    print(
+        f"{name:<8} {elapsed / n * 1e6:8.1f} µs/petición  pico {peak_total / samples / 1024:6.1f} KiB  "
+        f"retenido {retained_total / samples / 1024:5.1f} KiB en {blocks_total / samples:5.1f} bloques por petición"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de parseo y serialización de la respuesta de Gemini")
+    parser.add_argument("--n", type=int, default=5000, help="Peticiones simuladas por variante")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    responses = load_recorded_responses()
+    measure("anterior", legacy_request, responses, args.n)
+    measure("actual", current_request, responses, args.n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# benchmarks/bench_similarity.py
+# Índice de vecinos (SIMILARITY_INDEX_ENABLED): latencia de búsqueda con el índice lleno y tasa de acierto
+# frente a la caché exacta cuantizada sobre un tráfico sintético en el que la mayoría de peticiones repiten
+# una huella anterior con pequeños cambios (unos km más, una comida menos). En cada fallo se "genera" la
+# respuesta con el motor local (cita los valores del usuario, así también se mide la sustitución) y se guarda.
+#
+# Uso (desde la raíz del repo):
+#   python -m benchmarks.bench_similarity [--entries 100000] [--requests 20000] [--distances 0.1 0.2 0.3 0.5]
+import argparse
+import logging
+import random
+import statistics
+import time
+from typing import List
+
+from app.api.v1.schemas.footprint import FootprintInputSchema
+from app.core.config import settings
+from app.services.footprint_key import HABIT_FIELDS, footprint_values, quantized_footprint_key
+from app.services.local_engine import generate_local_recommendations
+from app.services.similarity_index import SimilarityIndex
+from benchmarks.bench_local_engine import random_footprint
+
+
+def perturb(data: FootprintInputSchema, rng: random.Random) -> FootprintInputSchema:
+    """La misma huella con 1-3 hábitos retocados un poco y `result` movido hasta un 3%."""
+    raw = data.model_dump()
+    for section, field in rng.sample(HABIT_FIELDS, rng.randint(1, 3)):
+        value = raw[section][field]
+        step = rng.choice((-1, 1)) * (max(1.0, round(value * rng.uniform(0.02, 0.1), 1)))
+        raw[section][field] = max(0.0, round(value + step, 1))
+    raw["result"] = round(raw["result"] * rng.uniform(0.97, 1.03), 2)
+    return FootprintInputSchema(**raw)
+
+
+def traffic(n: int, new_ratio: float, rng: random.Random) -> List[FootprintInputSchema]:
+    requests: List[FootprintInputSchema] = []
+    for _ in range(n):
+        if not requests or rng.random() < new_ratio:
+            requests.append(random_footprint(rng))
+        else:
+            requests.append(perturb(rng.choice(requests), rng))
+    return requests
+
+
+def measure_lookups(entries: int, queries: int, rng: random.Random) -> None:
+    index = SimilarityIndex(capacity=entries, max_distance=0.3, ttl_seconds=3600.0)
+    output = generate_local_recommendations(random_footprint(rng))
+    start = time.perf_counter()
+    for _ in range(entries):
+        index.add(random_footprint(rng), output)
+    fill = time.perf_counter() - start
+
+    probes = [perturb(random_footprint(rng), rng) for _ in range(queries)]
+    for name, run in (("nearest", lambda d: index.nearest(footprint_values(d))), ("lookup", index.lookup)):
+        latencies = []
+        for data in probes:
+            t0 = time.perf_counter()
+            run(data)
+            latencies.append(time.perf_counter() - t0)
+        latencies.sort()
+        print(f"{name:<8} {entries} entradas: p50 {statistics.median(latencies) * 1e6:7.1f} µs, "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:7.1f} µs")
+    print(f"llenado: {fill / entries * 1e6:.1f} µs por inserción")
+
+
+def measure_hit_rate(requests: List[FootprintInputSchema], distances: List[float]) -> None:
+    exact_keys = set()
+    exact_hits = 0
+    for data in requests:
+        key = quantized_footprint_key(data, "bench", settings.CACHE_QUANTUM, settings.CACHE_RESULT_QUANTUM)
+        if key in exact_keys:
+            exact_hits += 1
+        exact_keys.add(key)
+    print(f"{'caché exacta':<16} aciertos {exact_hits / len(requests):6.1%}")
+
+    for distance in distances:
+        index = SimilarityIndex(capacity=len(requests), max_distance=distance, ttl_seconds=3600.0)
+        for data in requests:
+            if index.lookup(data) is None:
+                index.add(data, generate_local_recommendations(data))
+        stats = index.stats()
+        print(f"{f'vecino <= {distance}':<16} aciertos {stats['hit_ratio']:6.1%} (conflictos {stats['conflicts']})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark del índice de vecinos de recomendaciones")
+    parser.add_argument("--entries", type=int, default=100000, help="Entradas del índice para medir la búsqueda")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=20000, help="Peticiones del tráfico sintético")
+    parser.add_argument("--new-ratio", type=float, default=0.3, help="Fracción de huellas nuevas (el resto retoca una anterior)")
+    parser.add_argument("--distances", nargs="+", type=float, default=[0.1, 0.2, 0.3, 0.5])
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL) # Un log por acierto no aporta nada a la medición
+    rng = random.Random(args.seed)
+    measure_lookups(args.entries, args.queries, rng)
+    print(f"\n{args.requests} peticiones, {args.new_ratio:.0%} huellas nuevas")
+    measure_hit_rate(traffic(args.requests, args.new_ratio, rng), args.distances)
+
+
+if __name__ == "__main__":
+    main()
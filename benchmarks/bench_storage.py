@@ -0,0 +1,151 @@
+# benchmarks/bench_storage.py
+# Tamaño por fila y throughput de inserción de user_recommendations: esquema antiguo (payload en texto más nueve
+# columnas *_suggestion copiadas) frente al esquema compacto de la migración 0004 (un JSONB, particionado por mes).
+#
+# Sin --dsn solo calcula, sin BD, los bytes de texto que se guardan por fila en cada variante:
+#   indentado - model_dump_json(indent=2) + columnas copiadas (lo que se guardaba originalmente)
+#   texto     - JSON compacto + columnas copiadas (esquema antiguo con la serialización actual)
+#   jsonb     - solo el JSON compacto (el tamaño real en JSONB depende de Postgres: usa --dsn)
+# Con --dsn crea dos esquemas temporales con una tabla user_recommendations cada uno, inserta las mismas filas en
+# lotes con la misma sentencia que usa la API (INSERT multi-fila) y mide filas/s, tamaño medio de fila
+# (pg_column_size) y tamaño total en disco (tabla, TOAST e índices); al terminar borra los esquemas.
+#
+# Uso (desde la raíz del repo):
+#   python -m benchmarks.bench_storage [--rows 20000] [--batch 200] [--dsn postgresql://localhost/bench]
+import argparse
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from typing import List
+
+from app.api.v1.schemas.recommendation import RecommendationOutputSchema
+from app.core.config import settings
+from app.db import database
+from app.services.local_engine import generate_local_recommendations
+from app.services.recommendation_service import _parse_gemini_response_structured
+from benchmarks.bench_local_engine import random_footprint
+from benchmarks.stand_ins import load_recorded_responses
+
+LEGACY_TABLE_SQL = """
+CREATE TABLE user_recommendations (
+    id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    calculation_date DATE NOT NULL,
+    recommendations_payload TEXT,
+    global_rec_suggestion TEXT,
+    transport_rec1_suggestion TEXT, transport_rec2_suggestion TEXT,
+    food_rec1_suggestion TEXT, food_rec2_suggestion TEXT,
+    energy_rec1_suggestion TEXT, energy_rec2_suggestion TEXT,
+    waste_rec1_suggestion TEXT, waste_rec2_suggestion TEXT
+);
+CREATE INDEX ON user_recommendations (user_id, calculation_date DESC, id DESC);
+"""
+
+JSONB_TABLE_SQL = """
+CREATE SEQUENCE user_recommendations_row_id_seq AS BIGINT;
+CREATE TABLE user_recommendations (
+    id BIGINT NOT NULL DEFAULT nextval('user_recommendations_row_id_seq'),
+    user_id TEXT NOT NULL,
+    calculation_date DATE NOT NULL,
+    input_fingerprint TEXT,
+    recommendations_payload JSONB,
+    PRIMARY KEY (calculation_date, id)
+) PARTITION BY RANGE (calculation_date);
+CREATE TABLE user_recommendations_default PARTITION OF user_recommendations DEFAULT;
+CREATE INDEX ON user_recommendations (user_id, calculation_date DESC, id DESC);
+"""
+
+
+def sample_outputs(count: int, seed: int) -> List[RecommendationOutputSchema]:
+    """Mezcla de respuestas grabadas de Gemini y del motor local (textos con cifras distintas en cada fila)."""
+    rng = random.Random(seed)
+    recorded = [_parse_gemini_response_structured(text) for text in load_recorded_responses()]
+    return [
+        recorded[i % len(recorded)] if i % 2 else generate_local_recommendations(random_footprint(rng))
+        for i in range(count)
+    ]
+
+
+def text_sizes(outputs: List[RecommendationOutputSchema]) -> None:
+    def copied_columns(output: RecommendationOutputSchema) -> int:
+        categories = output.category_recommendations
+        suggestions = [output.global_recommendation.suggestion]
+        for items in (categories.transport, categories.food, categories.energy, categories.waste):
+            suggestions += [item.suggestion for item in items]
+        return sum(len(suggestion.encode()) for suggestion in suggestions)
+
+    variants = {
+        "indentado": [len(o.model_dump_json(indent=2).encode()) + copied_columns(o) for o in outputs],
+        "texto": [len(o.to_json()) + copied_columns(o) for o in outputs],
+        "jsonb": [len(o.to_json()) for o in outputs],
+    }
+    baseline = statistics.mean(variants["indentado"])
+    print("Bytes de texto guardados por fila (sin cabeceras de fila ni compresión TOAST):")
+    for name, sizes in variants.items():
+        mean = statistics.mean(sizes)
+        print(f"  {name:<10} {mean:8.0f} B/fila  ({(mean - baseline) / baseline * 100:+.1f}% frente a indentado)")
+
+
+def measure_postgres(dsn: str, outputs: List[RecommendationOutputSchema], batch: int) -> None:
+    import psycopg
+
+    rows = [(f"user-{i % 500}", date(2025, 1, 1) + timedelta(days=i % 365), output) for i, output in enumerate(outputs)]
+    suffix = f"{int(time.time())}"
+    layouts = (("texto", LEGACY_TABLE_SQL, False), ("jsonb", JSONB_TABLE_SQL, True))
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        for name, ddl, jsonb in layouts:
+            schema = f"bench_storage_{name}_{suffix}"
+            conn.execute(f"CREATE SCHEMA {schema}")
+            try:
+                conn.execute(f"SET search_path TO {schema}")
+                conn.execute(ddl)
+                if jsonb:
+                    for month in range(1, 13): # Particiones mensuales de 2025, como las crea la migración 0004
+                        start, end = date(2025, month, 1), date(2025 + month // 12, month % 12 + 1, 1)
+                        conn.execute(
+                            f"CREATE TABLE user_recommendations_2025_{month:02d} PARTITION OF user_recommendations "
+                            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+                        )
+
+                settings.DB_JSONB_STORAGE_ENABLED = jsonb
+                settings.IDEMPOTENT_RECOMMENDATIONS_ENABLED = False
+                params = [database.build_insert_params(user_id, day, output) for user_id, day, output in rows]
+                start_time = time.perf_counter()
+                for offset in range(0, len(params), batch):
+                    chunk = params[offset:offset + batch]
+                    with conn.transaction():
+                        conn.execute(database._insert_recommendations_sql(len(chunk)), database._insert_params(chunk))
+                elapsed = time.perf_counter() - start_time
+
+                conn.execute("VACUUM ANALYZE user_recommendations")
+                avg_row = conn.execute("SELECT avg(pg_column_size(t.*)) FROM user_recommendations AS t").fetchone()[0]
+                total = conn.execute(
+                    "SELECT sum(pg_total_relation_size(relid)) FROM pg_partition_tree('user_recommendations')"
+                ).fetchone()[0]
+                print(
+                    f"  {name:<6} {len(rows) / elapsed:9.0f} filas/s  fila media {float(avg_row):7.0f} B  "
+                    f"total {total / 1024 / 1024:7.2f} MiB ({total / len(rows):6.0f} B/fila con índices y TOAST)"
+                )
+            finally:
+                conn.execute("RESET search_path")
+                conn.execute(f"DROP SCHEMA {schema} CASCADE")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de almacenamiento de user_recommendations")
+    parser.add_argument("--rows", type=int, default=20000, help="Filas a generar")
+    parser.add_argument("--batch", type=int, default=200, help="Filas por INSERT multi-fila")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--dsn", default=None, help="Postgres de pruebas (crea y borra esquemas temporales)")
+    args = parser.parse_args()
+
+    outputs = sample_outputs(args.rows, args.seed)
+    text_sizes(outputs)
+    if args.dsn:
+        print(f"\nPostgres ({args.rows} filas, lotes de {args.batch}):")
+        measure_postgres(args.dsn, outputs, args.batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# benchmarks/load_test.py
+# Benchmark de carga extremo a extremo de POST /api/v1/recommendations/ sin servicios externos.
+#
+# La app FastAPI se ejecuta en el mismo proceso (httpx.ASGITransport, con su lifespan) y Gemini,
+# Postgres y TARGET_SERVICE_URL se sustituyen por los stand-ins de benchmarks/stand_ins.py.
+# Escenarios:
+#   cache_hit  - la misma huella una y otra vez (tras calentar la caché)
+#   cache_miss - huellas distintas en cada petición: siempre llama a Gemini, guarda y publica
+#   error      - Gemini falla (503 transitorio) con --error-rate; incluye reintentos y circuit breaker
+#   burst      - todas las peticiones a la vez sobre pocas huellas distintas y caché fría (single-flight)
+# Cada ejecución escribe un JSON en --output-dir (throughput y p50/p95/p99 por escenario) que se
+# puede comparar con otro con --compare.
+#
+# Uso (desde la raíz del repo):
+#   python -m benchmarks.load_test --requests 300 --concurrency 32
+#   python -m benchmarks.load_test --scenarios cache_miss burst --db postgres   # Postgres local del .env
+#   python -m benchmarks.load_test --compare benchmarks/results/<anterior>.json
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import subprocess
+import time
+
+import httpx
+
+from benchmarks.bench_local_engine import random_footprint
+from benchmarks.stand_ins import FakeGeminiModel, InMemoryPool, LatencyProfile, WebhookReceiver, load_recorded_responses
+
+SCENARIOS = ("cache_hit", "cache_miss", "error", "burst")
+ENDPOINT = "/api/v1/recommendations/"
+
+
+def _percentile(ordered: List[float], p: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+async def _drive(client: httpx.AsyncClient, bodies: List[dict], concurrency: int) -> dict:
+    """Envía `bodies` con como mucho `concurrency` peticiones en vuelo y mide cada una."""
+    latencies: List[float] = []
+    status_counts: Dict[str, int] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(body: dict) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post(ENDPOINT, json=body)
+                code = str(response.status_code)
+            except Exception as e:
+                code = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            status_counts[code] = status_counts.get(code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(body) for body in bodies))
+    duration = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(bodies),
+        "concurrency": concurrency,
+        "duration_s": round(duration, 4),
+        "throughput_rps": round(len(bodies) / duration, 2) if duration else None,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 0.50) * 1000, 3),
+            "p95": round(_percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(_percentile(latencies, 0.99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        },
+        "status_counts": status_counts,
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    # Los módulos de la app se importan aquí: configuran logging y leen la configuración al importarse
+    from app.main import app
+    from app.core import gemini_client, http_client
+    from app.core.config import settings
+    from app.db import database
+    from app.services.recommendation_cache import recommendation_cache
+
+    logging.getLogger().setLevel(args.log_level)
+    for name in list(logging.root.manager.loggerDict):
+        logging.getLogger(name).setLevel(args.log_level)
+
+    rng = random.Random(args.seed)
+    settings.CACHE_ENABLED = True
+    settings.DB_WRITE_BEHIND_ENABLED = args.write_behind
+    settings.RATE_LIMIT_ENABLED = args.rate_limit # Todo el tráfico sale de una única IP simulada
+    settings.TARGET_SERVICE_URL = "http://webhook.bench/enviar_calculos"
+
+    fake_model = FakeGeminiModel(
+        load_recorded_responses(args.responses),
+        LatencyProfile(median=args.gemini_median, p99=args.gemini_p99),
+        error_rate=0.0,
+        seed=args.seed,
+    )
+    gemini_client.model = fake_model
+    receiver = WebhookReceiver(latency=args.webhook_latency)
+    http_client._client = receiver.client() # open_http_client() respeta un cliente ya creado
+    memory_pool: Optional[InMemoryPool] = None
+    if args.db == "memory":
+        memory_pool = InMemoryPool(max_size=settings.DB_POOL_MAX_SIZE, latency=args.db_latency)
+        database._pool = memory_pool # open_db_pool() no abre otro si ya hay uno
+
+    def reset_between_scenarios() -> None:
+        recommendation_cache.local._data.clear()
+        recommendation_cache.local._bytes = 0
+        gemini_client._breaker.record_success()
+        fake_model.error_rate = 0.0
+
+    def unique_bodies(count: int) -> List[dict]:
+        return [random_footprint(rng).model_dump() for _ in range(count)]
+
+    def scenario_bodies(name: str) -> tuple:
+        """(cuerpos de calentamiento, cuerpos medidos, concurrencia) de un escenario."""
+        if name == "cache_hit":
+            body = unique_bodies(1)[0]
+            return [body], [body] * args.requests, args.concurrency
+        if name == "burst":
+            distinct = unique_bodies(args.burst_distinct)
+            return [], [distinct[i % len(distinct)] for i in range(args.requests)], args.requests
+        return [], unique_bodies(args.requests), args.concurrency # cache_miss y error
+
+    results: Dict[str, dict] = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for name in args.scenarios:
+                reset_between_scenarios()
+                warmup, bodies, concurrency = scenario_bodies(name)
+                for body in warmup:
+                    await client.post(ENDPOINT, json=body)
+                if name == "error":
+                    fake_model.error_rate = args.error_rate
+
+                calls_before = fake_model.calls
+                statements_before = memory_pool.statements if memory_pool else 0
+                received_before = receiver.received
+                result = await _drive(client, bodies, concurrency)
+                if settings.DB_WRITE_BEHIND_ENABLED:
+                    # Las filas encoladas cuentan como parte del escenario: esperar a que se vacíe la cola
+                    while write_behind_pending():
+                        await asyncio.sleep(0.01)
+                result["gemini_calls"] = fake_model.calls - calls_before
+                result["db_statements"] = memory_pool.statements - statements_before if memory_pool else None
+                result["webhook_deliveries"] = receiver.received - received_before
+                results[name] = result
+                print(
+                    f"{name:<11} {result['throughput_rps']:>9} req/s  "
+                    f"p50={result['latency_ms']['p50']:>9} ms  p95={result['latency_ms']['p95']:>9} ms  "
+                    f"p99={result['latency_ms']['p99']:>9} ms  status={result['status_counts']}  "
+                    f"gemini={result['gemini_calls']}"
+                )
+    return results
+
+
+def write_behind_pending() -> bool:
+    from app.db.write_behind import write_behind_queue
+    return write_behind_queue.running and write_behind_queue._queue.qsize() > 0
+
+
+def compare(current: dict, baseline_path: Path) -> None:
+    """Imprime la variación de throughput y p95/p99 respecto a una ejecución anterior."""
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    print(f"\nComparación con {baseline_path.name} (commit {baseline['meta'].get('git_commit')}):")
+    for name, result in current["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if not old:
+            continue
+
+        def delta(new_value: Optional[float], old_value: Optional[float]) -> str:
+            if not new_value or not old_value:
+                return "n/a"
+            return f"{(new_value - old_value) / old_value * 100:+.1f}%"
+
+        print(
+            f"  {name:<11} throughput {delta(result['throughput_rps'], old['throughput_rps'])}  "
+            f"p95 {delta(result['latency_ms']['p95'], old['latency_ms']['p95'])}  "
+            f"p99 {delta(result['latency_ms']['p99'], old['latency_ms']['p99'])}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de carga de la API de recomendaciones con stand-ins locales")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="Peticiones por escenario")
+    parser.add_argument("--concurrency", type=int, default=32, help="Peticiones en vuelo (salvo burst: todas a la vez)")
+    parser.add_argument("--burst-distinct", type=int, default=5, help="Huellas distintas en el escenario burst")
+    parser.add_argument("--gemini-median", type=float, default=0.8, help="Latencia mediana del Gemini simulado (s)")
+    parser.add_argument("--gemini-p99", type=float, default=2.5, help="Latencia p99 del Gemini simulado (s)")
+    parser.add_argument("--error-rate", type=float, default=1.0, help="Probabilidad de error de Gemini en el escenario error")
+    parser.add_argument("--responses", type=Path, default=None, help="JSON con respuestas grabadas de Gemini")
+    parser.add_argument("--db", choices=("memory", "postgres"), default="memory",
+                        help="memory: shim en memoria; postgres: la BD configurada en .env (p. ej. un Postgres local)")
+    parser.add_argument("--db-latency", type=float, default=0.002, help="Latencia por sentencia del shim en memoria (s)")
+    parser.add_argument("--write-behind", action="store_true", help="Activa DB_WRITE_BEHIND_ENABLED")
+    parser.add_argument("--rate-limit", action="store_true", help="Activa RATE_LIMIT_ENABLED (una sola IP: casi todo será 429)")
+    parser.add_argument("--webhook-latency", type=float, default=0.05, help="Latencia del receptor de TARGET_SERVICE_URL (s)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--log-level", default="CRITICAL", help="Nivel de log de la app durante la medición")
+    parser.add_argument("--output-dir", type=Path, default=Path(__file__).parent / "results")
+    parser.add_argument("--compare", type=Path, default=None, help="JSON de una ejecución anterior con el que comparar")
+    args = parser.parse_args()
+
+    scenarios = asyncio.run(run(args))
+    commit = _git_commit()
+    started = datetime.now(timezone.utc)
+    report = {
+        "meta": {
+            "timestamp": started.isoformat(),
+            "git_commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        },
+        "scenarios": scenarios,
+    }
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    output = args.output_dir / f"{started.strftime('%Y%m%dT%H%M%SZ')}_{commit or 'nogit'}.json"
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"\nResultados guardados en {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
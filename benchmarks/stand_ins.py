@@ -0,0 +1,219 @@
+# benchmarks/stand_ins.py
+# Sustitutos locales de las dependencias externas para los benchmarks de carga:
+# - FakeGeminiModel: reemplaza gemini_client.model (latencia log-normal, tasa de errores, respuestas grabadas).
+# - InMemoryPool: reemplaza el pool de Postgres en app.db.database (registra las sentencias, latencia fija).
+# - WebhookReceiver: receptor de TARGET_SERVICE_URL servido por httpx.MockTransport.
+# Se sustituye el punto más bajo posible para que el resto del camino (single-flight, reintentos,
+# breaker, caché, construcción de SQL, cliente HTTP compartido) se ejecute igual que en producción.
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+from contextlib import asynccontextmanager
+from google.api_core import exceptions as google_exceptions
+import asyncio
+import json
+import math
+import random
+import httpx
+
+DEFAULT_RESPONSES_FILE = Path(__file__).parent / "fixtures" / "gemini_responses.json"
+
+
+def load_recorded_responses(path: Optional[Path] = None) -> List[str]:
+    """Lista de respuestas grabadas de Gemini (texto tal cual lo devolvió el modelo)."""
+    with open(path or DEFAULT_RESPONSES_FILE, encoding="utf-8") as f:
+        return [item if isinstance(item, str) else json.dumps(item, ensure_ascii=False) for item in json.load(f)]
+
+
+@dataclass
+class LatencyProfile:
+    """Latencia log-normal definida por su mediana y su p99 (segundos)."""
+    median: float = 0.8
+    p99: float = 2.5
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        sigma = max(math.log(self.p99 / self.median) / 2.326, 0.0) if self.p99 > self.median else 0.0
+        return rng.lognormvariate(math.log(self.median), sigma)
+
+
+class _Part:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _Content:
+    def __init__(self, text: str):
+        self.parts = [_Part(text)]
+
+
+class _Candidate:
+    def __init__(self, text: str):
+        self.content = _Content(text)
+
+
+class _Usage:
+    def __init__(self, prompt: str, text: str):
+        # Aproximación habitual: ~4 caracteres por token
+        self.prompt_token_count = max(1, len(prompt) // 4)
+        self.candidates_token_count = max(1, len(text) // 4)
+
+
+class FakeGeminiResponse:
+    """Imita los atributos de GenerateContentResponse que usa gemini_client."""
+
+    def __init__(self, prompt: str, text: str):
+        self.text = text
+        self.candidates = [_Candidate(text)]
+        self.prompt_feedback = None
+        self.usage_metadata = _Usage(prompt, text)
+
+
+class FakeGeminiModel:
+    """
+    Sustituto de genai.GenerativeModel. Cada llamada espera una latencia muestreada de `latency`,
+    falla con probabilidad `error_rate` (503 de Google, error transitorio) y, si no, devuelve una
+    de las respuestas grabadas (en rotación). Con `tokens_per_second` la latencia crece además con
+    la longitud de la respuesta, como en la generación real (un token de salida tras otro).
+    """
+
+    def __init__(self, responses: List[str], latency: LatencyProfile, error_rate: float = 0.0, seed: int = 0,
+                 tokens_per_second: float = 0.0):
+        self.responses = responses
+        self.latency = latency
+        self.error_rate = error_rate
+        self.tokens_per_second = tokens_per_second
+        self._rng = random.Random(seed)
+        self._next = 0
+        self.calls = 0
+        self.errors = 0
+
+    def _pick(self) -> str:
+        text = self.responses[self._next % len(self.responses)]
+        self._next += 1
+        return text
+
+    def respond(self, prompt: str) -> str:
+        """Texto de la respuesta a `prompt`. Las subclases pueden adaptarlo al prompt recibido."""
+        return self._pick()
+
+    def _delay(self, text: str) -> float:
+        delay = self.latency.sample(self._rng)
+        if self.tokens_per_second:
+            delay += _Usage("", text).candidates_token_count / self.tokens_per_second
+        return delay
+
+    async def generate_content_async(self, prompt: str, generation_config: Any = None, stream: bool = False):
+        self.calls += 1
+        if stream:
+            return self._stream(prompt)
+        text = self.respond(prompt)
+        await asyncio.sleep(self._delay(text))
+        if self._rng.random() < self.error_rate:
+            self.errors += 1
+            raise google_exceptions.ServiceUnavailable("fake Gemini: simulated 503")
+        return FakeGeminiResponse(prompt, text)
+
+    async def _stream(self, prompt: str, chunk_size: int = 64) -> AsyncIterator[FakeGeminiResponse]:
+        text = self.respond(prompt)
+        pieces = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        total_delay = self._delay(text)
+        for piece in pieces:
+            await asyncio.sleep(total_delay / len(pieces))
+            yield FakeGeminiResponse(prompt, piece)
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "errors": self.errors}
+
+
+class _InMemoryCursor:
+    def __init__(self, pool: "InMemoryPool"):
+        self._pool = pool
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, query: str, params: Any = None) -> None:
+        await asyncio.sleep(self._pool.latency)
+        self._pool.record(query, params)
+
+    async def fetchone(self) -> Optional[dict]:
+        return None
+
+    async def fetchall(self) -> List[dict]:
+        return []
+
+    @property
+    def rowcount(self) -> int:
+        return 0
+
+
+class _InMemoryConnection:
+    def __init__(self, pool: "InMemoryPool"):
+        self._pool = pool
+
+    def cursor(self, *args, **kwargs) -> _InMemoryCursor:
+        return _InMemoryCursor(self._pool)
+
+    async def execute(self, query: str, params: Any = None) -> _InMemoryCursor:
+        cursor = _InMemoryCursor(self._pool)
+        await cursor.execute(query, params)
+        return cursor
+
+
+@dataclass
+class InMemoryPool:
+    """
+    Sustituto mínimo de AsyncConnectionPool: `connection()` limita la concurrencia a `max_size`
+    (como el pool real) y cada sentencia tarda `latency` segundos. Solo cuenta sentencias y filas.
+    """
+    max_size: int = 10
+    latency: float = 0.002
+    statements: int = 0
+    inserted_rows: int = 0
+    closed: bool = False
+    _slots: asyncio.Semaphore = field(init=False)
+
+    def __post_init__(self):
+        self._slots = asyncio.Semaphore(self.max_size)
+
+    def record(self, query: str, params: Any) -> None:
+        self.statements += 1
+        if query.lstrip().upper().startswith("INSERT INTO USER_RECOMMENDATIONS"):
+            self.inserted_rows += query.count("), (") + 1
+
+    @asynccontextmanager
+    async def connection(self, timeout: Optional[float] = None):
+        async with self._slots:
+            yield _InMemoryConnection(self)
+
+    async def close(self) -> None:
+        self.closed = True
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"statements": self.statements, "inserted_rows": self.inserted_rows}
+
+
+class WebhookReceiver:
+    """Receptor de TARGET_SERVICE_URL: responde 200 tras `latency` segundos y cuenta las entregas."""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.received = 0
+        self.bytes = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.latency)
+        self.received += 1
+        self.bytes += len(request.content)
+        return httpx.Response(200, json={"status": "ok"})
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+    def stats(self) -> dict:
+        return {"received": self.received, "bytes": self.bytes}
@@ -0,0 +1,11 @@
+-- migrations/0001_recommendation_cache.sql
+-- Nivel compartido de la caché de recomendaciones: lo leen y escriben todos los workers de uvicorn.
+-- UNLOGGED porque es una caché: no necesita WAL ni sobrevivir a un crash del servidor.
+CREATE UNLOGGED TABLE IF NOT EXISTS recommendation_cache (
+    cache_key   TEXT PRIMARY KEY,
+    payload     TEXT NOT NULL,
+    expires_at  TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_recommendation_cache_expires_at
+    ON recommendation_cache (expires_at);
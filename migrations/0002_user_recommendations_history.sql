@@ -0,0 +1,14 @@
+-- migrations/0002_user_recommendations_history.sql
+-- Historial de recomendaciones por usuario (GET /api/v1/recommendations/history).
+-- Paginación por keyset: WHERE user_id = $1 AND (calculation_date, id) < ($2, $3)
+--                        ORDER BY calculation_date DESC, id DESC LIMIT $4
+-- `id` desempata las filas del mismo usuario y fecha, así el cursor es estable aunque se inserten filas nuevas.
+ALTER TABLE user_recommendations
+    ADD COLUMN IF NOT EXISTS id BIGINT GENERATED ALWAYS AS IDENTITY;
+
+-- Índice con el mismo orden que la consulta: cada página es un recorrido del índice sin ordenación,
+-- cueste lo mismo la primera página que la número mil. No incluye recommendations_payload: un JSON de
+-- recomendaciones puede superar el tamaño máximo de una entrada de B-tree (~2,7 KB) y haría fallar el INSERT.
+-- CONCURRENTLY para no bloquear las escrituras mientras se construye (psql ejecuta cada sentencia fuera de transacción).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_recommendations_history
+    ON user_recommendations (user_id, calculation_date DESC, id DESC);
@@ -0,0 +1,12 @@
+-- migrations/0003_user_recommendations_idempotency.sql
+-- Reenvíos idempotentes (IDEMPOTENT_RECOMMENDATIONS_ENABLED=true): si un usuario con sesión vuelve a enviar la
+-- misma huella para la misma fecha, se devuelve la fila ya guardada en lugar de llamar otra vez al LLM.
+-- input_fingerprint es el hash exacto de los valores de la huella y del motor que generó la respuesta.
+ALTER TABLE user_recommendations
+    ADD COLUMN IF NOT EXISTS input_fingerprint TEXT;
+
+-- Sirve a la vez para la búsqueda previa y para el INSERT ... ON CONFLICT DO UPDATE (upsert).
+-- Las filas sin huella (usuarios 'No Login' y filas anteriores a esta migración) tienen NULL y, como los NULL
+-- son distintos entre sí para un índice único, no entran en conflicto: se siguen insertando como hasta ahora.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_user_recommendations_input
+    ON user_recommendations (user_id, calculation_date, input_fingerprint);
@@ -0,0 +1,118 @@
+-- migrations/0004_user_recommendations_jsonb_partitioned.sql
+-- Esquema compacto de user_recommendations (DB_JSONB_STORAGE_ENABLED=true):
+--   * Un único payload JSONB por fila. Las nueve columnas *_suggestion, que copiaban texto ya presente en el
+--     payload, se sustituyen por la vista user_recommendations_flat (expresiones sobre el JSONB, sin almacenamiento).
+--   * Particionado por rango mensual de calculation_date: los meses antiguos se archivan o eliminan con
+--     DETACH/DROP PARTITION, sin DELETE masivo ni VACUUM posterior.
+--   * Una partición DEFAULT recoge las fechas sin partición propia (fechas enviadas por el cliente fuera de rango).
+-- Requiere 0002 y 0003 y PostgreSQL 11 o posterior (partición DEFAULT e índices únicos en tablas particionadas).
+-- Idempotente (usa \gset y \if de psql): si la tabla ya está particionada no se toca.
+-- El id sale de una secuencia compartida (DEFAULT nextval) y no de una columna IDENTITY: hasta PostgreSQL 17 una
+-- tabla particionada no puede tener IDENTITY, y CREATE TABLE ... LIKE copia el DEFAULT a cada partición.
+-- El cambio va en una transacción y la tabla antigua queda como user_recommendations_legacy (bórrala cuando hayas
+-- verificado los datos). La copia bloquea las escrituras: en tablas grandes, hazlo en una ventana de mantenimiento.
+
+-- Partición del mes que empieza en `month_start`. Si la DEFAULT ya tiene filas de ese mes, se mueven a la nueva
+-- partición antes de adjuntarla (ATTACH fallaría en caso contrario, y también PARTITION OF). INCLUDING DEFAULTS
+-- copia el nextval del id: las filas insertadas directamente en la partición también reciben uno.
+CREATE OR REPLACE FUNCTION create_user_recommendations_partition(month_start DATE) RETURNS VOID
+LANGUAGE plpgsql AS $$
+DECLARE
+    range_start DATE := date_trunc('month', month_start)::date;
+    range_end   DATE := (date_trunc('month', month_start) + INTERVAL '1 month')::date;
+    part_name   TEXT := 'user_recommendations_' || to_char(range_start, 'YYYY_MM');
+BEGIN
+    IF to_regclass(part_name) IS NOT NULL THEN
+        RETURN;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE user_recommendations INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part_name);
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM user_recommendations_default WHERE calculation_date >= %L AND calculation_date < %L RETURNING *) '
+        'INSERT INTO %I SELECT * FROM moved', range_start, range_end, part_name);
+    EXECUTE format('ALTER TABLE user_recommendations ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                   part_name, range_start, range_end);
+END;
+$$;
+
+-- Particiones desde el mes actual hasta `months_ahead` meses después. La API la llama al arrancar
+-- (DB_PARTITIONS_MONTHS_AHEAD); conviene programarla también (pg_cron o cron) para procesos de larga duración.
+CREATE OR REPLACE FUNCTION ensure_user_recommendations_partitions(months_ahead INT DEFAULT 3) RETURNS VOID
+LANGUAGE plpgsql AS $$
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        PERFORM create_user_recommendations_partition((date_trunc('month', current_date) + make_interval(months => i))::date);
+    END LOOP;
+END;
+$$;
+
+SELECT COALESCE((SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('user_recommendations')), false) AS already_partitioned \gset
+\if :already_partitioned
+\echo 'user_recommendations ya está particionada: nada que migrar.'
+\else
+BEGIN;
+
+-- La de la tabla antigua (user_recommendations_id_seq, de su IDENTITY) se queda con ella
+CREATE SEQUENCE user_recommendations_row_id_seq AS BIGINT;
+
+CREATE TABLE user_recommendations_new (
+    id                      BIGINT NOT NULL DEFAULT nextval('user_recommendations_row_id_seq'),
+    user_id                 TEXT NOT NULL,
+    calculation_date        DATE NOT NULL,
+    input_fingerprint       TEXT,
+    recommendations_payload JSONB,
+    PRIMARY KEY (calculation_date, id) -- En una tabla particionada la clave primaria debe incluir la clave de partición
+) PARTITION BY RANGE (calculation_date);
+
+CREATE TABLE user_recommendations_default PARTITION OF user_recommendations_new DEFAULT;
+
+-- Los nombres de índice son únicos por esquema: los de la tabla antigua se renombran para reutilizarlos
+ALTER INDEX IF EXISTS idx_user_recommendations_history RENAME TO idx_user_recommendations_legacy_history;
+ALTER INDEX IF EXISTS uq_user_recommendations_input RENAME TO uq_user_recommendations_legacy_input;
+ALTER TABLE user_recommendations RENAME TO user_recommendations_legacy;
+ALTER TABLE user_recommendations_new RENAME TO user_recommendations;
+ALTER SEQUENCE user_recommendations_row_id_seq OWNED BY user_recommendations.id;
+
+-- Una partición por cada mes con datos, más los próximos meses
+SELECT create_user_recommendations_partition(month_start::date)
+FROM (SELECT DISTINCT date_trunc('month', calculation_date) AS month_start FROM user_recommendations_legacy) AS months;
+SELECT ensure_user_recommendations_partitions(3);
+
+-- Copia conservando los id (los cursores de /history siguen siendo válidos); el texto JSON pasa a JSONB
+INSERT INTO user_recommendations (id, user_id, calculation_date, input_fingerprint, recommendations_payload)
+SELECT id, user_id, calculation_date, input_fingerprint, recommendations_payload::jsonb
+FROM user_recommendations_legacy;
+
+SELECT setval('user_recommendations_row_id_seq', COALESCE(MAX(id), 0) + 1, false)
+FROM user_recommendations;
+
+-- Índices en la tabla padre: se crean en cada partición, también en las que se añadan después
+CREATE INDEX idx_user_recommendations_history
+    ON user_recommendations (user_id, calculation_date DESC, id DESC);
+CREATE UNIQUE INDEX uq_user_recommendations_input
+    ON user_recommendations (user_id, calculation_date, input_fingerprint);
+
+-- Columnas desglosadas del esquema antiguo, calculadas al leer
+CREATE OR REPLACE VIEW user_recommendations_flat AS
+SELECT
+    id,
+    user_id,
+    calculation_date,
+    input_fingerprint,
+    recommendations_payload,
+    recommendations_payload #>> '{global_recommendation,suggestion}'                AS global_rec_suggestion,
+    recommendations_payload #>> '{category_recommendations,transport,0,suggestion}' AS transport_rec1_suggestion,
+    recommendations_payload #>> '{category_recommendations,transport,1,suggestion}' AS transport_rec2_suggestion,
+    recommendations_payload #>> '{category_recommendations,food,0,suggestion}'      AS food_rec1_suggestion,
+    recommendations_payload #>> '{category_recommendations,food,1,suggestion}'      AS food_rec2_suggestion,
+    recommendations_payload #>> '{category_recommendations,energy,0,suggestion}'    AS energy_rec1_suggestion,
+    recommendations_payload #>> '{category_recommendations,energy,1,suggestion}'    AS energy_rec2_suggestion,
+    recommendations_payload #>> '{category_recommendations,waste,0,suggestion}'     AS waste_rec1_suggestion,
+    recommendations_payload #>> '{category_recommendations,waste,1,suggestion}'     AS waste_rec2_suggestion
+FROM user_recommendations;
+
+COMMIT;
+\endif
+
+-- Retención, p. ej. archivar y borrar un mes antiguo:
+--   ALTER TABLE user_recommendations DETACH PARTITION user_recommendations_2024_01;
+--   pg_dump -t user_recommendations_2024_01 ... && DROP TABLE user_recommendations_2024_01;
@@ -0,0 +1,30 @@
+-- migrations/0005_recommendation_jobs.sql
+-- Modo asíncrono (JOBS_ENABLED=true): POST /api/v1/recommendations/jobs guarda aquí la huella y responde 202;
+-- los workers de la API reclaman trabajos con SELECT ... FOR UPDATE SKIP LOCKED (varios procesos o réplicas
+-- pueden drenar la misma cola sin pisarse) y GET /jobs/{id} lee el estado o el resultado.
+-- Un trabajo 'running' cuyo locked_until ya pasó (worker caído o reiniciado) vuelve a reclamarse.
+CREATE TABLE IF NOT EXISTS recommendation_jobs (
+    id              UUID PRIMARY KEY,
+    user_id         TEXT NOT NULL,
+    priority        SMALLINT NOT NULL DEFAULT 0, -- Mayor primero: usuarios con sesión por delante de 'No Login'
+    status          TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'succeeded', 'failed')),
+    engine          TEXT,
+    input_payload   JSONB NOT NULL,
+    result_payload  JSONB,
+    error           TEXT,
+    attempts        INT NOT NULL DEFAULT 0,
+    created_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+    started_at      TIMESTAMPTZ,
+    finished_at     TIMESTAMPTZ,
+    locked_until    TIMESTAMPTZ
+);
+
+-- Cola pendiente en orden de reclamación; parcial para que los trabajos terminados no la engorden
+CREATE INDEX IF NOT EXISTS idx_recommendation_jobs_queue
+    ON recommendation_jobs (priority DESC, created_at)
+    WHERE status IN ('queued', 'running');
+
+-- Purga de trabajos terminados (JOBS_RETENTION_HOURS)
+CREATE INDEX IF NOT EXISTS idx_recommendation_jobs_finished
+    ON recommendation_jobs (finished_at)
+    WHERE finished_at IS NOT NULL;
@@ -0,0 +1,30 @@
+-- migrations/0006_webhook_outbox.sql
+-- Outbox transaccional del webhook (WEBHOOK_OUTBOX_ENABLED=true): la API escribe aquí el cuerpo que se enviará a
+-- TARGET_SERVICE_URL en la misma transacción que la fila de user_recommendations, y un dispatcher en segundo plano
+-- lo entrega. Si la fila se guarda, el envío queda registrado aunque el proceso se reinicie antes de hacerlo.
+-- El dispatcher reclama entradas con SELECT ... FOR UPDATE SKIP LOCKED (varias réplicas sin pisarse) y aplaza
+-- next_attempt_at mientras las envía: si cae a mitad, otra réplica las retoma cuando vence ese plazo.
+-- Tras WEBHOOK_OUTBOX_MAX_ATTEMPTS fallos la entrada pasa a 'dead' (dead letter) y se conserva para revisarla.
+CREATE TABLE IF NOT EXISTS webhook_outbox (
+    id               BIGSERIAL PRIMARY KEY,
+    payload          TEXT NOT NULL, -- JSON de RecommendationOutputSchema, byte a byte el que se envía
+    status           TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'delivered', 'dead')),
+    attempts         INT NOT NULL DEFAULT 0,
+    next_attempt_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_error       TEXT,
+    created_at       TIMESTAMPTZ NOT NULL DEFAULT now(),
+    delivered_at     TIMESTAMPTZ
+);
+
+-- Entradas pendientes en orden de reclamación; parcial para no arrastrar las entregadas
+CREATE INDEX IF NOT EXISTS idx_webhook_outbox_pending
+    ON webhook_outbox (next_attempt_at)
+    WHERE status = 'pending';
+
+-- Purga de entregas antiguas (WEBHOOK_OUTBOX_RETENTION_HOURS)
+CREATE INDEX IF NOT EXISTS idx_webhook_outbox_delivered
+    ON webhook_outbox (delivered_at)
+    WHERE status = 'delivered';
+
+-- Reintentar a mano las entradas en dead letter (p. ej. tras arreglar el receptor):
+--   UPDATE webhook_outbox SET status = 'pending', attempts = 0, next_attempt_at = now() WHERE status = 'dead';
@@ -0,0 +1,98 @@
+# tests/test_admission.py
+import asyncio
+import math
+
+import pytest
+
+from app.core.admission import AdmissionRejected, ConcurrencyGate, RateLimiter, TokenBucket
+
+
+def test_bucket_spends_and_refills_at_rate():
+    bucket = TokenBucket(rate=2.0, burst=4.0)
+    start = bucket.updated_at
+    assert bucket.try_acquire(start, cost=4) == 0.0
+    assert bucket.try_acquire(start, cost=1) == pytest.approx(0.5) # Un token tarda 1/rate segundos
+    assert bucket.try_acquire(start + 0.5, cost=1) == 0.0
+
+
+def test_bucket_never_goes_into_debt():
+    bucket = TokenBucket(rate=1.0, burst=10.0)
+    now = bucket.updated_at
+    # Un coste mayor que el burst no cabe nunca: no se admite ni gasta tokens
+    assert bucket.try_acquire(now, cost=500) == math.inf
+    assert bucket.tokens == 10.0
+    assert bucket.try_acquire(now, cost=10) == 0.0
+    assert bucket.tokens == 0.0
+
+
+def test_rate_limiter_rejects_cost_above_burst_with_retry_after():
+    limiter = RateLimiter(rate_per_minute=60, burst=10, max_keys=100)
+    limiter.check("user:a", cost=4)
+    with pytest.raises(AdmissionRejected) as rejected:
+        limiter.check("user:a", cost=500)
+    assert rejected.value.reason == "cost_above_burst"
+    # Faltan 4 tokens para llenar el cubo a 1 token/s: ese es el momento de enviar un lote de 10
+    assert rejected.value.retry_after == pytest.approx(4.0, abs=0.1)
+    limiter.check("user:a", cost=6) # El rechazo no gastó nada
+    assert limiter.stats() == {"keys": 1, "admitted": 2, "rejected": 1}
+
+
+def test_rate_limiter_keys_are_independent_and_bounded():
+    limiter = RateLimiter(rate_per_minute=1, burst=1, max_keys=2)
+    limiter.check("user:a")
+    with pytest.raises(AdmissionRejected) as rejected:
+        limiter.check("user:a")
+    assert rejected.value.reason == "rate_limited"
+    assert rejected.value.retry_after_header == "60"
+    limiter.check("user:b")
+    limiter.check("user:c") # Expulsa a "user:a" de la LRU, que vuelve con el cubo lleno
+    limiter.check("user:a")
+    assert limiter.stats()["keys"] == 2
+
+
+def test_gate_rejects_after_max_wait():
+    async def scenario():
+        gate = ConcurrencyGate(limit=1, max_queue=5, max_wait=0.05)
+        async with gate.slot():
+            with pytest.raises(AdmissionRejected) as rejected:
+                async with gate.slot():
+                    pass
+            return rejected.value, gate.stats()
+
+    rejection, stats = asyncio.run(scenario())
+    assert rejection.reason == "gemini_queue_timeout"
+    assert rejection.retry_after == 0.05
+    assert stats["rejected_timeout"] == 1
+    assert stats["waiting"] == 0
+
+
+def test_gate_rejects_immediately_when_the_queue_is_full():
+    async def scenario():
+        gate = ConcurrencyGate(limit=1, max_queue=1, max_wait=5.0)
+        entered = asyncio.Event()
+        release = asyncio.Event()
+
+        async def holder():
+            async with gate.slot():
+                entered.set()
+                await release.wait()
+
+        async def queued():
+            async with gate.slot():
+                return "turno"
+
+        holding = asyncio.create_task(holder())
+        await entered.wait()
+        waiting = asyncio.create_task(queued())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with gate.slot():
+                pass
+        release.set()
+        await holding
+        return rejected.value.reason, await waiting, gate.stats()
+
+    reason, queued_result, stats = asyncio.run(scenario())
+    assert reason == "gemini_queue_full"
+    assert queued_result == "turno" # El que esperaba en cola sí entra al liberarse el hueco
+    assert stats["in_flight"] == 0
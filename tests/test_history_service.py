@@ -0,0 +1,91 @@
+# tests/test_history_service.py
+import asyncio
+import json
+from datetime import date
+
+import pytest
+
+from app.services import history_service
+from app.services.history_service import decode_cursor, encode_cursor, etag_matches, get_recommendation_history
+
+
+class FakeHistoryTable:
+    """Filas de user_recommendations de un usuario, en el orden (calculation_date, id) descendente de la consulta real."""
+
+    def __init__(self, count: int):
+        self.rows = [
+            {"id": i, "calculation_date": date(2025, 1, i), "row_version": 1000 + i,
+             "payload": json.dumps({"notes": f"fila {i}"})}
+            for i in range(count, 0, -1)
+        ]
+        self.queries = []
+
+    async def fetch(self, user_id, limit, after=None, with_payload=True):
+        self.queries.append(with_payload)
+        rows = [row for row in self.rows if after is None or (row["calculation_date"], row["id"]) < after]
+        if not with_payload:
+            rows = [{key: row[key] for key in ("id", "calculation_date", "row_version")} for row in rows]
+        return rows[:limit]
+
+
+@pytest.fixture
+def table(monkeypatch):
+    fake = FakeHistoryTable(count=5)
+    monkeypatch.setattr(history_service, "fetch_recommendation_history", fake.fetch)
+    return fake
+
+
+def _page(**kwargs):
+    return asyncio.run(get_recommendation_history("user-1", **kwargs))
+
+
+@pytest.mark.parametrize("position", [(date(2025, 3, 9), 1), (date(1999, 12, 31), 2**53 + 7)])
+def test_cursor_round_trip(position):
+    cursor = encode_cursor(*position)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == position
+
+
+@pytest.mark.parametrize("garbage", ["", "no-es-base64!", encode_cursor(date(2025, 1, 1), 1)[:-3]])
+def test_invalid_cursor_raises_value_error(garbage):
+    with pytest.raises(ValueError):
+        decode_cursor(garbage)
+
+
+def test_pages_follow_the_cursor_until_the_end(table):
+    first = json.loads(_page(limit=2).body)
+    second = json.loads(_page(limit=2, cursor=first["next_cursor"]).body)
+    third = json.loads(_page(limit=2, cursor=second["next_cursor"]).body)
+    assert [item["id"] for item in first["items"] + second["items"] + third["items"]] == [5, 4, 3, 2, 1]
+    assert third["next_cursor"] is None
+    assert first["items"][0]["recommendations"] == {"notes": "fila 5"}
+
+
+def test_matching_etag_skips_the_payload_query(table):
+    etag = _page(limit=2).etag
+    table.queries.clear()
+    page = _page(limit=2, if_none_match=f'W/{etag}, "otro"')
+    assert page.not_modified
+    assert page.etag == etag
+    assert table.queries == [False]
+
+
+def test_etag_changes_when_a_row_xmin_changes(table):
+    before = _page(limit=2).etag
+    table.rows[1]["row_version"] += 1 # UPDATE de la fila (p. ej. un upsert con otro payload)
+    table.queries.clear()
+    page = _page(limit=2, if_none_match=before)
+    assert page.etag != before
+    assert not page.not_modified
+    assert table.queries == [False, True]
+
+
+def test_etag_depends_on_the_query_not_only_on_the_rows(table):
+    assert _page(limit=2).etag != _page(limit=3).etag
+
+
+def test_etag_matches_rules():
+    assert etag_matches('"a"', "*")
+    assert etag_matches('"a"', ' "b" , W/"a"')
+    assert not etag_matches('"a"', None)
+    assert not etag_matches('"a"', '"ab"')
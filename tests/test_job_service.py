@@ -0,0 +1,155 @@
+# tests/test_job_service.py
+import asyncio
+import json
+
+from app.api.v1.schemas.recommendation import RecommendationOutputSchema
+from app.core.admission import AdmissionRejected
+from app.services import job_service
+from app.services.job_service import JobWorkerPool
+
+FOOTPRINT = json.dumps({
+    "date": "2025-01-01", "energy": {}, "food": {}, "transport": {"carKm": 120}, "waste": {}, "result": 321.5,
+})
+
+RESULT = RecommendationOutputSchema.model_validate({
+    "global_recommendation": {"category": "Transporte", "suggestion": "Comparte coche"},
+    "category_recommendations": {},
+})
+
+# Como las salidas de error del servicio: categoría 'Error' y el motivo en las notas
+ERROR_OUTPUT = RecommendationOutputSchema.model_validate({
+    "global_recommendation": {"category": "Error", "suggestion": "No se pudieron generar recomendaciones."},
+    "category_recommendations": {},
+    "notes": "Error al contactar con Gemini",
+})
+
+
+class InMemoryJobQueue:
+    """Sustituye las funciones de recommendation_jobs que usa el worker, con la misma semántica de intentos."""
+
+    def __init__(self, *job_ids):
+        self.queued = list(job_ids)
+        self.attempts = {job_id: 0 for job_id in job_ids}
+        self.released = []
+        self.finished = {}
+
+    async def claim_job(self, lease_seconds):
+        if not self.queued:
+            return None
+        job_id = self.queued.pop(0)
+        self.attempts[job_id] += 1
+        return {"id": job_id, "user_id": "user-1", "engine": None, "input_payload": FOOTPRINT,
+                "attempts": self.attempts[job_id]}
+
+    async def release_job(self, job_id):
+        self.attempts[job_id] -= 1 # El reintento no consume intento
+        self.released.append(job_id)
+        self.queued.append(job_id)
+        return True
+
+    async def finish_job(self, job_id, result_payload, error=None):
+        self.finished[job_id] = (result_payload, error)
+        return True
+
+    async def purge_finished_jobs(self, retention_hours):
+        return 0
+
+    def install(self, monkeypatch):
+        for name in ("claim_job", "release_job", "finish_job", "purge_finished_jobs"):
+            monkeypatch.setattr(job_service, name, getattr(self, name))
+
+
+def _pool(**overrides) -> JobWorkerPool:
+    options = dict(workers=1, poll_interval=0.01, lease_seconds=60, max_attempts=3, retention_hours=24, shutdown_timeout=1.0)
+    options.update(overrides)
+    return JobWorkerPool(**options)
+
+
+async def _run_until_finished(pool: JobWorkerPool, jobs: InMemoryJobQueue, expected: int) -> None:
+    pool.start()
+    for _ in range(200):
+        if len(jobs.finished) >= expected:
+            break
+        await asyncio.sleep(0.01)
+    await pool.stop()
+
+
+def test_admission_rejection_requeues_without_spending_an_attempt(monkeypatch):
+    jobs = InMemoryJobQueue("job-1")
+    jobs.install(monkeypatch)
+    outcomes = iter([AdmissionRejected("gemini_queue_full", 0.01, "Gemini saturado"), RESULT])
+
+    async def recommend(footprint_data, user_id, engine):
+        assert footprint_data.transport.carKm == 120
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(job_service, "get_recommendations_for_footprint", recommend)
+    pool = _pool()
+    asyncio.run(_run_until_finished(pool, jobs, expected=1))
+
+    assert jobs.released == ["job-1"]
+    assert jobs.attempts["job-1"] == 1
+    assert jobs.finished["job-1"] == (RESULT.to_json(), None)
+    assert (pool.succeeded, pool.failed, pool.requeued, pool.in_flight) == (1, 0, 1, 0)
+
+
+def test_error_output_and_exceptions_fail_the_job(monkeypatch):
+    jobs = InMemoryJobQueue("errónea", "rota")
+    jobs.install(monkeypatch)
+
+    async def recommend(footprint_data, user_id, engine):
+        if jobs.attempts["rota"]: # "errónea" se reclama primero; "rota" solo tiene intentos cuando ya es su turno
+            raise RuntimeError("fallo de red")
+        return ERROR_OUTPUT
+
+    monkeypatch.setattr(job_service, "get_recommendations_for_footprint", recommend)
+    pool = _pool()
+    asyncio.run(_run_until_finished(pool, jobs, expected=2))
+
+    assert jobs.finished["rota"] == (None, "An internal server error occurred: fallo de red")
+    assert jobs.finished["errónea"] == (None, "Error al contactar con Gemini")
+    assert (pool.succeeded, pool.failed, pool.requeued) == (0, 2, 0)
+
+
+def test_job_over_max_attempts_is_abandoned_without_running(monkeypatch):
+    jobs = InMemoryJobQueue("envenenado")
+    jobs.attempts["envenenado"] = 3 # Tres workers cayeron con él: este es el cuarto intento
+    jobs.install(monkeypatch)
+
+    async def recommend(*args):
+        raise AssertionError("no debe ejecutarse")
+
+    monkeypatch.setattr(job_service, "get_recommendations_for_footprint", recommend)
+    asyncio.run(_run_until_finished(_pool(max_attempts=3), jobs, expected=1))
+    assert jobs.finished["envenenado"] == (None, "Abandonado tras 3 intentos interrumpidos.")
+
+
+def test_shutdown_returns_the_running_job_to_the_queue(monkeypatch):
+    jobs = InMemoryJobQueue("largo")
+    jobs.install(monkeypatch)
+    started = asyncio.Event()
+
+    async def recommend(*args):
+        started.set()
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(job_service, "get_recommendations_for_footprint", recommend)
+
+    async def scenario():
+        pool = _pool(shutdown_timeout=0.01)
+        pool.start()
+        await started.wait()
+        await pool.stop()
+        return pool
+
+    pool = asyncio.run(scenario())
+    assert jobs.released == ["largo"]
+    assert jobs.finished == {}
+    assert (pool.requeued, pool.in_flight, pool.running) == (1, 0, False)
+
+
+def test_priority_favours_signed_in_users():
+    assert job_service.job_priority("user-1") > job_service.job_priority(job_service.ANONYMOUS_USER_ID)
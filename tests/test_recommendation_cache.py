@@ -0,0 +1,87 @@
+# tests/test_recommendation_cache.py
+import asyncio
+
+from app.api.v1.schemas.recommendation import RecommendationOutputSchema
+from app.services import recommendation_cache as cache_module
+from app.services.recommendation_cache import LocalLRUCache, RecommendationCache
+
+SAMPLE = RecommendationOutputSchema.model_validate({
+    "global_recommendation": {"category": "General", "suggestion": "Apaga lo que no uses"},
+    "category_recommendations": {},
+})
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    lru = LocalLRUCache(max_entries=2, max_bytes=1_000, ttl_seconds=60)
+    lru.set("a", b"1")
+    lru.set("b", b"2")
+    assert lru.get("a") == b"1" # "a" pasa a ser la más reciente
+    lru.set("c", b"3")
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c")) == (b"1", b"3")
+    assert lru.evictions == 1
+
+
+def test_byte_budget_evicts_and_oversized_payloads_are_not_stored():
+    lru = LocalLRUCache(max_entries=100, max_bytes=10, ttl_seconds=60)
+    lru.set("a", b"xxxx")
+    lru.set("b", b"yyyy")
+    lru.set("c", b"zzzz") # 12 bytes > 10: sale "a"
+    assert len(lru) == 2 and lru.size_bytes == 8
+    assert lru.get("a") is None
+
+    lru.set("grande", b"w" * 11)
+    assert lru.get("grande") is None
+    assert len(lru) == 2 # La entrada que no cabe no vacía la caché
+
+    lru.set("b", b"yy") # Reemplazar una clave descuenta su tamaño anterior
+    assert lru.size_bytes == 6
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    lru = LocalLRUCache(max_entries=10, max_bytes=100, ttl_seconds=5)
+    lru.set("k", b"v")
+    now[0] += 4.9
+    assert lru.get("k") == b"v"
+    now[0] += 0.1
+    assert lru.get("k") is None
+    assert (lru.expirations, len(lru), lru.size_bytes) == (1, 0, 0)
+
+
+def test_cache_stores_bytes_and_hands_out_independent_objects():
+    cache = RecommendationCache(LocalLRUCache(10, 10_000, 60), shared_enabled=False, ttl_seconds=60, purge_every=0)
+
+    async def scenario():
+        await cache.set("k", SAMPLE)
+        first = await cache.get("k")
+        first.add_note("solo para esta petición")
+        return first, await cache.get("k"), await cache.get("otra")
+
+    first, second, missing = asyncio.run(scenario())
+    assert isinstance(cache.local.get("k"), bytes)
+    assert cache.local.get("k") == SAMPLE.to_json()
+    assert first is not second
+    assert second.notes is None
+    assert missing is None
+    assert (cache.local_hits, cache.misses) == (2, 1)
+
+
+def test_shared_hit_is_copied_to_the_local_level(monkeypatch):
+    lookups = []
+
+    async def fetch(key):
+        lookups.append(key)
+        return SAMPLE.to_json().decode()
+
+    monkeypatch.setattr(cache_module, "fetch_cached_recommendation", fetch)
+    cache = RecommendationCache(LocalLRUCache(10, 10_000, 60), shared_enabled=True, ttl_seconds=60, purge_every=0)
+
+    async def scenario():
+        return await cache.get("k"), await cache.get("k")
+
+    shared, local = asyncio.run(scenario())
+    assert shared == local == SAMPLE
+    assert lookups == ["k"]
+    assert cache.stats()["shared_hits"] == 1 and cache.stats()["local_hits"] == 1
@@ -0,0 +1,78 @@
+# tests/test_recommendation_schema.py
+import json
+
+from app.api.v1.schemas.recommendation import (
+    SUGGESTIONS_PER_CATEGORY,
+    CategorySpecificSuggestion,
+    RecommendationOutputSchema,
+    RecommendationsByCategory,
+    normalize_category_suggestions,
+)
+
+
+def test_short_list_is_padded_with_numbered_defaults():
+    result = normalize_category_suggestions("food", [{"suggestion": "Menos carne"}])
+    assert len(result) == SUGGESTIONS_PER_CATEGORY
+    assert result[0] == {"suggestion": "Menos carne"}
+    assert result[1]["suggestion"].endswith("for food (slot 2).")
+
+
+def test_long_list_is_truncated_and_invalid_items_are_skipped():
+    items = ["texto suelto", {"text": "sin clave"}, {"suggestion": 1}, {"suggestion": "b"}, {"suggestion": "c"}]
+    assert normalize_category_suggestions("waste", items) == [{"suggestion": "1"}, {"suggestion": "b"}]
+
+
+def test_non_list_becomes_only_defaults():
+    result = normalize_category_suggestions("energy", {"suggestion": "no es una lista"})
+    assert [item["suggestion"] for item in result] == [
+        "No specific suggestion provided by AI for energy (slot 1).",
+        "No specific suggestion provided by AI for energy (slot 2).",
+    ]
+
+
+def test_model_instances_are_kept_as_they_are():
+    kept = CategorySpecificSuggestion(suggestion="ya validada")
+    assert normalize_category_suggestions("transport", [kept])[0] is kept
+
+
+def test_before_validator_fills_missing_categories():
+    parsed = RecommendationsByCategory.model_validate(
+        {"transport": [{"suggestion": "t1"}, {"suggestion": "t2"}, {"suggestion": "t3"}], "food": None}
+    )
+    for category in RecommendationsByCategory.model_fields:
+        assert len(getattr(parsed, category)) == SUGGESTIONS_PER_CATEGORY
+    assert [item.suggestion for item in parsed.transport] == ["t1", "t2"]
+    assert parsed.waste[0].suggestion.startswith("No specific suggestion")
+
+
+def test_before_validator_runs_when_validating_gemini_json():
+    raw = json.dumps({
+        "global_recommendation": {"category": "General", "suggestion": "g"},
+        "category_recommendations": {"energy": [{"suggestion": "e"}]},
+    })
+    output = RecommendationOutputSchema.model_validate_json(raw)
+    assert output.category_recommendations.energy[0].suggestion == "e"
+    assert len(output.category_recommendations.transport) == SUGGESTIONS_PER_CATEGORY
+
+
+def test_from_json_reuses_the_text_only_when_asked():
+    canonical = RecommendationOutputSchema.model_validate_json(json.dumps({
+        "global_recommendation": {"category": "General", "suggestion": "g"},
+        "category_recommendations": {},
+    })).to_json()
+    # Como lo devolvería Postgres desde una columna JSONB: mismas claves, otro orden y otros espacios
+    reordered = json.dumps(dict(reversed(list(json.loads(canonical).items()))), indent=1)
+
+    assert RecommendationOutputSchema.from_json(canonical).to_json() is canonical
+    assert RecommendationOutputSchema.from_json(reordered).to_json() == reordered.encode()
+    assert RecommendationOutputSchema.from_json(reordered, reuse_text=False).to_json() == canonical
+
+
+def test_add_note_invalidates_the_cached_serialization():
+    output = RecommendationOutputSchema.from_json(RecommendationOutputSchema.model_validate({
+        "global_recommendation": {"category": "General", "suggestion": "g"},
+        "category_recommendations": {},
+    }).to_json())
+    output.add_note("primera")
+    output.add_note("segunda")
+    assert json.loads(output.to_json())["notes"] == "primera | segunda"
@@ -0,0 +1,106 @@
+# tests/test_resilience.py
+import asyncio
+
+import pytest
+
+from app.core import resilience
+from app.core.resilience import CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(resilience.time, "monotonic", fake)
+    return fake
+
+
+def _opened_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+
+def test_opens_after_threshold_and_fails_fast(clock):
+    breaker = _opened_breaker()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 29.0
+    assert not breaker.allow_request()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_half_open_admits_a_single_probe(clock):
+    breaker = _opened_breaker()
+    clock.now += 30.0
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.probe_token() is not None
+    assert not breaker.allow_request() # Segunda llamada mientras la prueba sigue en curso
+
+
+def test_probe_outcome_closes_or_reopens(clock):
+    breaker = _opened_breaker()
+    clock.now += 30.0
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.times_opened == 2
+
+    clock.now += 30.0
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.probe_token() is None
+
+
+def test_cancelled_probe_is_released_without_counting_a_failure(clock):
+    breaker = _opened_breaker()
+    clock.now += 30.0
+
+    async def call_site():
+        # Mismo patrón que gemini_client: la prueba se libera en finally, pase lo que pase
+        assert breaker.allow_request()
+        probe = breaker.probe_token()
+        try:
+            await asyncio.sleep(10)
+            breaker.record_success()
+        finally:
+            breaker.release_probe(probe)
+
+    async def scenario():
+        task = asyncio.create_task(call_site())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.consecutive_failures == 2 # La cancelación no suma un fallo
+    assert breaker.allow_request() # La siguiente llamada hace de prueba sin esperar
+
+
+def test_stale_release_does_not_free_a_newer_probe(clock):
+    breaker = _opened_breaker()
+    clock.now += 30.0
+    assert breaker.allow_request()
+    stale = breaker.probe_token()
+    clock.now += 30.0 # La primera prueba se colgó: pasado reset_timeout se admite otra
+    assert breaker.allow_request()
+    breaker.release_probe(stale)
+    assert not breaker.allow_request()
+
+
+def test_backoff_delays_stay_within_bounds():
+    for attempt in range(8):
+        step = min(5.0, 0.1 * 2 ** attempt)
+        assert 0.0 <= resilience.backoff_delay(attempt, 0.1, 5.0) <= step
+        assert step / 2 <= resilience.equal_jitter_backoff_delay(attempt, 0.1, 5.0) <= step
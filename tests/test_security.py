@@ -0,0 +1,136 @@
+# tests/test_security.py
+import asyncio
+import base64
+import json
+import time
+
+import pytest
+from jose import jwt
+
+from app.core import security
+from app.core.security import JWKSKeyStore, TokenVerificationError, VerifiedTokenCache, verify_token
+
+SECRETS = {"k1": "clave-de-firma-uno-32-bytes-min!!", "k2": "clave-de-firma-dos-32-bytes-min!!"}
+
+
+def _jwk(kid: str) -> dict:
+    secret = base64.urlsafe_b64encode(SECRETS[kid].encode()).decode().rstrip("=")
+    return {"kty": "oct", "kid": kid, "alg": "HS256", "use": "sig", "k": secret}
+
+
+def _token(kid: str, exp: float, sub: str = "user-1") -> str:
+    return jwt.encode({"sub": sub, "exp": int(exp)}, SECRETS[kid], algorithm="HS256", headers={"kid": kid})
+
+
+class Env:
+    """JWKS en un fichero que el test puede reescribir (rotación), con el store y la caché de tokens propios."""
+
+    def __init__(self, path, monkeypatch):
+        self.path = path
+        self.store = JWKSKeyStore(url=None, file=str(path), algorithms=("HS256",),
+                                  refresh_interval=600, min_refresh_interval=30)
+        self.cache = VerifiedTokenCache(max_entries=100)
+        self.verifications = 0
+        original = security._verify_signature_and_claims
+
+        async def counting(token):
+            self.verifications += 1
+            return await original(token)
+
+        monkeypatch.setattr(security, "jwks_store", self.store)
+        monkeypatch.setattr(security, "verified_token_cache", self.cache)
+        monkeypatch.setattr(security, "_verify_signature_and_claims", counting)
+        monkeypatch.setattr(security.settings, "JWT_AUDIENCE", None)
+        monkeypatch.setattr(security.settings, "JWT_ISSUER", None)
+        monkeypatch.setattr(security.settings, "JWT_LEEWAY_SECONDS", 0)
+
+    def elapse(self, seconds: float) -> None:
+        """Hace que la última recarga del JWKS parezca `seconds` segundos más antigua."""
+        self.store._last_attempt -= seconds
+
+    def publish(self, *kids: str) -> None:
+        self.path.write_text(json.dumps({"keys": [_jwk(kid) for kid in kids]}), encoding="utf-8")
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    environment = Env(tmp_path / "jwks.json", monkeypatch)
+    environment.publish("k1")
+    assert asyncio.run(environment.store.refresh())
+    return environment
+
+
+def test_verified_token_is_cached_until_its_exp(env, monkeypatch):
+    exp = int(time.time()) + 120 # El claim exp es un entero: la entrada caduca en ese segundo exacto
+    token = _token("k1", exp)
+    assert asyncio.run(verify_token(token))["sub"] == "user-1"
+    assert asyncio.run(verify_token(token))["sub"] == "user-1"
+    assert env.verifications == 1
+
+    monkeypatch.setattr(security.time, "time", lambda: exp - 0.5)
+    assert env.cache.get(env.cache.token_key(token)) is not None
+    monkeypatch.setattr(security.time, "time", lambda: exp)
+    assert env.cache.get(env.cache.token_key(token)) is None # Caduca justo en el exp del token
+    assert len(env.cache) == 0
+
+
+def test_token_without_exp_is_not_cached(env):
+    token = jwt.encode({"sub": "user-1"}, SECRETS["k1"], algorithm="HS256", headers={"kid": "k1"})
+    asyncio.run(verify_token(token))
+    asyncio.run(verify_token(token))
+    assert env.verifications == 2
+
+
+def test_unknown_kid_forces_a_jwks_refresh(env):
+    env.publish("k1", "k2") # Rotación: el emisor publica k2 y empieza a firmar con ella
+    env.elapse(30)
+    claims = asyncio.run(verify_token(_token("k2", time.time() + 60, sub="user-2")))
+    assert claims["sub"] == "user-2"
+    assert env.store.refreshes == 2
+
+
+def test_forced_refreshes_are_rate_limited(env):
+    env.publish("k1", "k2")
+    env.elapse(5) # Menos que min_refresh_interval desde la carga inicial
+    with pytest.raises(TokenVerificationError, match="clave desconocida"):
+        asyncio.run(verify_token(_token("k2", time.time() + 60)))
+    assert env.store.refreshes == 1
+
+    env.elapse(25)
+    assert asyncio.run(verify_token(_token("k2", time.time() + 60)))["sub"] == "user-1"
+    assert env.store.refreshes == 2
+
+
+def test_retired_key_clears_the_token_cache(env):
+    token = _token("k1", time.time() + 60)
+    asyncio.run(verify_token(token))
+    assert len(env.cache) == 1
+
+    env.publish("k2")
+    env.elapse(30)
+    assert asyncio.run(env.store.refresh())
+    assert len(env.cache) == 0
+    with pytest.raises(TokenVerificationError):
+        asyncio.run(verify_token(token))
+
+
+def test_failed_refresh_keeps_the_previous_keys(env):
+    env.path.write_text("no es json", encoding="utf-8")
+    env.elapse(30)
+    assert not asyncio.run(env.store.refresh())
+    assert env.store.refresh_failures == 1
+    assert asyncio.run(verify_token(_token("k1", time.time() + 60)))["sub"] == "user-1"
+
+
+def test_expired_and_tampered_tokens_are_rejected(env):
+    with pytest.raises(TokenVerificationError, match="expirado"):
+        asyncio.run(verify_token(_token("k1", time.time() - 10)))
+    header, payload, signature = _token("k1", time.time() + 60).split(".")
+    with pytest.raises(TokenVerificationError, match="Firma"):
+        asyncio.run(verify_token(f"{header}.{payload}.{signature[::-1]}"))
+
+
+@pytest.mark.parametrize("policy, rejected", [("reject", True), ("anonymous", False), (" Anonymous ", False), ("anonimo", True)])
+def test_unverifiable_tokens_policy_fails_closed(monkeypatch, policy, rejected):
+    monkeypatch.setattr(security.settings, "JWT_UNVERIFIABLE_TOKENS", policy)
+    assert security.tokens_rejected_without_jwks() is rejected
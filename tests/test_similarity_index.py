@@ -0,0 +1,46 @@
+# tests/test_similarity_index.py
+from app.services.similarity_index import retemplate
+
+
+def test_substitutes_unique_large_value_quoted_once():
+    payload = '{"suggestion": "Tus 120 km semanales en coche"}'
+    assert retemplate(payload, [120.0, 3.0], [132.0, 3.0]) == '{"suggestion": "Tus 132 km semanales en coche"}'
+
+
+def test_keeps_decimal_separator_of_the_text():
+    assert retemplate("Consumes 12,5 kWh", [12.5], [13.5]) == "Consumes 13,5 kWh"
+
+
+def test_unchanged_values_are_left_alone():
+    payload = "Paso 2: reduce de 2 a 1 vuelos"
+    assert retemplate(payload, [2.0, 0.0], [2.0, 0.0]) == payload
+
+
+def test_changed_value_not_quoted_keeps_payload():
+    payload = "Tus 120 km semanales"
+    assert retemplate(payload, [120.0, 40.0], [120.0, 44.0]) == payload
+
+
+def test_small_values_colliding_with_targets_steps_and_savings_conflict():
+    # "de 2 a 1" (objetivo), "2 t" (ahorro) y "Paso 2" no son el hábito 2 -> 3: no se puede reescribir
+    payload = "Reduce de 2 a 1 vuelos; ahorra 2 t CO2. Paso 2: usa 0 bolsas"
+    assert retemplate(payload, [2.0, 0.0, 5.0], [3.0, 0.1, 5.0]) is None
+
+
+def test_zero_quoted_conflicts():
+    assert retemplate("Usa 0 bolsas de plástico", [0.0], [0.1]) is None
+
+
+def test_large_value_quoted_twice_conflicts():
+    # El mismo número como valor del usuario y como cifra derivada: no se sabe cuál es cuál
+    payload = "Recorres 150 km; con el tren ahorrarías 150 kg de CO2"
+    assert retemplate(payload, [150.0], [160.0]) is None
+
+
+def test_value_shared_by_two_habits_that_now_differ_conflicts():
+    assert retemplate("Tus 20 comidas", [20.0, 20.0], [22.0, 20.0]) is None
+
+
+def test_numbers_inside_words_ranges_and_percentages_are_not_values():
+    payload = "Reduce un 50% el CO2 en 1-2 semanas; tus 120 km"
+    assert retemplate(payload, [50.0, 2.0, 120.0], [55.0, 3.0, 130.0]) == "Reduce un 50% el CO2 en 1-2 semanas; tus 130 km"
@@ -0,0 +1,98 @@
+# tests/test_singleflight.py
+import asyncio
+
+import pytest
+
+from app.core.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "respuesta"
+
+        results = await asyncio.gather(*(flight.do("k", fetch) for _ in range(5)))
+        return results, calls, flight.stats()
+
+    results, calls, stats = asyncio.run(scenario())
+    assert results == ["respuesta"] * 5
+    assert calls == 1
+    assert stats == {"executions": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_cancelling_one_waiter_does_not_affect_the_others():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return 42
+
+        first = asyncio.create_task(flight.do("k", fetch))
+        second = asyncio.create_task(flight.do("k", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == 42
+
+
+def test_cancelled_last_waiter_cancels_the_shared_task():
+    async def scenario():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        upstream_cancelled = asyncio.Event()
+
+        async def fetch():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                upstream_cancelled.set()
+                raise
+            return "no llega"
+
+        waiter = asyncio.create_task(flight.do("k", fetch))
+        await started.wait()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.wait_for(upstream_cancelled.wait(), timeout=1)
+        in_flight_after_cancel = flight.stats()["in_flight"]
+
+        async def fresh():
+            return "nueva"
+
+        # La clave quedó libre: una llamada nueva ejecuta otra vez en lugar de engancharse a la cancelada
+        return in_flight_after_cancel, await flight.do("k", fresh), flight.executions
+
+    in_flight, result, executions = asyncio.run(scenario())
+    assert in_flight == 0
+    assert result == "nueva"
+    assert executions == 2
+
+
+def test_exception_reaches_every_waiter():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream caído")
+
+        return await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert len(results) == 3
+    assert all(isinstance(result, ValueError) for result in results)
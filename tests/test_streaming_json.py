@@ -0,0 +1,69 @@
+# tests/test_streaming_json.py
+import json
+
+import pytest
+
+from app.core.streaming_json import IncrementalJSONScanner
+
+TARGETS = [("category_recommendations", "transport"), ("category_recommendations", "diet")]
+
+DOCUMENT = json.dumps(
+    {
+        "global_recommendation": {"category": "General", "suggestion": "Usa {llaves} y [corchetes] \"citados\""},
+        "category_recommendations": {
+            "transport": [{"category": "Transporte", "suggestion": "Bici, no coche: ahorra \\ y ,"}],
+            "diet": [{"category": "Dieta", "suggestion": "Menos carne"}, {"category": "Dieta", "suggestion": "Local"}],
+        },
+    },
+    ensure_ascii=False,
+)
+
+
+def _feed_in_chunks(text: str, size: int):
+    scanner = IncrementalJSONScanner(TARGETS)
+    seen = []
+    for start in range(0, len(text), size):
+        seen.extend(scanner.feed(text[start:start + size]))
+    return scanner, seen
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, len(DOCUMENT)])
+def test_targets_are_emitted_whatever_the_chunking(size):
+    scanner, seen = _feed_in_chunks(DOCUMENT, size)
+    expected = json.loads(DOCUMENT)["category_recommendations"]
+    assert seen == [
+        (("category_recommendations", "transport"), expected["transport"]),
+        (("category_recommendations", "diet"), expected["diet"]),
+    ]
+    assert scanner.done
+    assert scanner.text == DOCUMENT
+
+
+def test_key_split_across_chunks_is_resolved():
+    scanner = IncrementalJSONScanner([("category_recommendations", "transport")])
+    assert scanner.feed('{"category_recomm') == []
+    assert scanner.feed('endations": {"trans') == []
+    assert scanner.feed('port": [') == []
+    assert scanner.feed('{"suggestion": "a"}') == []
+    assert scanner.feed("]") == [(("category_recommendations", "transport"), [{"suggestion": "a"}])]
+
+
+def test_escaped_quote_split_across_chunks_stays_inside_the_string():
+    scanner = IncrementalJSONScanner([("diet",)])
+    # La barra invertida llega al final de un fragmento y la comilla escapada al principio del siguiente
+    assert scanner.feed('{"diet": [{"suggestion": "di \\') == []
+    assert scanner.feed('"no\\" ] }"}') == []
+    assert scanner.feed("]}") == [(("diet",), [{"suggestion": 'di "no" ] }'}])]
+    assert scanner.done
+
+
+def test_text_around_the_root_object_is_ignored():
+    scanner = IncrementalJSONScanner([("diet",)])
+    assert scanner.feed('```json\n{"diet": {"a": 1}') == [(("diet",), {"a": 1})]
+    assert scanner.feed('}\n```\n{"diet": {"b": 2}}') == []
+    assert scanner.done
+
+
+def test_array_positions_form_part_of_the_path():
+    scanner = IncrementalJSONScanner([("items", 1)])
+    assert scanner.feed('{"items": [{"n": 0}, {"n": 1}, {"n": 2}]}') == [(("items", 1), {"n": 1})]
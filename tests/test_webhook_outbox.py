@@ -0,0 +1,91 @@
+# tests/test_webhook_outbox.py
+import asyncio
+
+import pytest
+
+from app.services import webhook_outbox as outbox_module
+from app.services.webhook_outbox import WebhookOutboxDispatcher
+
+
+def _dispatcher(max_attempts: int = 5, concurrency: int = 4) -> WebhookOutboxDispatcher:
+    return WebhookOutboxDispatcher(
+        batch_size=50, concurrency=concurrency, poll_interval=0.01, lease_seconds=30,
+        max_attempts=max_attempts, backoff_base=1.0, backoff_max=20.0, retention_hours=24,
+    )
+
+
+def _entry(entry_id: int, attempts: int = 0) -> dict:
+    return {"id": entry_id, "payload": f'{{"entrega":{entry_id}}}', "attempts": attempts}
+
+
+@pytest.fixture
+def receiver(monkeypatch):
+    """Receptor del webhook: responde según el cuerpo y registra lo que llega al outbox en la BD."""
+    state = {"fail": set(), "sent": [], "delivered": [], "failed": []}
+
+    async def send_webhook(content: bytes):
+        state["sent"].append(content)
+        await asyncio.sleep(0)
+        return "HTTP 503" if content in state["fail"] else None
+
+    async def mark_delivered(ids):
+        state["delivered"].extend(ids)
+        return True
+
+    async def mark_failed(failures):
+        state["failed"].extend(failures)
+        return True
+
+    monkeypatch.setattr(outbox_module, "send_webhook", send_webhook)
+    monkeypatch.setattr(outbox_module, "mark_outbox_delivered", mark_delivered)
+    monkeypatch.setattr(outbox_module, "mark_outbox_failed", mark_failed)
+    return state
+
+
+def test_successes_and_failures_are_recorded_separately(receiver):
+    receiver["fail"].add(b'{"entrega":2}')
+    dispatcher = _dispatcher()
+    asyncio.run(dispatcher._deliver([_entry(1), _entry(2), _entry(3)]))
+
+    assert sorted(receiver["sent"]) == [b'{"entrega":1}', b'{"entrega":2}', b'{"entrega":3}']
+    assert receiver["delivered"] == [1, 3]
+    [(entry_id, delay, error)] = receiver["failed"]
+    assert (entry_id, error) == (2, "HTTP 503")
+    assert 1.0 <= delay <= 2.0 # Primer reintento: d = base * 2^1 = 2, equal jitter en [d/2, d]
+    assert dispatcher.stats()["delivered"] == 2 and dispatcher.stats()["retried"] == 1
+
+
+@pytest.mark.parametrize("previous_attempts, low, high", [(1, 2.0, 4.0), (3, 8.0, 16.0), (6, 10.0, 20.0)])
+def test_retry_delay_grows_and_is_capped(receiver, previous_attempts, low, high):
+    receiver["fail"].add(b'{"entrega":7}')
+    asyncio.run(_dispatcher(max_attempts=100)._deliver([_entry(7, attempts=previous_attempts)]))
+    [(_, delay, _)] = receiver["failed"]
+    assert low <= delay <= high
+
+
+def test_last_attempt_goes_to_dead_letter(receiver):
+    receiver["fail"].update({b'{"entrega":8}', b'{"entrega":9}'})
+    dispatcher = _dispatcher(max_attempts=3)
+    asyncio.run(dispatcher._deliver([_entry(8, attempts=2), _entry(9, attempts=1)]))
+
+    dead, retried = receiver["failed"]
+    assert dead == (8, None, "HTTP 503") # Sin retraso: mark_outbox_failed la deja en dead letter
+    assert retried[0] == 9 and retried[1] is not None
+    assert (dispatcher.dead, dispatcher.retried, dispatcher.delivered) == (1, 1, 0)
+
+
+def test_concurrent_sends_stay_within_the_limit(monkeypatch, receiver):
+    peak = 0
+    dispatcher = _dispatcher(concurrency=2)
+
+    async def slow_send(content):
+        nonlocal peak
+        peak = max(peak, dispatcher.in_flight)
+        await asyncio.sleep(0.01)
+        return None
+
+    monkeypatch.setattr(outbox_module, "send_webhook", slow_send)
+    asyncio.run(dispatcher._deliver([_entry(i) for i in range(6)]))
+    assert peak == 2
+    assert dispatcher.in_flight == 0
+    assert receiver["delivered"] == list(range(6))
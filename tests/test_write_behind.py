@@ -0,0 +1,90 @@
+# tests/test_write_behind.py
+import asyncio
+from datetime import date
+
+from app.api.v1.schemas.recommendation import FullRecommendation, RecommendationOutputSchema, RecommendationsByCategory
+from app.db import write_behind
+from app.db.write_behind import WriteBehindQueue
+
+
+def _output(text: str) -> RecommendationOutputSchema:
+    return RecommendationOutputSchema(
+        global_recommendation=FullRecommendation(category="General", suggestion=text),
+        category_recommendations=RecommendationsByCategory(),
+    )
+
+
+class RecordingInserter:
+    """Sustituto de insert_recommendations_batch: falla todo lote de más de una fila y las filas de `bad_users`."""
+
+    def __init__(self, bad_users):
+        self.bad_users = set(bad_users)
+        self.calls = []
+
+    async def __call__(self, rows):
+        self.calls.append([row[0] for row in rows])
+        return len(rows) == 1 and rows[0][0] not in self.bad_users
+
+
+def test_failed_batch_is_retried_row_by_row(monkeypatch):
+    inserter = RecordingInserter(bad_users={"u2"})
+    monkeypatch.setattr(write_behind, "insert_recommendations_batch", inserter)
+
+    async def scenario():
+        queue = WriteBehindQueue(max_size=10, batch_size=3, flush_interval=5.0, enqueue_timeout=0.1)
+        queue.start()
+        for user in ("u1", "u2", "u3"):
+            assert await queue.enqueue(user, date(2025, 1, 1), _output(f"para {user}"))
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(scenario())
+    assert inserter.calls == [["u1", "u2", "u3"], ["u1"], ["u2"], ["u3"]]
+    assert stats["flushed_rows"] == 2
+    assert stats["failed_rows"] == 1
+    assert stats["batches"] == 1
+
+
+def test_rows_are_serialized_at_enqueue_time(monkeypatch):
+    stored = []
+
+    async def insert(rows):
+        stored.extend(rows)
+        return True
+
+    monkeypatch.setattr(write_behind, "insert_recommendations_batch", insert)
+
+    async def scenario():
+        queue = WriteBehindQueue(max_size=10, batch_size=10, flush_interval=0.01, enqueue_timeout=0.1)
+        queue.start()
+        output = _output("original")
+        await queue.enqueue("u1", date(2025, 1, 1), output)
+        output.add_note("añadida después de encolar")
+        await queue.stop()
+
+    asyncio.run(scenario())
+    assert len(stored) == 1
+    assert "original" in stored[0][2] # Tercera columna: el JSON del payload
+    assert "añadida" not in stored[0][2]
+
+
+def test_enqueue_refuses_when_not_running_or_full(monkeypatch):
+    async def never_done(rows):
+        await asyncio.sleep(10)
+        return True
+
+    monkeypatch.setattr(write_behind, "insert_recommendations_batch", never_done)
+
+    async def scenario():
+        queue = WriteBehindQueue(max_size=1, batch_size=1, flush_interval=0.01, enqueue_timeout=0.01)
+        not_running = await queue.enqueue("u0", date(2025, 1, 1), _output("x"))
+        queue.start()
+        results = [await queue.enqueue(f"u{i}", date(2025, 1, 1), _output("x")) for i in range(3)]
+        queue._task.cancel()
+        await asyncio.gather(queue._task, return_exceptions=True)
+        return not_running, results, queue.stats()
+
+    not_running, results, stats = asyncio.run(scenario())
+    assert not_running is False
+    assert results[-1] is False # El flusher está ocupado y la cola de una plaza ya está llena
+    assert stats["rejected_rows"] >= 1